@@ -25,6 +25,7 @@
 #
 
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.admin.models import LogEntry, ADDITION, CHANGE
 from django.http import HttpResponseRedirect
 from django import template
 from django.core.exceptions import PermissionDenied
@@ -43,9 +44,11 @@ from django.core.urlresolvers import reverse
 from powerdns_manager.forms import ZoneTypeSelectionForm
 from powerdns_manager.forms import TtlSelectionForm
 from powerdns_manager.forms import ClonedZoneDomainForm
-from powerdns_manager.utils import generate_serial
 from powerdns_manager.utils import generate_api_key
-from powerdns_manager.utils import interchange_domain
+from powerdns_manager.utils import set_zone_ttl
+from powerdns_manager.utils import set_zone_type
+from powerdns_manager.utils import update_zone_serials
+from powerdns_manager.utils import clone_zones
 
 
 
@@ -59,6 +62,38 @@ from powerdns_manager.utils import interchange_domain
 #test_action.short_description = "Test Action"
 
 
+def _log_actions_bulk(modeladmin, request, objects, action_flag, message=''):
+    """Logs an action on each one of ``objects`` using a single bulk INSERT.
+    
+    This is the equivalent of calling ``modeladmin.log_addition()`` or
+    ``modeladmin.log_change()`` for each object.
+    
+    """
+    content_type_id = ContentType.objects.get_for_model(modeladmin.model).pk
+    LogEntry.objects.bulk_create([
+        LogEntry(
+            user_id = request.user.pk,
+            content_type_id = content_type_id,
+            object_id = force_unicode(obj.pk),
+            object_repr = force_unicode(obj)[:200],
+            action_flag = action_flag,
+            change_message = message
+        ) for obj in objects
+    ])
+
+
+def _report_failed_zones(request, domain_ids):
+    """Reports the zones whose serial could not be updated because the
+    content of their SOA record is malformed. See ``update_zone_serials()``.
+    
+    """
+    if not domain_ids:
+        return
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    origins = Domain.objects.filter(id__in=domain_ids).values_list('name', flat=True)
+    messages.error(request, 'The serial of the following zones could not be updated, because their SOA record is malformed: %s' % ', '.join(sorted(origins)))
+
+
 def reset_api_key(modeladmin, request, queryset):
     DynamicZone = cache.get_model('powerdns_manager', 'DynamicZone')
     n = queryset.count()
@@ -105,16 +140,17 @@ def set_domain_type_bulk(modeladmin, request, queryset):
     #if request.method == 'POST':
     if request.POST.get('post'):
         domain_type = request.POST.get('domaintype')
-        n = queryset.count()
+        domain_ids = list(queryset.values_list('id', flat=True))
+        n = len(domain_ids)
         
         if n and domain_type:
-            for obj in queryset:
-                obj.type = domain_type
-                obj.update_serial()
-                obj.save()
-                obj_display = force_unicode(obj)
-                modeladmin.log_change(request, obj, obj_display)
+            # Set the type of all the selected zones and update their serials.
+            failed = []
+            set_zone_type(domain_ids, domain_type, failed)
+            _log_actions_bulk(modeladmin, request, queryset, CHANGE,
+                'Set the zone type to %s.' % domain_type)
             messages.info(request, 'Successfully updated %d domains.' % n)
+            _report_failed_zones(request, failed)
         # Return None to display the change list page again.
         return None
     
@@ -151,7 +187,6 @@ def set_ttl_bulk(modeladmin, request, queryset):
     app_label = opts.app_label
     
     Domain = cache.get_model('powerdns_manager', 'Domain')
-    Record = cache.get_model('powerdns_manager', 'Record')
     
     perm_domain_change = '%s.%s' % (opts.app_label, opts.get_change_permission())
     perm_record_change = '%s.change_record' % opts.app_label
@@ -173,38 +208,26 @@ def set_ttl_bulk(modeladmin, request, queryset):
             new_ttl = form.cleaned_data['new_ttl']
             reset_zone_minimum = form.cleaned_data['reset_zone_minimum']
             
-            n = queryset.count()
+            domain_ids = list(queryset.values_list('id', flat=True))
+            n = len(domain_ids)
             record_count = 0
             
             if n and new_ttl:
-                for domain_obj in queryset:
-                    # Find all resource records of this domain
-                    qs = Record.objects.filter(domain=domain_obj)
-                    # Now set the new TTL
-                    for rr in qs:
-                        rr.ttl = int(new_ttl)
-                        # If this is the SOA record and ``reset_zone_minimum`` has
-                        # been checked, set the minimum TTL of the SOA record equal
-                        # to the ``new_ttl`` value
-                        #
-                        # Important: We do not call ``models.Domain.set_minimum_ttl()``
-                        # because we edit the SOA record here.
-                        #
-                        if reset_zone_minimum and rr.type == 'SOA':
-                            bits = rr.content.split()
-                            # SOA content:  primary hostmaster serial refresh retry expire default_ttl
-                            bits[6] = str(new_ttl)
-                            rr.content = ' '.join(bits)
-                        # Save the resource record
-                        rr.save()
-                        rr_display = force_unicode(rr)
-                        modeladmin.log_change(request, rr, rr_display)
-                    
-                    # Update the domain serial
-                    domain_obj.update_serial()
-                    
-                    record_count += len(qs)
+                # Set the new TTL on all the resource records of the selected
+                # zones and update their serials. If ``reset_zone_minimum``
+                # has been checked, the minimum TTL of the SOA records is set
+                # equal to the ``new_ttl`` value too.
+                failed = []
+                record_count = set_zone_ttl(domain_ids, int(new_ttl), reset_zone_minimum, failed)
+                
+                # Log a single change per zone
+                message = 'Set the TTL of all resource records to %d.' % int(new_ttl)
+                if reset_zone_minimum:
+                    message = '%s Reset the minimum TTL of the zone.' % message
+                _log_actions_bulk(modeladmin, request, queryset, CHANGE, message)
+                
                 messages.info(request, 'Successfully updated %d zones (%d total records).' % (n, record_count))
+                _report_failed_zones(request, failed)
             # Return None to display the change list page again.
             return None
     else:
@@ -227,10 +250,11 @@ def force_serial_update(modeladmin, request, queryset):
     """Action that updates the serial resets TTL information on all resource
     records of the selected zones.
     """
-    for domain in queryset:
-        domain.update_serial()
-    n = queryset.count()
-    messages.info(request, 'Successfully updated %d zones.' % n)
+    failed = []
+    domain_ids = list(queryset.values_list('id', flat=True))
+    n = update_zone_serials(domain_ids, failed=failed)
+    messages.info(request, 'Successfully updated the serials of %d of the %d selected zones.' % (n, len(domain_ids)))
+    _report_failed_zones(request, failed)
 force_serial_update.short_description = "Force serial update"
 
 
@@ -247,7 +271,8 @@ def clone_zone(modeladmin, request, queryset):
       - Domain Metadata
     
     This action first displays a page which provides an input box to enter
-    the origin of the new zone.
+    the origins of the new zones, one per line. The clones are created by
+    ``utils.clone_zones()``.
     
     It checks if the user has add & change permissions.
     
@@ -264,11 +289,6 @@ def clone_zone(modeladmin, request, queryset):
     opts = modeladmin.model._meta
     app_label = opts.app_label
     
-    Domain = cache.get_model('powerdns_manager', 'Domain')
-    Record = cache.get_model('powerdns_manager', 'Record')
-    DynamicZone = cache.get_model('powerdns_manager', 'DynamicZone')
-    DomainMetadata = cache.get_model('powerdns_manager', 'DomainMetadata')
-    
     # Check the number of selected zones. This action can work on a single zone.
     
     n = queryset.count()
@@ -301,112 +321,35 @@ def clone_zone(modeladmin, request, queryset):
             
             # Store Data from the form
             
-            # Store the new domain name for the clone.
-            clone_domain_name = form.cleaned_data['clone_domain_name']
+            # Store the new domain names of the clones.
+            clone_domain_names = form.cleaned_data['clone_domain_name']
             
-            if not clone_domain_name:
+            if not clone_domain_names:
                 return None # Should never happen
 
             option_clone_dynamic = form.cleaned_data['option_clone_dynamic']
             option_clone_metadata = form.cleaned_data['option_clone_metadata']
             
-            # Clone base zone
-            
             # At this point queryset contain exactly one object. Checked above.
             domain_obj = queryset[0]
             
-            # Create the clone (Check for uniqueness takes place in forms.ClonedZoneDomainForm 
-            clone_obj = Domain.objects.create(
-                name = clone_domain_name,
-                master = domain_obj.master,
-                #last_check = domain_obj.last_check,
-                type = domain_obj.type,
-                #notified_serial = domain_obj.notified_serial,
-                account = domain_obj.account,
-                created_by = request.user   # We deliberately do not use the domain_obj.created_by
-            )
-            modeladmin.log_addition(request, clone_obj)
-            
-            # Clone Resource Records
-            
-            # Find all resource records of this domain
-            domain_rr_qs = Record.objects.filter(domain=domain_obj)
-            
-            # Create the clone's RRs
-            for rr in domain_rr_qs:
-                
-                # Construct RR name with interchanged domain
-                clone_rr_name = interchange_domain(rr.name, domain_obj.name, clone_domain_name)
-                
-                # Special treatment to the content of SOA and SRV RRs
-                if rr.type == 'SOA':
-                    content_parts = rr.content.split()
-                    # primary
-                    content_parts[0] = interchange_domain(content_parts[0], domain_obj.name, clone_domain_name)
-                    # hostmaster
-                    content_parts[1] = interchange_domain(content_parts[1], domain_obj.name, clone_domain_name)
-                    # Serial. Set new serial
-                    content_parts[2] = generate_serial()
-                    clone_rr_content = ' '.join(content_parts)
-                elif rr.type == 'SRV':
-                    content_parts = rr.content.split()
-                    # target
-                    content_parts[2] = interchange_domain(content_parts[2], domain_obj.name, clone_domain_name)
-                    clone_rr_content = ' '.join(content_parts)
-                else:
-                    clone_rr_content = interchange_domain(rr.content, domain_obj.name, clone_domain_name)
-                
-                # Create and save the cloned record.
-                clone_rr = Record(
-                    domain = clone_obj,
-                    name = clone_rr_name,
-                    type = rr.type,
-                    content = clone_rr_content,
-                    ttl = rr.ttl,
-                    prio = rr.prio,
-                    auth = rr.auth,
-                    ordername = rr.ordername
-                )
-                clone_rr.save()
-                #modeladmin.log_addition(request, clone_rr)
-            
-            # Clone Dynamic Zone setting
-            
-            if option_clone_dynamic:
-                
-                # Get the base domain's dynamic zone.
-                # There is only one Dynamic Zone object for each zone.
-                domain_dynzone_obj = DynamicZone.objects.get(domain=domain_obj)
-                
-                # Create and save the dynamic zone object for the clone.
-                clone_dynzone_obj = DynamicZone(
-                    domain = clone_obj,
-                    is_dynamic = domain_dynzone_obj.is_dynamic
-                    )
-                clone_dynzone_obj.save()
-            
-            # Clone the zone's metadata
-            
-            if option_clone_metadata:
-                
-                # Get the base domain's metadata object.
-                # There is only one metadata object for each zone.
-                domain_metadata_obj = DomainMetadata.objects.get(domain=domain_obj)
-                
-                # Create and save the metadata object for the clone.
-                clone_metadata_obj = DomainMetadata(
-                    domain = clone_obj,
-                    kind = domain_metadata_obj.kind,
-                    content = domain_metadata_obj.content
-                    )
-                clone_metadata_obj.save()
+            # Create the clones (Check for uniqueness takes place in forms.ClonedZoneDomainForm)
+            # We deliberately do not use the domain_obj.created_by
+            clone_objs = clone_zones(domain_obj, clone_domain_names,
+                created_by=request.user,
+                clone_dynamic=option_clone_dynamic,
+                clone_metadata=option_clone_metadata)
+            _log_actions_bulk(modeladmin, request, clone_objs, ADDITION)
             
             messages.info(request, 'Successfully cloned %s zone to %s' % \
-                (domain_obj.name, clone_domain_name))
+                (domain_obj.name, ', '.join(clone_domain_names)))
             
-            # Redirect to the new zone's change form.
-            return HttpResponseRedirect(reverse('admin:%s_domain_change' % app_label, args=(clone_obj.id,)))
-    
+            if len(clone_objs) == 1:
+                # Redirect to the new zone's change form.
+                return HttpResponseRedirect(reverse('admin:%s_domain_change' % app_label, args=(clone_objs[0].id,)))
+            # Return None to display the change list page again.
+            return None
+
     else:
         form = ClonedZoneDomainForm()
     
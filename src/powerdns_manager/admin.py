@@ -28,11 +28,15 @@ from django.contrib import admin
 from django.db.models.loading import cache
 from django.contrib import messages
 from django.contrib.admin import SimpleListFilter
+from django.contrib.admin.views.main import ChangeList
+from django.db import connections
+from django.db import router
 from django.utils.translation import ugettext_lazy as _
 from django.utils.crypto import get_random_string
 
 from powerdns_manager import settings
 from powerdns_manager.forms import DomainModelForm
+from powerdns_manager.forms import RecordInlineFormSet
 from powerdns_manager.forms import SoaRecordModelForm
 from powerdns_manager.forms import NsRecordModelForm
 from powerdns_manager.forms import MxRecordModelForm
@@ -62,6 +66,7 @@ from powerdns_manager.actions import force_serial_update
 from powerdns_manager.actions import reset_api_key
 from powerdns_manager.actions import clone_zone
 from powerdns_manager.utils import generate_api_key
+from powerdns_manager.utils import SoaContent
 
 
 
@@ -83,6 +88,8 @@ class BaseTabularRecordInline(admin.TabularInline):
     RR_TYPE = '__OVERRIDE__'
     form = '__OVERRIDE__'
     model = cache.get_model('powerdns_manager', 'Record')
+    formset = RecordInlineFormSet
+    template = 'powerdns_manager/edit_inline/record_tabular.html'
     extra = 0
     fields = ('name', 'ttl', 'content')
     
@@ -95,12 +102,22 @@ class BaseTabularRecordInline(admin.TabularInline):
         """Return only RR_TYPE records"""
         qs = super(BaseTabularRecordInline, self).queryset(request)
         return qs.filter(type=self.RR_TYPE)
+    
+    def get_formset(self, request, obj=None, **kwargs):
+        """The formset retrieves the records of all types at once and uses
+        the RR_TYPE records. Large RR types are paginated."""
+        formset = super(BaseTabularRecordInline, self).get_formset(request, obj, **kwargs)
+        formset.rr_type = self.RR_TYPE
+        formset.paginate = True
+        formset.params = request.GET
+        return formset
 
 
 
 class SoaRecordInline(admin.StackedInline):
     model = cache.get_model('powerdns_manager', 'Record')
     form = SoaRecordModelForm
+    formset = RecordInlineFormSet
     # Show exactly one form
     extra = 1
     max_num = 1
@@ -115,6 +132,11 @@ class SoaRecordInline(admin.StackedInline):
         """Return only SOA records"""
         qs = super(SoaRecordInline, self).queryset(request)
         return qs.filter(type='SOA')
+    
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super(SoaRecordInline, self).get_formset(request, obj, **kwargs)
+        formset.rr_type = 'SOA'
+        return formset
 
 
 class NsRecordInline(BaseTabularRecordInline):
@@ -239,11 +261,35 @@ class CryptoKeyInline(admin.TabularInline):
 
 
 
+class DomainChangeList(ChangeList):
+    """ChangeList for zones.
+    
+    The number of the resource records and the content of the SOA record of
+    each zone are retrieved by subqueries of the query of the change list,
+    instead of running queries for every zone of the list.
+    
+    """
+    def get_query_set(self, request):
+        qs = super(DomainChangeList, self).get_query_set(request)
+        Record = cache.get_model('powerdns_manager', 'Record')
+        qn = connections[router.db_for_read(self.model)].ops.quote_name
+        condition = '%s.%s = %s.%s' % (
+            qn(Record._meta.db_table), qn(Record._meta.get_field('domain').column),
+            qn(self.model._meta.db_table), qn(self.model._meta.pk.column))
+        return qs.extra(select={
+            'record_count': 'SELECT COUNT(*) FROM %s WHERE %s' % (
+                qn(Record._meta.db_table), condition),
+            'soa_content': "SELECT %s FROM %s WHERE %s AND %s = 'SOA' LIMIT 1" % (
+                qn('content'), qn(Record._meta.db_table), condition, qn('type')),
+        })
+
+
+
 class DomainAdmin(admin.ModelAdmin):
     form = DomainModelForm
     fields = ('date_modified', 'name', 'type', 'master')
     readonly_fields = ('date_modified', )
-    list_display = ('name', 'export_zone_html_link', 'type', 'master', 'date_modified')
+    list_display = ('name', 'export_zone_html_link', 'type', 'record_count', 'soa_serial', 'master', 'date_modified')
     list_filter = ('type', )
     search_fields = ('name', 'master')
     verbose_name = 'zone'
@@ -292,6 +338,25 @@ class DomainAdmin(admin.ModelAdmin):
     inlines.append(DomainMetadataInline)
     inlines.append(CryptoKeyInline)
     
+    def get_changelist(self, request, **kwargs):
+        return DomainChangeList
+    
+    def record_count(self, obj):
+        """Set by ``DomainChangeList``."""
+        return obj.record_count
+    record_count.short_description = 'Records'
+    record_count.admin_order_field = 'record_count'
+    
+    def soa_serial(self, obj):
+        """Set by ``DomainChangeList``."""
+        if not obj.soa_content:
+            return ''
+        try:
+            return SoaContent.parse(obj.soa_content).serial
+        except ValueError:
+            return ''
+    soa_serial.short_description = 'Serial'
+    
     def queryset(self, request):
         qs = super(DomainAdmin, self).queryset(request)
         if not request.user.is_superuser:
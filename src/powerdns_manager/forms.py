@@ -28,7 +28,10 @@ import time
 import re
 
 from django import forms
+from django.forms.models import BaseInlineFormSet
 from django.db.models.loading import cache
+from django.db.models.query import EmptyQuerySet
+from django.db.models import Count
 from django.utils.translation import ugettext_lazy as _
 from django.core.validators import validate_ipv4_address
 from django.core.validators import validate_ipv6_address
@@ -36,6 +39,10 @@ from django.core.exceptions import ValidationError
 
 from powerdns_manager import settings
 from powerdns_manager.utils import validate_hostname
+from powerdns_manager.utils import get_dynamic_zone_auth
+from powerdns_manager.utils import SoaContent
+from powerdns_manager.utils import search_records
+from powerdns_manager.utils import get_record_page
 
 
 
@@ -154,16 +161,22 @@ class SoaRecordModelForm(BaseRecordModelForm):
             instance = kwargs['instance']
             if instance.pk is not None:    # This check asserts that this is an EDIT
                 if instance.type == 'SOA':
-                    bits = instance.content.split()
-                    kwargs['initial'] = {
-                        'primary': bits[0],
-                        'hostmaster': bits[1],
-                        'serial': bits[2],
-                        'refresh': bits[3],
-                        'retry': bits[4],
-                        'expire': bits[5],
-                        'default_ttl': bits[6],
-                    }
+                    # Malformed SOA content leaves the extra fields empty,
+                    # so that it can be corrected through the form.
+                    try:
+                        soa = SoaContent.parse(instance.content)
+                    except ValueError:
+                        pass
+                    else:
+                        kwargs['initial'] = {
+                            'primary': soa.primary,
+                            'hostmaster': soa.hostmaster,
+                            'serial': soa.serial,
+                            'refresh': soa.refresh,
+                            'retry': soa.retry,
+                            'expire': soa.expire,
+                            'default_ttl': soa.minimum,
+                        }
         super(SoaRecordModelForm, self).__init__(*args, **kwargs)
     
     def clean_primary(self):
@@ -200,7 +213,7 @@ class SoaRecordModelForm(BaseRecordModelForm):
         """
         self.instance.type = 'SOA'
         
-        self.instance.content = '%s %s %d %s %s %s %s' % (
+        self.instance.content = SoaContent(
             self.cleaned_data.get('primary'),
             self.cleaned_data.get('hostmaster'),
             int(time.time()),
@@ -208,7 +221,7 @@ class SoaRecordModelForm(BaseRecordModelForm):
             self.cleaned_data.get('retry'),
             self.cleaned_data.get('expire'),
             self.cleaned_data.get('default_ttl')
-        )
+        ).to_content()
         
         if not self.instance.ttl:
             self.instance.ttl = self.cleaned_data.get('default_ttl')
@@ -238,6 +251,162 @@ class SoaRecordModelForm(BaseRecordModelForm):
 #        return 'soa-%s' % default_prefix
 
 
+class RecordList(list):
+    """A list of Record instances that is used by ``RecordInlineFormSet``
+    in place of a queryset.
+    
+    The ``db`` attribute is required by the formset in order to process
+    the primary keys of the submitted forms.
+    
+    """
+    def __init__(self, records, db):
+        super(RecordList, self).__init__(records)
+        self.db = db
+
+
+class RecordInlineFormSet(BaseInlineFormSet):
+    """Inline formset for the resource records of a specific type.
+    
+    The inlines of the zone change view use one formset per RR type. Instead
+    of running a query per RR type, the records of the zone are retrieved
+    with a single query, which is shared by all the formsets through the
+    Domain instance, and are partitioned by type.
+    
+    If ``paginate`` is set, only a page of ``PDNS_RECORD_INLINE_PAGE_SIZE``
+    records is shown. The records of the RR types that do not fit in a single
+    page, or are searched, are not part of the shared query. Their pages are
+    retrieved by separate queries, so the number of the records that are
+    loaded does not depend on the size of the zone. The page and the search
+    term are read from the ``params`` of the request. When the formset is
+    submitted, only the records of the submitted forms are retrieved.
+    
+    The ``rr_type``, ``paginate`` and ``params`` attributes are set by the
+    inline that creates the formset.
+    
+    """
+    rr_type = None
+    paginate = False
+    params = None
+    
+    # Information about the current page, used by the template of the inline
+    pager = None
+    
+    def get_page_param(self):
+        return '%s_page' % self.rr_type.lower()
+    
+    def get_search_param(self):
+        return '%s_q' % self.rr_type.lower()
+    
+    def get_page_url(self, page_number):
+        params = self.params.copy()
+        params[self.get_page_param()] = page_number
+        return '?%s' % params.urlencode()
+    
+    def get_search_query(self):
+        """Returns the query string, without the page and the search term,
+        to which the search term is appended."""
+        params = self.params.copy()
+        for param in (self.get_page_param(), self.get_search_param()):
+            if param in params:
+                del params[param]
+        params[self.get_search_param()] = ''
+        return params.urlencode()
+    
+    def get_zone_record_counts(self):
+        """Returns a dictionary mapping the RR types to the number of the
+        records of the zone.
+        
+        """
+        if not hasattr(self.instance, '_zone_record_counts_cache'):
+            qs = self.model._default_manager.using(self.queryset.db)
+            qs = qs.filter(**{self.fk.name: self.instance})
+            self.instance._zone_record_counts_cache = dict(
+                qs.values_list('type').annotate(Count('id')).order_by())
+        return self.instance._zone_record_counts_cache
+    
+    def get_zone_records(self):
+        """Returns a dictionary mapping the RR types to the lists of the
+        records of the zone.
+        
+        If pagination is enabled, the records of the RR types that have more
+        records than the page size are not retrieved.
+        
+        The related Domain instance of each record is set to the instance of
+        the formset, so that no additional queries are run in order to
+        retrieve the domain of each record.
+        
+        """
+        if not hasattr(self.instance, '_zone_records_cache'):
+            zone_records = {}
+            qs = self.model._default_manager.using(self.queryset.db)
+            qs = qs.filter(**{self.fk.name: self.instance})
+            if settings.PDNS_RECORD_INLINE_PAGE_SIZE:
+                large_types = [rr_type for rr_type, count in self.get_zone_record_counts().items()
+                    if count > settings.PDNS_RECORD_INLINE_PAGE_SIZE]
+                if large_types:
+                    qs = qs.exclude(type__in=large_types)
+            for rr in self._set_domain(qs.order_by('name', 'id')):
+                zone_records.setdefault(rr.type, []).append(rr)
+            self.instance._zone_records_cache = zone_records
+        return self.instance._zone_records_cache
+    
+    def get_submitted_records(self):
+        """Returns a list of the records of the submitted forms."""
+        pk_name = self.model._meta.pk.name
+        pks = []
+        for i in range(self.initial_form_count()):
+            pk = self.data.get('%s-%s' % (self.add_prefix(i), pk_name), '')
+            if pk.isdigit():
+                pks.append(int(pk))
+        if not pks:
+            return []
+        return self._set_domain(self.queryset.filter(pk__in=pks))
+    
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            if self.rr_type is None or self.instance.pk is None or \
+                    isinstance(self.queryset, EmptyQuerySet):
+                return super(RecordInlineFormSet, self).get_queryset()
+            page_size = settings.PDNS_RECORD_INLINE_PAGE_SIZE
+            params = self.params or {}
+            search = params.get(self.get_search_param(), '').strip()
+            if self.is_bound:
+                records = self.get_submitted_records()
+            elif not page_size or not self.paginate:
+                records = self.get_zone_records().get(self.rr_type)
+                if records is None:
+                    # Records that are not part of the shared query
+                    records = self._set_domain(self.queryset.order_by('name', 'id'))
+            elif not search and self.get_zone_record_counts().get(self.rr_type, 0) <= page_size:
+                records = self.get_zone_records().get(self.rr_type, [])
+            else:
+                qs = search_records(self.queryset, search).order_by('name', 'id')
+                page = get_record_page(qs, params.get(self.get_page_param()), page_size)
+                records = self._set_domain(page.object_list)
+                self.pager = {
+                    'page': page,
+                    'search': search,
+                    'search_query': self.get_search_query(),
+                    'previous_url': page.has_previous() and self.get_page_url(page.previous_page_number()),
+                    'next_url': page.has_next() and self.get_page_url(page.next_page_number()),
+                }
+            self._queryset = RecordList(records, self.queryset.db)
+        return self._queryset
+    
+    def _set_domain(self, records):
+        cache_name = self.fk.get_cache_name()
+        records = list(records)
+        for rr in records:
+            setattr(rr, cache_name, self.instance)
+        return records
+    
+    def _construct_form(self, i, **kwargs):
+        form = super(RecordInlineFormSet, self)._construct_form(i, **kwargs)
+        # Avoid a query for the domain of each record
+        setattr(form.instance, self.fk.get_cache_name(), self.instance)
+        return form
+
+
 class NsRecordModelForm(BaseRecordModelForm):
     """ModelForm for NS resource records."""
 
@@ -562,19 +731,21 @@ class DynamicIPUpdateForm(forms.Form):
         1) The key must contain [A-Z0-9]
         2) A dynamic zone must be configured with the supplied key
         
+        The id of the domain of the dynamic zone is stored in the
+        ``domain_id`` attribute of the form, so that the view does not
+        need to look up the API key again.
+        
         """
         api_key = self.cleaned_data.get('api_key')
 
         if not re.match('^[A-Z0-9]+$', api_key):
             raise forms.ValidationError('Invalid API key')
         
-        DynamicZone = cache.get_model('powerdns_manager', 'DynamicZone')
-        try:
-            DynamicZone.objects.get(api_key__exact=api_key)
-        except DynamicZone.DoesNotExist:
+        auth = get_dynamic_zone_auth(api_key)
+        if auth is None or not auth[1]:
             raise forms.ValidationError('Invalid API key')
-        else:
-            return api_key
+        self.domain_id = auth[0]
+        return api_key
     
     def clean_hostname(self):
         """Checks the provided hostname.
@@ -611,25 +782,31 @@ class TtlSelectionForm(forms.Form):
 
 
 class ClonedZoneDomainForm(forms.Form):
-    """This form is used in intermediate page that sets the name of the cloned zone."""
-    clone_domain_name = forms.CharField(max_length=255, required=True, label=_('Domain Name'), help_text="""Enter the domain name of the clone.""")
+    """This form is used in intermediate page that sets the names of the cloned zones."""
+    clone_domain_name = forms.CharField(widget=forms.Textarea(attrs={'rows': 5}), required=True, label=_('Domain Names'), help_text="""Enter the domain name of the clone. Multiple clones can be created by entering one domain name per line.""")
     option_clone_dynamic = forms.BooleanField(required=False, initial=True, label=_('Clone dynamic setting'), help_text="""If checked and the original zone is marked as dynamic, then the clone will also be marked as dynamic as well and a new API key will be generated for it.""")
     option_clone_metadata = forms.BooleanField(required=False, initial=True, label=_('Clone zone metadata'), help_text="""If checked, the metadata associated with the original zone will be cloned too.""")
     
     def clean_clone_domain_name(self):
-        clone_domain_name = self.cleaned_data.get('clone_domain_name')
+        """Returns the list of the domain names of the clones."""
+        clone_domain_names = []
+        for clone_domain_name in self.cleaned_data.get('clone_domain_name').split():
+            if clone_domain_name not in clone_domain_names:
+                clone_domain_names.append(clone_domain_name)
+        if not clone_domain_names:
+            raise forms.ValidationError('Enter at least one domain name.')
         
         # 1) Check for valid characters
-        validate_hostname(clone_domain_name, supports_cidr_notation=True)
+        for clone_domain_name in clone_domain_names:
+            if len(clone_domain_name) > 255:
+                raise forms.ValidationError('Domain name is too long: %s' % clone_domain_name)
+            validate_hostname(clone_domain_name, supports_cidr_notation=True)
         
         # 2) Check for uniqueness
         Domain = cache.get_model('powerdns_manager', 'Domain')
-        try:
-            domain_obj = Domain.objects.get(name=clone_domain_name)
-        except Domain.DoesNotExist:
-            pass
-        else:
-            raise forms.ValidationError('A zone with this name already exists. Please enter a new domain name.')
+        existing = Domain.objects.filter(name__in=clone_domain_names).values_list('name', flat=True)
+        if existing:
+            raise forms.ValidationError('A zone with this name already exists: %s. Please enter a new domain name.' % ', '.join(existing))
         
-        return clone_domain_name
+        return clone_domain_names
 
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+#  This file is part of django-powerdns-manager.
+#
+#  django-powerdns-manager is a web based PowerDNS administration panel.
+#
+#  Development Web Site:
+#    - http://www.codetrax.org/projects/django-powerdns-manager
+#  Public Source Code Repository:
+#    - https://source.codetrax.org/hgroot/django-powerdns-manager
+#
+#  Copyright 2012 George Notaras <gnot [at] g-loaded.eu>
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Composite indexes of the PowerDNS tables.
+
+Django 1.4 does not support indexes on multiple columns, so the indexes
+that PowerDNS and the administration interface need for their lookups are
+created by the app itself after
+``syncdb`` has created the tables. The existing indexes are read from the
+database catalog of each supported backend and a required index is
+considered present if an existing index starts with its columns, regardless
+of the index name. This way the indexes that have been created manually
+using the PowerDNS schema are not created twice.
+
+"""
+
+from django.db import connections
+from django.db import router
+from django.db.models.loading import cache
+
+from powerdns_manager.utils import commit_on_success_unless_managed
+
+
+
+# Composite indexes: (model name, index name, columns)
+# The index names of the records table are the ones used in the PowerDNS schema.
+COMPOSITE_INDEXES = (
+    ('Record', 'nametype_index', ('name', 'type')),
+    ('Record', 'domaintype_index', ('domain_id', 'type')),
+    ('Record', 'recordorder', ('domain_id', 'ordername')),
+    # The zones and TSIG keys of non-superusers are filtered by owner and
+    # ordered by name in the administration interface.
+    ('Domain', 'domains_created_by_name', ('created_by_id', 'name')),
+    ('TsigKey', 'tsigkeys_created_by_name', ('created_by_id', 'name')),
+)
+
+
+def _get_sqlite_indexes(cursor, qn, table):
+    indexes = {}
+    cursor.execute('PRAGMA index_list(%s)' % qn(table))
+    for row in cursor.fetchall():
+        indexes[row[1]] = None
+    for index_name in indexes.keys():
+        cursor.execute('PRAGMA index_info(%s)' % qn(index_name))
+        indexes[index_name] = tuple(
+            [column for seqno, cid, column in sorted(cursor.fetchall())])
+    return indexes
+
+def _get_mysql_indexes(cursor, qn, table):
+    columns = {}
+    cursor.execute('SHOW INDEX FROM %s' % qn(table))
+    for row in cursor.fetchall():
+        # Key_name, Seq_in_index, Column_name
+        columns.setdefault(row[2], []).append((row[3], row[4]))
+    return dict([(index_name, tuple([column for seq, column in sorted(cols)]))
+        for index_name, cols in columns.items()])
+
+def _get_postgresql_indexes(cursor, qn, table):
+    indexes = {}
+    cursor.execute("""
+        SELECT ic.relname, a.attname
+        FROM pg_index i
+            JOIN pg_class tc ON tc.oid = i.indrelid
+            JOIN pg_class ic ON ic.oid = i.indexrelid
+            CROSS JOIN generate_series(0, 31) AS k(n)
+            JOIN pg_attribute a ON a.attrelid = tc.oid AND a.attnum = i.indkey[k.n]
+        WHERE tc.relname = %s AND k.n < i.indnatts
+        ORDER BY ic.relname, k.n""", [table])
+    for index_name, column in cursor.fetchall():
+        indexes.setdefault(index_name, ())
+        indexes[index_name] += (column,)
+    return indexes
+
+_INDEX_READERS = {
+    'sqlite': _get_sqlite_indexes,
+    'mysql': _get_mysql_indexes,
+    'postgresql': _get_postgresql_indexes,
+}
+
+
+def get_table_indexes(table, using):
+    """Returns a dictionary mapping the names of the indexes of ``table``
+    to tuples of the indexed columns.
+    
+    Raises NotImplementedError if the database backend is not supported.
+    
+    """
+    connection = connections[using]
+    vendor = connection.vendor
+    if vendor not in _INDEX_READERS:
+        raise NotImplementedError('Unsupported database backend: %s' % vendor)
+    cursor = connection.cursor()
+    return _INDEX_READERS[vendor](cursor, connection.ops.quote_name, table)
+
+
+def get_composite_indexes(using):
+    """Returns a list of (table, index name, columns) tuples of the composite
+    indexes whose models are synchronized to the ``using`` database.
+    
+    """
+    indexes = []
+    for model_name, index_name, columns in COMPOSITE_INDEXES:
+        model = cache.get_model('powerdns_manager', model_name)
+        if router.allow_syncdb(using, model):
+            indexes.append((model._meta.db_table, index_name, columns))
+    return indexes
+
+
+def get_missing_indexes(using):
+    """Returns a list of (table, index name, columns) tuples of the composite
+    indexes that do not exist in the ``using`` database.
+    
+    """
+    missing = []
+    table_indexes = {}
+    for table, index_name, columns in get_composite_indexes(using):
+        if table not in table_indexes:
+            table_indexes[table] = get_table_indexes(table, using).values()
+        for existing_columns in table_indexes[table]:
+            if tuple(existing_columns[:len(columns)]) == columns:
+                break
+        else:
+            missing.append((table, index_name, columns))
+    return missing
+
+
+def create_missing_indexes(using):
+    """Creates the composite indexes that do not exist in the ``using``
+    database.
+    
+    Returns a list of (table, index name, columns) tuples of the created
+    indexes.
+    
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    missing = get_missing_indexes(using)
+    if missing:
+        with commit_on_success_unless_managed(using):
+            cursor = connection.cursor()
+            for table, index_name, columns in missing:
+                cursor.execute('CREATE INDEX %s ON %s (%s)' % (
+                    qn(index_name), qn(table), ', '.join([qn(c) for c in columns])))
+    return missing
+
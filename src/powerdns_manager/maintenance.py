@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+#
+#  This file is part of django-powerdns-manager.
+#
+#  django-powerdns-manager is a web based PowerDNS administration panel.
+#
+#  Development Web Site:
+#    - http://www.codetrax.org/projects/django-powerdns-manager
+#  Public Source Code Repository:
+#    - https://source.codetrax.org/hgroot/django-powerdns-manager
+#
+#  Copyright 2012 George Notaras <gnot [at] g-loaded.eu>
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import socket
+import threading
+import datetime
+from contextlib import contextmanager
+
+from django.core.signals import request_finished
+from django.db import connections
+from django.db import router
+from django.db import transaction
+from django.db import IntegrityError
+from django.db.models import F
+from django.db.models.loading import cache
+from django.utils import timezone
+
+from powerdns_manager import settings
+from powerdns_manager.utils import commit_on_success_unless_managed
+from powerdns_manager.utils import rectify_zone
+from powerdns_manager.utils import update_zone_serials
+from powerdns_manager.utils import iter_zone_file
+from powerdns_manager.utils import write_zone_file
+from powerdns_manager.utils import logger
+
+
+def run_zone_maintenance(domain_ids):
+    """Rectifies the specified zones and updates their serials.
+    
+    domain_ids: list of ``Domain`` ids
+    
+    Zones that no longer exist are skipped.
+    
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    
+    domain_qs = Domain.objects.filter(id__in=domain_ids).values_list('id', 'name')
+    with commit_on_success_unless_managed(using=router.db_for_write(Domain)):
+        existing_ids = []
+        for domain_id, name in domain_qs:
+            rectify_zone(name)
+            existing_ids.append(domain_id)
+        update_zone_serials(existing_ids)
+
+
+def get_zone_job_kinds():
+    """Returns the kinds of the jobs added for the maintenance of a zone."""
+    kinds = ['rectify', 'serial']
+    if settings.PDNS_ZONE_EXPORT_DIRECTORY:
+        kinds.append('export')
+    return kinds
+
+
+def enqueue_zone_jobs(domain_ids, kinds=None):
+    """Adds jobs for the specified zones to the job table.
+    
+    domain_ids: list of ``Domain`` ids
+    kinds: list of job kinds. See ``models.ZoneJob.KIND_CHOICES``.
+    
+    Jobs that are already pending, and not yet processed by a worker, are
+    not added again. Jobs that have failed ``PDNS_WORKER_MAX_ATTEMPTS`` times
+    are never processed again, so a new job is added for their zone.
+    
+    """
+    ZoneJob = cache.get_model('powerdns_manager', 'ZoneJob')
+    
+    if kinds is None:
+        kinds = get_zone_job_kinds()
+    
+    pending = set(ZoneJob.objects.filter(domain__id__in=domain_ids, kind__in=kinds,
+        locked_by__isnull=True, attempts__lt=settings.PDNS_WORKER_MAX_ATTEMPTS
+        ).values_list('domain', 'kind'))
+    ZoneJob.objects.bulk_create([
+        ZoneJob(domain_id=domain_id, kind=kind)
+            for domain_id in domain_ids for kind in kinds
+                if (domain_id, kind) not in pending
+    ])
+
+
+def get_worker_id():
+    """Returns an identifier of the current worker thread."""
+    worker_id = '%s:%d:%s' % (socket.gethostname(), os.getpid(), threading.current_thread().name)
+    return worker_id[-64:]
+
+
+def acquire_zone_lock(domain_id, worker_id):
+    """Acquires the lock of a zone.
+    
+    Returns True if the lock has been acquired, or False if the lock is held
+    by another worker.
+    
+    """
+    ZoneLock = cache.get_model('powerdns_manager', 'ZoneLock')
+    db = router.db_for_write(ZoneLock)
+    
+    with commit_on_success_unless_managed(using=db):
+        sid = transaction.savepoint(using=db)
+        try:
+            ZoneLock.objects.create(domain_id=domain_id, locked_by=worker_id)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid, using=db)
+            return False
+        transaction.savepoint_commit(sid, using=db)
+    return True
+
+
+def release_zone_lock(domain_id, worker_id):
+    """Releases the lock of a zone."""
+    ZoneLock = cache.get_model('powerdns_manager', 'ZoneLock')
+    ZoneLock.objects.filter(domain__id=domain_id, locked_by=worker_id).delete()
+
+
+def refresh_zone_lock(domain_id, worker_id):
+    """Refreshes the lock of a zone, so that it is not considered stale.
+    
+    Returns True if the lock is still held by ``worker_id``.
+    
+    """
+    ZoneLock = cache.get_model('powerdns_manager', 'ZoneLock')
+    return bool(ZoneLock.objects.filter(domain__id=domain_id,
+        locked_by=worker_id).update(date_modified=timezone.now()))
+
+
+@contextmanager
+def zone_lock_refresher(domain_id, worker_id, interval=None):
+    """Refreshes the lock of a zone in a background thread while the block
+    runs.
+    
+    By default, the lock is refreshed every third of
+    ``PDNS_WORKER_LOCK_TIMEOUT`` seconds, so that the lock of a worker, which
+    runs the jobs of a zone for longer than the timeout, is not released by
+    ``recover_zone_jobs()``.
+    
+    """
+    if interval is None:
+        interval = settings.PDNS_WORKER_LOCK_TIMEOUT / 3.0
+    stopped = threading.Event()
+    
+    def refresh():
+        try:
+            while not stopped.wait(interval):
+                try:
+                    refresh_zone_lock(domain_id, worker_id)
+                except Exception:
+                    # The lock is refreshed again after the next interval
+                    pass
+        finally:
+            # Close the database connections of the refresher thread
+            for conn in connections.all():
+                conn.close()
+    
+    thread = threading.Thread(target=refresh)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def recover_zone_jobs():
+    """Releases stale zone locks and the jobs of workers that have died.
+    
+    Locks that have not been refreshed for ``PDNS_WORKER_LOCK_TIMEOUT``
+    seconds are considered stale. Running workers refresh their locks, see
+    ``zone_lock_refresher()``. Jobs that are locked by a worker, which does
+    not hold the lock of their zone, are released.
+    
+    """
+    ZoneJob = cache.get_model('powerdns_manager', 'ZoneJob')
+    ZoneLock = cache.get_model('powerdns_manager', 'ZoneLock')
+    
+    stale = timezone.now() - datetime.timedelta(seconds=settings.PDNS_WORKER_LOCK_TIMEOUT)
+    ZoneLock.objects.filter(date_modified__lt=stale).delete()
+    locked_domain_ids = list(ZoneLock.objects.values_list('domain', flat=True))
+    ZoneJob.objects.filter(locked_by__isnull=False).exclude(
+        domain__id__in=locked_domain_ids).update(locked_by=None)
+
+
+def run_zone_jobs(domain_id, kinds):
+    """Runs jobs of the specified kinds on the zone with id ``domain_id``."""
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    
+    try:
+        origin = Domain.objects.values_list('name', flat=True).get(id=domain_id)
+    except Domain.DoesNotExist:
+        return
+    
+    with commit_on_success_unless_managed(using=router.db_for_write(Domain)):
+        if 'rectify' in kinds:
+            rectify_zone(origin)
+        if 'serial' in kinds:
+            update_zone_serials([domain_id])
+    
+    if 'export' in kinds and settings.PDNS_ZONE_EXPORT_DIRECTORY:
+        write_zone_file(settings.PDNS_ZONE_EXPORT_DIRECTORY, origin, iter_zone_file(origin))
+
+
+def process_zone_jobs(worker_id=None, max_zones=100):
+    """Processes pending jobs of up to ``max_zones`` zones.
+    
+    The worker acquires the lock of each zone before it claims the pending
+    jobs of the zone, and refreshes the lock while it runs the jobs, so the
+    jobs of a zone are never processed concurrently.
+    All the claimed jobs of a zone are processed together. Failed jobs are
+    released and retried up to ``PDNS_WORKER_MAX_ATTEMPTS`` times.
+    
+    Returns the number of the processed zones.
+    
+    """
+    ZoneJob = cache.get_model('powerdns_manager', 'ZoneJob')
+    
+    if worker_id is None:
+        worker_id = get_worker_id()
+    
+    pending_qs = ZoneJob.objects.filter(locked_by__isnull=True,
+        attempts__lt=settings.PDNS_WORKER_MAX_ATTEMPTS)
+    
+    domain_ids = []
+    for domain_id in pending_qs.values_list('domain', flat=True)[:max_zones * 3]:
+        if domain_id not in domain_ids:
+            domain_ids.append(domain_id)
+    
+    processed = 0
+    for domain_id in domain_ids[:max_zones]:
+        if not acquire_zone_lock(domain_id, worker_id):
+            continue
+        try:
+            if not pending_qs.filter(domain__id=domain_id).update(locked_by=worker_id):
+                continue
+            job_qs = ZoneJob.objects.filter(domain__id=domain_id, locked_by=worker_id)
+            kinds = set(job_qs.values_list('kind', flat=True))
+            try:
+                with zone_lock_refresher(domain_id, worker_id):
+                    run_zone_jobs(domain_id, kinds)
+            except Exception, e:
+                job_qs.update(locked_by=None, attempts=F('attempts') + 1, last_error=str(e))
+            else:
+                job_qs.delete()
+            processed += 1
+        finally:
+            release_zone_lock(domain_id, worker_id)
+    return processed
+
+
+
+class ZoneMaintenanceScheduler(object):
+    """Schedules the maintenance (rectify and serial update) of zones.
+    
+    Multiple requests for the maintenance of the same zone, which are made
+    while the maintenance of the zone is pending, are collapsed into one.
+    When the pending maintenance is run depends on the mode:
+    
+    immediate
+        The maintenance runs as soon as it is scheduled, unless it is
+        scheduled within a ``batch()`` block, in which case it runs once at
+        the end of the outermost block.
+    request
+        The maintenance runs when the current HTTP request has finished, which
+        is after the transaction of the admin views has been committed. Outside
+        of HTTP requests, ``flush()`` has to be called or a ``batch()`` block
+        has to be used.
+    thread
+        The maintenance runs in a background thread ``delay`` seconds after
+        the first zone has been scheduled.
+    queue
+        Jobs are added to the job table, within the current transaction, and
+        are processed by the ``pdns_worker`` management command.
+    
+    """
+    MODES = ('immediate', 'request', 'thread', 'queue')
+    
+    def __init__(self, mode=None, delay=None):
+        if mode is None:
+            mode = settings.PDNS_ZONE_MAINTENANCE_MODE
+        if mode not in self.MODES:
+            raise Exception('Invalid zone maintenance mode: %s' % mode)
+        if delay is None:
+            delay = settings.PDNS_ZONE_MAINTENANCE_DELAY
+        self.mode = mode
+        self.delay = delay
+        # Zones scheduled by the current thread
+        self._local = threading.local()
+        # Zones handed over to the background thread
+        self._lock = threading.Lock()
+        self._thread_pending = []
+        self._timer = None
+        # Failed maintenance attempts of the zones retried by the background thread
+        self._attempts = {}
+    
+    def _get_local(self):
+        local = self._local
+        if not hasattr(local, 'pending'):
+            local.pending = []
+            local.depth = 0
+        return local
+    
+    def schedule(self, domain_id):
+        """Schedules the maintenance of the zone with id ``domain_id``."""
+        local = self._get_local()
+        if domain_id not in local.pending:
+            local.pending.append(domain_id)
+        if not local.depth and self.mode != 'request':
+            self.flush()
+    
+    @contextmanager
+    def batch(self):
+        """Collapses the maintenance scheduled within the block.
+        
+        The scheduled maintenance is flushed at the end of the outermost
+        block. If an exception is raised, the scheduled maintenance is
+        discarded.
+        
+        """
+        local = self._get_local()
+        local.depth += 1
+        try:
+            yield
+        except:
+            local.depth -= 1
+            if not local.depth:
+                local.pending = []
+            raise
+        local.depth -= 1
+        if not local.depth:
+            self.flush()
+    
+    def flush(self):
+        """Runs or hands over the maintenance scheduled by the current thread."""
+        local = self._get_local()
+        domain_ids = local.pending
+        local.pending = []
+        if not domain_ids:
+            return
+        if self.mode == 'thread':
+            self._lock.acquire()
+            try:
+                for domain_id in domain_ids:
+                    self._attempts.pop(domain_id, None)
+                self._hand_over(domain_ids)
+            finally:
+                self._lock.release()
+        elif self.mode == 'queue':
+            enqueue_zone_jobs(domain_ids)
+        else:
+            run_zone_maintenance(domain_ids)
+    
+    def _hand_over(self, domain_ids):
+        # Must be called while holding ``self._lock``
+        for domain_id in domain_ids:
+            if domain_id not in self._thread_pending:
+                self._thread_pending.append(domain_id)
+        if self._timer is None:
+            self._timer = threading.Timer(self.delay, self._run_in_thread)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def _run_in_thread(self):
+        self._lock.acquire()
+        try:
+            domain_ids = self._thread_pending
+            self._thread_pending = []
+            self._timer = None
+        finally:
+            self._lock.release()
+        try:
+            failed_ids = self._run_zone_maintenance(domain_ids)
+        finally:
+            # Close the database connections of the timer thread
+            for conn in connections.all():
+                conn.close()
+        self._lock.acquire()
+        try:
+            retry_ids = []
+            for domain_id in domain_ids:
+                if domain_id not in failed_ids:
+                    self._attempts.pop(domain_id, None)
+                    continue
+                attempts = self._attempts.get(domain_id, 0) + 1
+                if attempts < settings.PDNS_WORKER_MAX_ATTEMPTS:
+                    self._attempts[domain_id] = attempts
+                    retry_ids.append(domain_id)
+                else:
+                    self._attempts.pop(domain_id, None)
+                    logger.error('Maintenance of zone %s failed %d times, giving up',
+                        domain_id, attempts)
+            if retry_ids:
+                # Retried after ``delay`` seconds
+                self._hand_over(retry_ids)
+        finally:
+            self._lock.release()
+    
+    def _run_zone_maintenance(self, domain_ids):
+        """Runs the maintenance of the zones and returns a list of the ids of
+        the zones whose maintenance has failed.
+        
+        If the maintenance of the zones fails, the zones are maintained one
+        by one, so that a failing zone does not prevent the maintenance of
+        the rest of the zones. Failures are logged.
+        
+        """
+        try:
+            run_zone_maintenance(domain_ids)
+            return []
+        except Exception:
+            if len(domain_ids) == 1:
+                logger.exception('Maintenance of zone %s failed', domain_ids[0])
+                return domain_ids
+        failed_ids = []
+        for domain_id in domain_ids:
+            try:
+                run_zone_maintenance([domain_id])
+            except Exception:
+                logger.exception('Maintenance of zone %s failed', domain_id)
+                failed_ids.append(domain_id)
+        return failed_ids
+    
+    def request_finished_cb(self, sender, **kwargs):
+        if not self._get_local().depth:
+            self.flush()
+
+
+# Scheduler used by the ``zone_saved`` signal callback
+zone_maintenance_scheduler = ZoneMaintenanceScheduler()
+
+request_finished.connect(zone_maintenance_scheduler.request_finished_cb)
+
+
+def schedule_zone_maintenance(domain_id):
+    """Schedules the rectification and the serial update of a zone."""
+    zone_maintenance_scheduler.schedule(domain_id)
+
+
+def zone_maintenance_batch():
+    """Returns a context manager that collapses the zone maintenance.
+    
+    Example::
+    
+        with zone_maintenance_batch():
+            for domain_obj in domains:
+                ...
+                zone_saved.send(sender=Domain, instance=domain_obj)
+    
+    """
+    return zone_maintenance_scheduler.batch()
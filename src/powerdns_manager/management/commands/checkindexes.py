@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+#  This file is part of django-powerdns-manager.
+#
+#  django-powerdns-manager is a web based PowerDNS administration panel.
+#
+#  Development Web Site:
+#    - http://www.codetrax.org/projects/django-powerdns-manager
+#  Public Source Code Repository:
+#    - https://source.codetrax.org/hgroot/django-powerdns-manager
+#
+#  Copyright 2012 George Notaras <gnot [at] g-loaded.eu>
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db import router
+from django.db.models.loading import cache
+
+from powerdns_manager.indexes import get_missing_indexes
+from powerdns_manager.indexes import create_missing_indexes
+
+
+
+class Command(BaseCommand):
+    
+    help = 'Report the composite indexes of the PowerDNS tables that are missing.'
+    requires_model_validation = False
+    
+    option_list = BaseCommand.option_list + (
+        make_option('-c', '--create', action='store_true', dest='create',
+            help='Create the missing indexes.'),
+        make_option('--database', action='store', dest='database',
+            help='The database to check. Defaults to the database of the PowerDNS tables.'),
+    )
+    
+    def handle(self, *args, **options):
+        create = options.get('create')
+        verbosity = int(options.get('verbosity', 1))
+        using = options.get('database')
+        if not using:
+            Record = cache.get_model('powerdns_manager', 'Record')
+            using = router.db_for_write(Record) or DEFAULT_DB_ALIAS
+        
+        try:
+            if create:
+                indexes = create_missing_indexes(using)
+            else:
+                indexes = get_missing_indexes(using)
+        except NotImplementedError, e:
+            raise CommandError(str(e))
+        
+        for table, index_name, columns in indexes:
+            if create:
+                sys.stdout.write('Created index %s on %s(%s)\n' % (
+                    index_name, table, ','.join(columns)))
+            else:
+                sys.stdout.write('Missing index %s on %s(%s)\n' % (
+                    index_name, table, ','.join(columns)))
+        if verbosity and not indexes:
+            sys.stdout.write('No composite indexes are missing.\n')
+        sys.stdout.flush()
+        
+        if indexes and not create:
+            sys.exit(1)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+#  This file is part of django-powerdns-manager.
+#
+#  django-powerdns-manager is a web based PowerDNS administration panel.
+#
+#  Development Web Site:
+#    - http://www.codetrax.org/projects/django-powerdns-manager
+#  Public Source Code Repository:
+#    - https://source.codetrax.org/hgroot/django-powerdns-manager
+#
+#  Copyright 2012 George Notaras <gnot [at] g-loaded.eu>
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.exceptions import ValidationError
+from django.db.models.loading import cache
+
+from powerdns_manager.utils import validate_hostname
+from powerdns_manager.utils import clone_zones
+
+
+
+class Command(BaseCommand):
+    
+    help = 'Clone a zone to one or more new zones.'
+    args = 'template_domain clone_domain1 clone_domain2 ...'
+    requires_model_validation = False
+    
+    option_list = BaseCommand.option_list + (
+        make_option('-d', '--domainfile', action='store', dest='domainfile', metavar="PATH",
+            help='The path of text file containing the domain names of the clones. File format is one domain per line.'),
+        make_option('-u', '--username', action='store', dest='username', metavar="USERNAME",
+            help='The username of the user the clones belong to.'),
+        make_option('--no-dynamic', action='store_false', dest='clone_dynamic', default=True,
+            help='Do not clone the dynamic setting of the zone.'),
+        make_option('--no-metadata', action='store_false', dest='clone_metadata', default=True,
+            help='Do not clone the metadata of the zone.'),
+    )
+    
+    def handle(self, *args, **options):
+        domainfile = options.get('domainfile')
+        username = options.get('username')
+        verbosity = int(options.get('verbosity', 1))
+        
+        if not args:
+            raise CommandError('error: Missing template domain')
+        elif domainfile and not os.path.isfile(domainfile):
+            raise CommandError('error: Expected path to file')
+        elif len(args) < 2 and not domainfile:
+            raise CommandError('error: Missing clone domain')
+        
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        try:
+            domain_obj = Domain.objects.get(name=args[0])
+        except Domain.DoesNotExist:
+            raise CommandError('error: Zone does not exist: %s' % args[0])
+        
+        created_by = None
+        if username:
+            User = cache.get_model('auth', 'User')
+            try:
+                created_by = User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError('error: User does not exist: %s' % username)
+        
+        # Clone domains may exist as args or contained in the domainfile.
+        # Create a list containing all domains.
+        clone_names = list(args[1:])
+        if domainfile:
+            f = open(domainfile, 'rb')
+            clone_names.extend( [line.strip() for line in f.readlines() if line.strip()] )
+            f.close()
+        
+        # Skip invalid and existing domains
+        existing = set(Domain.objects.filter(name__in=clone_names).values_list('name', flat=True))
+        names = []
+        for clone_name in clone_names:
+            try:
+                validate_hostname(clone_name, supports_cidr_notation=True)
+            except ValidationError, e:
+                self.report(clone_name, '; '.join(e.messages), verbosity)
+                continue
+            if clone_name in existing:
+                self.report(clone_name, 'Zone already exists', verbosity)
+            elif clone_name not in names:
+                names.append(clone_name)
+        
+        for clone_obj in clone_zones(domain_obj, names, created_by=created_by,
+                clone_dynamic=options.get('clone_dynamic'),
+                clone_metadata=options.get('clone_metadata')):
+            self.report(clone_obj.name, None, verbosity)
+    
+    def report(self, domain, error, verbosity):
+        if error is not None:
+            sys.stderr.write('error: %s: %s\n' % (str(error), domain))
+            sys.stderr.flush()
+        elif verbosity:
+            sys.stdout.write('success: %s\n' % domain)
+            sys.stdout.flush()
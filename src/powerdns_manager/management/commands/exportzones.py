@@ -26,12 +26,166 @@
 
 import os
 import sys
+import multiprocessing
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
 from optparse import make_option
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 from django.db.models.loading import cache
 
-from powerdns_manager.utils import generate_zone_file
+from powerdns_manager.utils import iter_zone_file
+from powerdns_manager.utils import iter_zone_files
+from powerdns_manager.utils import get_zone_file_path
+from powerdns_manager.utils import SoaContent
+from powerdns_manager.utils import write_file_atomically
+from powerdns_manager.utils import write_zone_file
+from powerdns_manager.utils import logger
+
+
+# Number of zones exported by each task of a worker process
+EXPORT_CHUNK_SIZE = 100
+
+# Name of the file, in the output directory, in which the state of the
+# exported zones is recorded by incremental exports.
+MANIFEST_FILENAME = '.exportzones.manifest'
+
+
+def get_zone_states(origins=None):
+    """Returns the current state of the zones with the provided origins.
+    
+    If ``origins`` is None, the state of all zones is returned.
+    
+    Returns a dictionary which maps the origin of each zone to a
+    ``[serial, date_modified]`` list, where ``serial`` is the serial of the
+    SOA record, or None if its content is malformed, and ``date_modified``
+    is ``Domain.date_modified`` in ISO format.
+    
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    Record = cache.get_model('powerdns_manager', 'Record')
+    
+    if origins is None:
+        domain_querysets = [Domain.objects.all()]
+    else:
+        # The origins are looked up in chunks, so that the number of the query
+        # parameters does not exceed the limits of the database.
+        domain_querysets = [Domain.objects.filter(name__in=origins[i:i+EXPORT_CHUNK_SIZE])
+            for i in range(0, len(origins), EXPORT_CHUNK_SIZE)]
+    
+    states = {}
+    for domains in domain_querysets:
+        serials = {}
+        soa_qs = Record.objects.filter(domain__in=domains.values('id'), type='SOA')
+        for domain_id, content in soa_qs.values_list('domain', 'content'):
+            try:
+                serials[domain_id] = str(SoaContent.parse(content).serial)
+            except ValueError:
+                serials[domain_id] = None
+        
+        for domain_id, origin, date_modified in domains.values_list('id', 'name', 'date_modified'):
+            states[origin] = [serials.get(domain_id), date_modified.isoformat()]
+    return states
+
+
+def read_manifest(outdir):
+    """Returns the manifest of the zone files in ``outdir``.
+    
+    A manifest that cannot be read is logged and treated as empty, so that
+    all the zones are exported again.
+    
+    """
+    path = os.path.join(outdir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    f = open(path, 'r')
+    try:
+        manifest = json.load(f)
+    except ValueError, e:
+        logger.warning('Invalid manifest %s: %s', path, e)
+        return {}
+    finally:
+        f.close()
+    if not isinstance(manifest, dict):
+        logger.warning('Invalid manifest %s: not a JSON object', path)
+        return {}
+    return manifest
+
+
+def write_manifest(outdir, manifest):
+    """Writes the manifest of the zone files in ``outdir``."""
+    path = os.path.join(outdir, MANIFEST_FILENAME)
+    write_file_atomically(path, [json.dumps(manifest, indent=1, sort_keys=True)])
+
+
+def _write_zone_file(outdir, origin, zone_file_lines):
+    """Writes the zone file of ``origin`` to ``outdir``.
+    
+    Returns None on success, or the error message if the zone file could
+    not be generated or written, so that one failed zone does not abort
+    the export of the rest of the zones.
+    
+    """
+    try:
+        write_zone_file(outdir, origin, zone_file_lines)
+    except Exception, e:
+        return str(e)
+    return None
+
+
+def export_zones(origins, outdir, prefetch=False):
+    """Exports the zones with the provided origins to ``outdir``.
+    
+    If ``origins`` is None, all zones are exported.
+    
+    Returns a list of ``(origin, error)`` tuples. ``error`` is None if the
+    zone has been exported successfully.
+    
+    If ``prefetch`` is True, the records of all the zones are retrieved with
+    a single query. Otherwise, the records are retrieved zone by zone.
+    
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    results = []
+    
+    if prefetch:
+        if origins is None:
+            domain_querysets = [Domain.objects.all()]
+        else:
+            domain_querysets = [Domain.objects.filter(name__in=origins[i:i+EXPORT_CHUNK_SIZE])
+                for i in range(0, len(origins), EXPORT_CHUNK_SIZE)]
+        exported = set()
+        for domains in domain_querysets:
+            for origin, zone_file_lines in iter_zone_files(domains):
+                exported.add(origin)
+                results.append( (origin, _write_zone_file(outdir, origin, zone_file_lines)) )
+        for origin in origins or ():
+            if origin not in exported:
+                results.append( (origin, 'zone not found') )
+        return results
+    
+    if origins is None:
+        origins = Domain.objects.values_list('name', flat=True)
+    
+    for origin in origins:
+        try:
+            zone_file_lines = iter_zone_file(origin)
+        except Domain.DoesNotExist:
+            results.append( (origin, 'zone not found') )
+        except Exception, e:
+            results.append( (origin, str(e)) )
+        else:
+            results.append( (origin, _write_zone_file(outdir, origin, zone_file_lines)) )
+    return results
+
+
+def _export_zones_worker(args):
+    """Runs ``export_zones()`` in a worker process."""
+    origins, outdir, prefetch = args
+    return export_zones(origins, outdir, prefetch)
 
 
 
@@ -46,32 +200,98 @@ class Command(BaseCommand):
             help='Directory where zone files should be stored.'),
         make_option('-a', '--all', action='store_true', dest='all',
             help='Export all zones.'),
+        make_option('-j', '--jobs', action='store', dest='jobs', type='int', default=1, metavar="N",
+            help='Number of worker processes that export zones in parallel. Each process uses its own database connection.'),
+        make_option('-p', '--prefetch', action='store_true', dest='prefetch',
+            help='Retrieve the records of many zones with a single query instead of one query per zone.'),
+        make_option('-i', '--incremental', action='store_true', dest='incremental',
+            help='Export only the zones whose serial or modification date has changed since the last incremental export.'),
     )
     
     def handle(self, *origins, **options):
         outdir = os.path.abspath(options.get('directory'))
         export_all = options.get('all')
+        jobs = options.get('jobs')
+        prefetch = options.get('prefetch')
+        incremental = options.get('incremental')
         verbosity = int(options.get('verbosity', 1))
         
         if export_all and len(origins) > 0:
             raise CommandError('No origins should be specified when the --all switch is used.')
+        elif jobs < 1:
+            raise CommandError('The number of jobs must be a positive integer.')
         
-        Domain = cache.get_model('powerdns_manager', 'Domain')
-        if export_all:
-            origins = [d.name for d in Domain.objects.all()]
+        origins = list(origins)
         
-        for origin in origins:
-            try:
-                data = generate_zone_file(origin)
-            except Domain.DoesNotExist:
-                sys.stderr.write('error: zone not found: %s\n' % origin)
+        if incremental:
+            # Skip the zones whose state has not changed since the last export
+            # and whose zone file still exists.
+            states = get_zone_states(None if export_all else origins)
+            manifest = read_manifest(outdir)
+            if export_all:
+                origins = sorted(states.keys())
+                export_all = False
+            changed_origins = []
+            for origin in origins:
+                if origin in states and manifest.get(origin) == states[origin] and \
+                        os.path.exists(get_zone_file_path(outdir, origin)):
+                    if verbosity >= 2:
+                        sys.stdout.write('unchanged: %s\n' % origin)
+                else:
+                    changed_origins.append(origin)
+            origins = changed_origins
+        
+        if jobs == 1:
+            results = export_zones(None if export_all else origins, outdir, prefetch)
+        else:
+            Domain = cache.get_model('powerdns_manager', 'Domain')
+            if export_all:
+                origins = list(Domain.objects.values_list('name', flat=True))
+            results = self.export_zones_parallel(origins, outdir, prefetch, jobs)
+        self.report(results, verbosity)
+        
+        if incremental:
+            # Record the state of the zones, as it was before they were
+            # exported. Zones modified during the export are exported again
+            # by the next run.
+            for origin, error in results:
+                if not error:
+                    manifest[origin] = states[origin]
+            write_manifest(outdir, manifest)
+    
+    def export_zones_parallel(self, origins, outdir, prefetch, jobs):
+        # The zones are exported by worker processes in chunks. The database
+        # connections are closed before the workers are forked, so that each
+        # worker opens its own connections.
+        for conn in connections.all():
+            conn.close()
+        
+        tasks = [(origins[i:i+EXPORT_CHUNK_SIZE], outdir, prefetch)
+            for i in range(0, len(origins), EXPORT_CHUNK_SIZE)]
+        results = []
+        pool = multiprocessing.Pool(processes=jobs)
+        try:
+            for task_results in pool.imap_unordered(_export_zones_worker, tasks):
+                results.extend(task_results)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+    
+    def report(self, results, verbosity):
+        failed = []
+        for origin, error in results:
+            if error:
+                failed.append(origin)
+                sys.stderr.write('error: %s: %s\n' % (error, origin))
                 sys.stderr.flush()
-            else:
-                path = os.path.join(outdir, '%s.zone' % origin)
-                f = open(path, 'w')
-                f.write(data)
-                f.close()
-                if verbosity:
-                    sys.stdout.write('success: %s\n' % origin)
-                    sys.stdout.flush()
-
+            elif verbosity:
+                sys.stdout.write('success: %s\n' % origin)
+                sys.stdout.flush()
+        
+        if verbosity and len(results) > 1:
+            sys.stdout.write('%d zones exported successfully, %d failed.\n' % (
+                len(results) - len(failed), len(failed)))
+            for origin in failed:
+                sys.stdout.write('failed: %s\n' % origin)
+            sys.stdout.flush()
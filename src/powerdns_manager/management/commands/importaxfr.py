@@ -26,11 +26,16 @@
 
 import os
 import sys
+import threading
+import Queue
 from optparse import make_option
 
 from django.core.management.base import BaseCommand, CommandError
 
 from powerdns_manager.utils import process_axfr_response
+from powerdns_manager.utils import transfer_zone
+from powerdns_manager.utils import get_zone_rr_data
+from powerdns_manager.utils import import_zone_rr_data
 
 
 
@@ -47,16 +52,21 @@ class Command(BaseCommand):
             help='The path of text file containing domain names to import. File format is one domain per line.'),
         make_option('-o', '--overwrite', action='store_true', dest='overwrite',
             help='Overwrite existing zones.'),
+        make_option('-c', '--concurrency', action='store', dest='concurrency', type='int', default=1, metavar="N",
+            help='Number of zone transfers that run concurrently.'),
     )
     
     def handle(self, *arg_domains, **options):
         nameserver = options.get('nameserver')
         domainfile = options.get('domainfile')
         overwrite = options.get('overwrite')
+        concurrency = options.get('concurrency')
         verbosity = int(options.get('verbosity', 1))
         
         if not nameserver:
             raise CommandError('error: nameserver is required')
+        elif concurrency < 1:
+            raise CommandError('error: concurrency must be a positive integer')
         elif domainfile and not os.path.isfile(domainfile):
             raise CommandError('error: Expected path to file')
         elif not arg_domains and not domainfile:
@@ -72,14 +82,68 @@ class Command(BaseCommand):
             domains.extend( [line.strip() for line in f.readlines() if line.strip()] )
             f.close()
         
+        failed = []
+        if concurrency == 1:
+            for domain in domains:
+                try:
+                    process_axfr_response(domain, nameserver, overwrite=overwrite)
+                except Exception, e:
+                    self.report(domain, e, verbosity, failed)
+                else:
+                    self.report(domain, None, verbosity, failed)
+        else:
+            self.import_zones_concurrently(domains, nameserver, overwrite, concurrency, verbosity, failed)
+        
+        if verbosity and len(domains) > 1:
+            sys.stdout.write('%d zones imported successfully, %d failed.\n' % (
+                len(domains) - len(failed), len(failed)))
+            for domain in failed:
+                sys.stdout.write('failed: %s\n' % domain)
+            sys.stdout.flush()
+    
+    def import_zones_concurrently(self, domains, nameserver, overwrite, concurrency, verbosity, failed):
+        # Zone transfers run in ``concurrency`` threads, which put the
+        # transferred zone data in a bounded queue. The zone data is written
+        # to the database by the current thread, one transaction per zone.
+        # The threads do not access the database.
+        domain_queue = Queue.Queue()
         for domain in domains:
-            try:
-                process_axfr_response(domain, nameserver, overwrite=overwrite)
-            except Exception, e:
-                sys.stderr.write('error: %s: %s\n' % (str(e), domain))
-                sys.stderr.flush()
-            else:
-                if verbosity:
-                    sys.stdout.write('success: %s\n' % domain)
-                    sys.stdout.flush()
+            domain_queue.put(domain)
+        zone_queue = Queue.Queue(maxsize=concurrency * 2)
+        
+        def transfer_worker():
+            while True:
+                try:
+                    domain = domain_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    zone = transfer_zone(domain, nameserver)
+                    origin = str(zone.origin).rstrip('.')
+                    zone_queue.put( (domain, origin, get_zone_rr_data(zone), None) )
+                except Exception, e:
+                    zone_queue.put( (domain, None, None, e) )
+        
+        for i in range(min(concurrency, len(domains))):
+            t = threading.Thread(target=transfer_worker)
+            t.daemon = True
+            t.start()
+        
+        for i in range(len(domains)):
+            domain, origin, rr_data, error = zone_queue.get()
+            if error is None:
+                try:
+                    import_zone_rr_data(origin, rr_data, overwrite=overwrite)
+                except Exception, e:
+                    error = e
+            self.report(domain, error, verbosity, failed)
+    
+    def report(self, domain, error, verbosity, failed):
+        if error is not None:
+            failed.append(domain)
+            sys.stderr.write('error: %s: %s\n' % (str(error), domain))
+            sys.stderr.flush()
+        elif verbosity:
+            sys.stdout.write('success: %s\n' % domain)
+            sys.stdout.flush()
 
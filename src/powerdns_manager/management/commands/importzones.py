@@ -26,11 +26,38 @@
 
 import os
 import sys
+import glob
+import multiprocessing
 from optparse import make_option
 
 from django.core.management.base import BaseCommand, CommandError
 
-from powerdns_manager.utils import process_zone_file
+from powerdns_manager.utils import parse_zone_file
+from powerdns_manager.utils import get_zone_rr_data
+from powerdns_manager.utils import import_zone_rr_data
+
+
+def parse_zone_file_data(zonefile):
+    """Reads and parses a zone file.
+    
+    Returns a ``(zonefile, origin, rr_data, error)`` tuple, where ``rr_data``
+    is the list of resource records returned by ``get_zone_rr_data()``.
+    ``error`` is None if the zone file has been parsed successfully.
+    
+    No database access takes place in this function, so it can run in
+    worker processes.
+    
+    """
+    try:
+        f = open(zonefile, 'r')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        zone = parse_zone_file(None, data)
+        return (zonefile, str(zone.origin).rstrip('.'), get_zone_rr_data(zone), None)
+    except Exception, e:
+        return (zonefile, None, None, str(e))
 
 
 
@@ -41,28 +68,81 @@ class Command(BaseCommand):
     requires_model_validation = False
     
     option_list = BaseCommand.option_list + (
-        #make_option('-d', '--directory', action='store', dest='directory', metavar="PATH",
-        #    help='TODO'),
+        make_option('-d', '--directory', action='store', dest='directory', metavar="PATH",
+            help='Import the zone files contained in this directory.'),
+        make_option('-p', '--pattern', action='store', dest='pattern', default='*', metavar="GLOB",
+            help='Import only the files of the directory whose name matches this shell pattern (default: *).'),
+        make_option('-j', '--jobs', action='store', dest='jobs', type='int', default=1, metavar="N",
+            help='Number of worker processes that parse zone files in parallel.'),
         make_option('-o', '--overwrite', action='store_true', dest='overwrite',
             help='Overwrite existing zones.'),
     )
     
     def handle(self, *zonefiles, **options):
+        directory = options.get('directory')
+        pattern = options.get('pattern')
+        jobs = options.get('jobs')
         overwrite = options.get('overwrite')
         verbosity = int(options.get('verbosity', 1))
-
+        
+        if jobs < 1:
+            raise CommandError('The number of jobs must be a positive integer.')
+        elif directory and not os.path.isdir(directory):
+            raise CommandError('Expected path to directory: %s' % directory)
+        
+        # Zone file arguments may also be shell patterns. Arguments that are
+        # not files are reported as failed.
+        paths = []
+        missing = []
         for zonefile in zonefiles:
-            if os.path.isfile(zonefile):
-                f = open(zonefile, 'r')
-                data = f.read()
-                f.close()
-                try:
-                    process_zone_file(None, data, overwrite=overwrite)
-                except Exception, e:
-                    sys.stderr.write('error: %s: %s\n' % (str(e), zonefile))
-                    sys.stderr.flush()
+            for path in sorted(glob.glob(zonefile)) or [zonefile]:
+                if os.path.isfile(path):
+                    paths.append(path)
                 else:
+                    missing.append(path)
+        if directory:
+            # Subdirectories of the directory are not imported
+            paths.extend([path for path in sorted(glob.glob(os.path.join(directory, pattern)))
+                if os.path.isfile(path)])
+        
+        # Zone files are parsed by worker processes. The parsed zone data is
+        # written to the database by the current process using bulk inserts.
+        if jobs == 1 or len(paths) < 2:
+            results = (parse_zone_file_data(path) for path in paths)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes=jobs)
+            results = pool.imap_unordered(parse_zone_file_data, paths)
+        
+        failed = []
+        for zonefile in missing:
+            failed.append(zonefile)
+            sys.stderr.write('error: No such file: %s\n' % zonefile)
+            sys.stderr.flush()
+        try:
+            for zonefile, origin, rr_data, error in results:
+                if error is None:
+                    try:
+                        import_zone_rr_data(origin, rr_data, overwrite=overwrite)
+                    except Exception, e:
+                        error = str(e)
+                if error is None:
                     if verbosity:
                         sys.stdout.write('success: %s\n' % zonefile)
                         sys.stdout.flush()
-
+                else:
+                    failed.append(zonefile)
+                    sys.stderr.write('error: %s: %s\n' % (error, zonefile))
+                    sys.stderr.flush()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        
+        total = len(paths) + len(missing)
+        if verbosity and total > 1:
+            sys.stdout.write('%d zone files imported successfully, %d failed.\n' % (
+                total - len(failed), len(failed)))
+            for zonefile in failed:
+                sys.stdout.write('failed: %s\n' % zonefile)
+            sys.stdout.flush()
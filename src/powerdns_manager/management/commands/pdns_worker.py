@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+#  This file is part of django-powerdns-manager.
+#
+#  django-powerdns-manager is a web based PowerDNS administration panel.
+#
+#  Development Web Site:
+#    - http://www.codetrax.org/projects/django-powerdns-manager
+#  Public Source Code Repository:
+#    - https://source.codetrax.org/hgroot/django-powerdns-manager
+#
+#  Copyright 2012 George Notaras <gnot [at] g-loaded.eu>
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import sys
+import time
+import threading
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from powerdns_manager.maintenance import get_worker_id
+from powerdns_manager.maintenance import process_zone_jobs
+from powerdns_manager.maintenance import recover_zone_jobs
+
+
+
+class Command(BaseCommand):
+    
+    help = 'Process the zone maintenance jobs (rectify, serial update, export).'
+    args = ''
+    requires_model_validation = False
+    
+    option_list = BaseCommand.option_list + (
+        make_option('-t', '--threads', action='store', dest='threads', type='int', default=1, metavar="N",
+            help='Number of worker threads. Each thread uses its own database connection.'),
+        make_option('-s', '--sleep', action='store', dest='sleep', type='float', default=5, metavar="SECONDS",
+            help='Number of seconds to wait when there are no pending jobs.'),
+        make_option('--once', action='store_true', dest='once',
+            help='Exit when there are no pending jobs.'),
+    )
+    
+    def handle(self, *args, **options):
+        threads = options.get('threads')
+        sleep = options.get('sleep')
+        once = options.get('once')
+        verbosity = int(options.get('verbosity', 1))
+        
+        if threads < 1:
+            raise CommandError('The number of threads must be a positive integer.')
+        
+        recover_zone_jobs()
+        
+        if threads == 1:
+            self.work(sleep, once, verbosity)
+            return
+        
+        # Close the connections of the main thread. Each thread opens its own.
+        for conn in connections.all():
+            conn.close()
+        
+        workers = []
+        for i in range(threads):
+            t = threading.Thread(target=self.work, args=(sleep, once, verbosity))
+            t.daemon = True
+            t.start()
+            workers.append(t)
+        
+        # Join with a timeout, so that KeyboardInterrupt is not blocked
+        while [worker for worker in workers if worker.is_alive()]:
+            for t in workers:
+                t.join(1)
+    
+    def work(self, sleep, once, verbosity):
+        worker_id = get_worker_id()
+        try:
+            while True:
+                n = process_zone_jobs(worker_id)
+                if n and verbosity >= 2:
+                    sys.stdout.write('%s: processed %d zones\n' % (worker_id, n))
+                    sys.stdout.flush()
+                if not n:
+                    if once:
+                        return
+                    time.sleep(sleep)
+                    recover_zone_jobs()
+        finally:
+            if threading.current_thread().name != 'MainThread':
+                for conn in connections.all():
+                    conn.close()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+#  This file is part of django-powerdns-manager.
+#
+#  django-powerdns-manager is a web based PowerDNS administration panel.
+#
+#  Development Web Site:
+#    - http://www.codetrax.org/projects/django-powerdns-manager
+#  Public Source Code Repository:
+#    - https://source.codetrax.org/hgroot/django-powerdns-manager
+#
+#  Copyright 2012 George Notaras <gnot [at] g-loaded.eu>
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.loading import cache
+
+from powerdns_manager.utils import update_zone_serials
+
+
+
+class Command(BaseCommand):
+    
+    help = 'Update the serials of zones.'
+    args = 'origin1 origin2 ...'
+    requires_model_validation = False
+    
+    option_list = BaseCommand.option_list + (
+        make_option('-a', '--all', action='store_true', dest='all',
+            help='Update the serials of all zones.'),
+        make_option('-d', '--domainfile', action='store', dest='domainfile', metavar="PATH",
+            help='The path of text file containing domain names. File format is one domain per line.'),
+    )
+    
+    def handle(self, *origins, **options):
+        update_all = options.get('all')
+        domainfile = options.get('domainfile')
+        verbosity = int(options.get('verbosity', 1))
+        
+        if update_all and (origins or domainfile):
+            raise CommandError('No origins should be specified when the --all switch is used.')
+        elif domainfile and not os.path.isfile(domainfile):
+            raise CommandError('error: Expected path to file')
+        elif not update_all and not origins and not domainfile:
+            raise CommandError('error: Missing domain')
+        
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        
+        if update_all:
+            domain_ids = list(Domain.objects.values_list('id', flat=True))
+        else:
+            origins = list(origins)
+            if domainfile:
+                f = open(domainfile, 'rb')
+                origins.extend( [line.strip() for line in f.readlines() if line.strip()] )
+                f.close()
+            domain_ids = []
+            existing = set()
+            for i in range(0, len(origins), 500):
+                for domain_id, name in Domain.objects.filter(
+                        name__in=origins[i:i+500]).values_list('id', 'name'):
+                    domain_ids.append(domain_id)
+                    existing.add(name)
+            for origin in origins:
+                if origin not in existing:
+                    sys.stderr.write('error: Zone does not exist: %s\n' % origin)
+                    sys.stderr.flush()
+        
+        soa_count = update_zone_serials(domain_ids)
+        
+        if verbosity:
+            sys.stdout.write('Updated the serials of %d zones.\n' % soa_count)
+            sys.stdout.flush()
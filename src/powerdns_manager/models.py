@@ -24,17 +24,22 @@
 #  limitations under the License.
 #
 
+import sys
+
 from django.db import models
 from django.db.models import signals
 from django.utils.translation import ugettext_lazy as _
 from django.db.models.loading import cache
 from django.core.urlresolvers import reverse
+from django.core.urlresolvers import get_script_prefix
+from django.utils import timezone
 
 from powerdns_manager import settings
 from powerdns_manager import signal_cb
-from powerdns_manager.utils import generate_serial
 from powerdns_manager.utils import generate_serial_timestamp
 from powerdns_manager.utils import generate_api_key
+from powerdns_manager.utils import invalidate_dynamic_zone_auth
+from powerdns_manager.utils import SoaContent
 
 
 
@@ -44,6 +49,26 @@ http://wiki.powerdns.com/trac/wiki/fields
 """
 
 
+# The parts of the zone export URL before and after the origin, by script prefix
+_export_zone_url_parts = {}
+
+def get_export_zone_url(origin):
+    """Returns the URL of the export view of the zone ``origin``.
+    
+    The URL is built from the parts of a reversed URL, which are computed once
+    for each script prefix, so that ``reverse()`` is not called for every zone
+    of the change list.
+    
+    """
+    script_prefix = get_script_prefix()
+    if script_prefix not in _export_zone_url_parts:
+        url = reverse('export_zone', kwargs={'origin': '__origin__'})
+        _export_zone_url_parts[script_prefix] = url.split('__origin__', 1)
+    prefix, suffix = _export_zone_url_parts[script_prefix]
+    return '%s%s%s' % (prefix, origin, suffix)
+
+
+
 class Domain(models.Model):
     """Model for PowerDNS domain."""
     
@@ -84,23 +109,60 @@ class Domain(models.Model):
 #        self.update_serial()
 #        return super(Domain, self).save(*args, **kwargs)
     
+    def get_soa(self, refresh=False):
+        """Returns the parsed content of the SOA record of the zone.
+        
+        Returns a ``utils.SoaContent`` instance, or None if a SOA record does
+        not exist for this zone. A ``ValueError`` is raised if the content of
+        the SOA record is malformed.
+        
+        The SOA record is retrieved once and is cached on this instance, so
+        that it can be used repeatedly within a unit of work, for instance
+        while the records of the zone are saved. The cache lives as long as
+        this instance and is only updated by ``save_soa()``. Changes made to
+        the SOA record in any other way, including through other ``Domain``
+        instances, are not seen until ``refresh`` is set to True.
+        
+        """
+        if refresh or not hasattr(self, '_soa_cache'):
+            Record = cache.get_model('powerdns_manager', 'Record')
+            soa_qs = Record.objects.filter(domain=self, type='SOA').values_list('id', 'content')
+            soa = None
+            for rr_id, rr_content in soa_qs[:1]:
+                soa = SoaContent.parse(rr_content, record_id=rr_id)
+            self._soa_cache = soa
+        return self._soa_cache
+    
+    def save_soa(self, soa):
+        """Writes ``soa`` to the SOA record of the zone using a single UPDATE.
+        
+        Accepts a ``utils.SoaContent`` instance, as returned by ``get_soa()``.
+        
+        """
+        Record = cache.get_model('powerdns_manager', 'Record')
+        Record.objects.filter(id=soa.record_id).update(
+            content=soa.to_content(),
+            change_date=generate_serial_timestamp(),
+            date_modified=timezone.now())
+        self._soa_cache = soa
+    
     def get_minimum_ttl(self):
         """Returns the minimum TTL.
         
-        The SOA record of the zone is retrieved and the minimum TTL is extracted
-        from the ``content`` field.
+        The minimum TTL is read from the SOA record of the zone. See
+        ``get_soa()``.
         
-        If a SOA record does not exist for this zone, PDNS_DEFAULT_RR_TTL
-        is returned from the settings..
+        If a SOA record does not exist for this zone, or its content is
+        malformed, PDNS_DEFAULT_RR_TTL is returned from the settings..
         
         """
-        Record = cache.get_model('powerdns_manager', 'Record')
         try:
-            soa_rr = Record.objects.get(domain=self, type='SOA')
-        except Record.DoesNotExist:
+            soa = self.get_soa()
+        except ValueError:
             return settings.PDNS_DEFAULT_RR_TTL
-        else:
-            return soa_rr.content.split()[-1]
+        if soa is None:
+            return settings.PDNS_DEFAULT_RR_TTL
+        return soa.minimum
     
     def set_minimum_ttl(self, new_minimum_ttl):
         """Sets the minimum TTL.
@@ -116,42 +178,36 @@ class Domain(models.Model):
         TODO: Investigate whether it is needed to perform any checks against settings.PDNS_DEFAULT_RR_TTL
         
         """
-        Record = cache.get_model('powerdns_manager', 'Record')
-        try:
-            soa_rr = Record.objects.get(domain=self, type='SOA')
-        except Record.DoesNotExist:
+        soa = self.get_soa(refresh=True)
+        if soa is None:
             raise Exception('SOA Resource Record does not exist.')
-        else:
-            bits = soa_rr.content.split()
-            bits[6] = new_minimum_ttl
-            soa_rr.content = ' '.join(bits)
-            soa_rr.save()
+        soa.minimum = int(new_minimum_ttl)
+        self.save_soa(soa)
     
     def update_serial(self):
         """Updates the serial of the zone (SOA record).
         
         SOA content:  primary hostmaster serial refresh retry expire default_ttl
         
+        See ``utils.update_zone_serials()``, which updates the serials of
+        many zones at once.
+        
         """
-        Record = cache.get_model('powerdns_manager', 'Record')
-        try:
-            soa_rr = Record.objects.get(domain=self, type='SOA')
-        except Record.DoesNotExist:
+        soa = self.get_soa(refresh=True)
+        if soa is None:
             raise Exception('SOA Resource Record does not exist.')
-        else:
-            bits = soa_rr.content.split()
-            bits[2] = str(generate_serial(serial_old=bits[2]))
-            soa_rr.content = ' '.join(bits)
-            soa_rr.save()
+        soa.update_serial()
+        self.save_soa(soa)
     
     def export_zone_html_link(self):
-        html_link = '<a href="%s"><strong>export zone</strong></a>' % reverse('export_zone', kwargs={'origin': self.name})
+        html_link = '<a href="%s"><strong>export zone</strong></a>' % get_export_zone_url(self.name)
         return html_link
     export_zone_html_link.allow_tags = True
     export_zone_html_link.short_description = 'Export'
 
-signal_cb.zone_saved.connect(signal_cb.rectify_zone_cb, sender=Domain)
-signal_cb.zone_saved.connect(signal_cb.update_zone_serial_cb, sender=Domain)
+# The zone is rectified and its serial is updated by the zone maintenance
+# scheduler. See ``maintenance.ZoneMaintenanceScheduler``.
+signal_cb.zone_saved.connect(signal_cb.schedule_zone_maintenance_cb, sender=Domain)
 
 
 class Record(models.Model):
@@ -194,9 +250,9 @@ class Record(models.Model):
         verbose_name_plural = _('records')
         get_latest_by = 'date_modified'
         ordering = ['type']
-        # The following index is created by a MySQL statement in ``sql/record.mysql.sql``
-        #     CREATE INDEX nametype_index ON records(name,type);
-        # SEE: http://stackoverflow.com/questions/1578195/django-create-index-non-unique-multiple-column
+        # The composite indexes on (name,type), (domain_id,type) and
+        # (domain_id,ordername) are created after syncdb by ``indexes.py``.
+        # See the ``checkindexes`` management command.
         
     def __unicode__(self):
         #return '%s %s' % (self.type, self.name)
@@ -230,6 +286,8 @@ class Record(models.Model):
         
         return super(Record, self).save(*args, **kwargs)
 
+# Create the composite indexes of the PowerDNS tables after syncdb
+signals.post_syncdb.connect(signal_cb.create_indexes_cb, sender=sys.modules[__name__])
 
 
 class SuperMaster(models.Model):
@@ -381,7 +439,7 @@ class DynamicZone(models.Model):
     """
     domain = models.ForeignKey('powerdns_manager.Domain', unique=True, related_name='%(app_label)s_%(class)s_domain', verbose_name=_('domain'), help_text=_("""Select the domain, the A and AAAA records of which might be updated dynamically over HTTP."""))
     is_dynamic = models.BooleanField(verbose_name=_('Dynamic zone'), help_text="""Check to mark this zone as dynamic. An API key will be generated for you so as to be able to update the A nd AAAA records IP addresses over HTTP.""")
-    api_key = models.CharField(max_length=24, null=True, verbose_name=_('API Key'), help_text="""The API key is generated automatically. To reset it, use the relevant action in the changelist view.""")
+    api_key = models.CharField(max_length=24, null=True, db_index=True, verbose_name=_('API Key'), help_text="""The API key is generated automatically. To reset it, use the relevant action in the changelist view.""")
     date_modified = models.DateTimeField(auto_now=True, verbose_name=_('Last Modified'))
     
     class Meta:
@@ -402,6 +460,9 @@ class DynamicZone(models.Model):
         
         If ``is_dynamic`` is not enabled, always set ``api_key`` to NULL.
         
+        The cached lookups of the previous and the current API key are
+        invalidated after the instance has been saved.
+        
         """
         if self.is_dynamic:
             if not self.api_key:
@@ -409,5 +470,69 @@ class DynamicZone(models.Model):
         else:
             self.api_key = None
         
-        return super(DynamicZone, self).save(*args, **kwargs)
+        old_api_keys = []
+        if self.pk:
+            old_api_keys = list(DynamicZone.objects.filter(pk=self.pk).values_list('api_key', flat=True))
+        
+        result = super(DynamicZone, self).save(*args, **kwargs)
+        invalidate_dynamic_zone_auth(self.api_key, *old_api_keys)
+        return result
+
+signals.post_delete.connect(signal_cb.invalidate_dynamic_zone_auth_cb, sender=DynamicZone)
+
+
+
+
+class ZoneJob(models.Model):
+    """Model for zone maintenance jobs.
+    
+    This is a PowerDNS Manager feature. Jobs are added by the zone maintenance
+    scheduler in ``queue`` mode and are processed by the ``pdns_worker``
+    management command.
+    
+    """
+    KIND_CHOICES = (
+        ('rectify', 'Rectify'),
+        ('serial', 'Update serial'),
+        ('export', 'Export zone file'),
+    )
+    domain = models.ForeignKey('powerdns_manager.Domain', related_name='%(app_label)s_%(class)s_domain', verbose_name=_('domain'), help_text=_("""The zone this job applies to."""))
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, verbose_name=_('kind'), help_text="""The kind of the job.""")
+    # Set by the worker that processes the job
+    locked_by = models.CharField(max_length=64, null=True, db_index=True, verbose_name=_('locked by'), help_text="""The worker processing this job.""")
+    attempts = models.PositiveIntegerField(default=0, verbose_name=_('attempts'), help_text="""The number of failed attempts to process this job.""")
+    last_error = models.TextField(blank=True, null=True, verbose_name=_('last error'), help_text="""The error of the last failed attempt.""")
+    date_created = models.DateTimeField(auto_now_add=True, verbose_name=_('Created on'))
+    
+    class Meta:
+        db_table = 'zonejobs'
+        verbose_name = _('zone job')
+        verbose_name_plural = _('zone jobs')
+        ordering = ['id']
+    
+    def __unicode__(self):
+        return u'%s %s' % (self.kind, self.domain_id)
+
 
+
+class ZoneLock(models.Model):
+    """Model for zone locks.
+    
+    This is a PowerDNS Manager feature. A worker holds the lock of a zone
+    while it processes the jobs of the zone, so that the maintenance of a
+    zone never runs concurrently.
+    
+    """
+    domain = models.ForeignKey('powerdns_manager.Domain', unique=True, related_name='%(app_label)s_%(class)s_domain', verbose_name=_('domain'), help_text=_("""The locked zone."""))
+    locked_by = models.CharField(max_length=64, verbose_name=_('locked by'), help_text="""The worker holding the lock.""")
+    date_created = models.DateTimeField(auto_now_add=True, verbose_name=_('Created on'))
+    # Refreshed periodically by the worker holding the lock
+    date_modified = models.DateTimeField(auto_now=True, verbose_name=_('Last Modified'))
+    
+    class Meta:
+        db_table = 'zonelocks'
+        verbose_name = _('zone lock')
+        verbose_name_plural = _('zone locks')
+    
+    def __unicode__(self):
+        return u'%s' % self.domain_id
@@ -62,3 +62,53 @@ PDNS_ENABLED_RR_TYPES = getattr(settings, 'PDNS_ENABLED_RR_TYPES', _DEFAULT_PDNS
 
 PDNS_ALLOW_WILDCARD_NAMES = getattr(settings, 'PDNS_ALLOW_WILDCARD_NAMES', True)
 
+
+# Number of resource records written by each bulk INSERT statement
+PDNS_BULK_INSERT_BATCH_SIZE = getattr(settings, 'PDNS_BULK_INSERT_BATCH_SIZE', 1000)
+
+# Maximum number of rows affected by each batched UPDATE statement
+PDNS_BULK_UPDATE_BATCH_SIZE = getattr(settings, 'PDNS_BULK_UPDATE_BATCH_SIZE', 500)
+
+# Number of records shown per page by each RR inline of the zone change view
+PDNS_RECORD_INLINE_PAGE_SIZE = getattr(settings, 'PDNS_RECORD_INLINE_PAGE_SIZE', 100)
+
+# Number of worker processes used to calculate NSEC3 hashes (1 disables the pool)
+PDNS_NSEC3_HASH_WORKERS = getattr(settings, 'PDNS_NSEC3_HASH_WORKERS', 1)
+
+# Minimum number of names that have to be hashed for the worker pool to be used
+PDNS_NSEC3_PARALLEL_THRESHOLD = getattr(settings, 'PDNS_NSEC3_PARALLEL_THRESHOLD', 10000)
+
+# Queue the dynamic IP updates and write them to the database in batches
+PDNS_DYNAMIC_UPDATE_QUEUE = getattr(settings, 'PDNS_DYNAMIC_UPDATE_QUEUE', False)
+
+# Number of seconds the dynamic IP updates are kept in the queue
+PDNS_DYNAMIC_UPDATE_QUEUE_DELAY = getattr(settings, 'PDNS_DYNAMIC_UPDATE_QUEUE_DELAY', 5)
+
+# Cache backends that are not shared by the processes of the project
+_PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_HAS_SHARED_CACHE = settings.CACHES.get('default', {}).get('BACKEND') not in _PROCESS_LOCAL_CACHE_BACKENDS
+
+# Number of seconds the API key lookups of the dynamic zones are cached (0 disables the cache).
+# Caching is only enabled by default if the default cache is shared by all processes.
+PDNS_API_KEY_CACHE_TIMEOUT = getattr(settings, 'PDNS_API_KEY_CACHE_TIMEOUT', _HAS_SHARED_CACHE and 300 or 0)
+
+# When the zones are rectified and their serials are updated after they have
+# been saved: 'immediate', 'request' (after the HTTP request), 'thread' or
+# 'queue' (by the pdns_worker command)
+PDNS_ZONE_MAINTENANCE_MODE = getattr(settings, 'PDNS_ZONE_MAINTENANCE_MODE', 'immediate')
+
+# Number of seconds the zone maintenance is delayed in 'thread' mode
+PDNS_ZONE_MAINTENANCE_DELAY = getattr(settings, 'PDNS_ZONE_MAINTENANCE_DELAY', 2)
+
+# Directory where the pdns_worker command exports the zone files of the maintained zones
+PDNS_ZONE_EXPORT_DIRECTORY = getattr(settings, 'PDNS_ZONE_EXPORT_DIRECTORY', None)
+
+# Number of seconds after which a zone lock of a worker is considered stale
+PDNS_WORKER_LOCK_TIMEOUT = getattr(settings, 'PDNS_WORKER_LOCK_TIMEOUT', 3600)
+
+# Number of times a failed zone job is retried
+PDNS_WORKER_MAX_ATTEMPTS = getattr(settings, 'PDNS_WORKER_MAX_ATTEMPTS', 3)
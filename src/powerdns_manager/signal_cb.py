@@ -24,9 +24,13 @@
 #  limitations under the License.
 #
 
+import sys
+
 import django.dispatch
 
-from powerdns_manager.utils import rectify_zone
+from powerdns_manager.utils import invalidate_dynamic_zone_auth
+from powerdns_manager.maintenance import schedule_zone_maintenance
+from powerdns_manager.indexes import create_missing_indexes
 
 
 
@@ -36,11 +40,23 @@ from powerdns_manager.utils import rectify_zone
 zone_saved = django.dispatch.Signal(providing_args=['instance'])
 
 
-def rectify_zone_cb(sender, **kwargs):
-    instance = kwargs['instance']   # powerdns_manager.Domain instance
-    rectify_zone(instance.name)
-
-def update_zone_serial_cb(sender, **kwargs):
+def schedule_zone_maintenance_cb(sender, **kwargs):
     instance = kwargs['instance']   # powerdns_manager.Domain instance
-    instance.update_serial()
-
+    schedule_zone_maintenance(instance.id)
+
+def invalidate_dynamic_zone_auth_cb(sender, **kwargs):
+    instance = kwargs['instance']   # powerdns_manager.DynamicZone instance
+    invalidate_dynamic_zone_auth(instance.api_key)
+
+def create_indexes_cb(sender, **kwargs):
+    # Sent by ``syncdb`` for every database. Composite indexes are created
+    # only in the database the PowerDNS tables are synchronized to.
+    try:
+        created = create_missing_indexes(kwargs['db'])
+    except NotImplementedError, e:
+        sys.stderr.write('Composite indexes were not created: %s\n' % e)
+        return
+    if int(kwargs.get('verbosity', 1)) >= 1:
+        for table, index_name, columns in created:
+            sys.stdout.write('Creating index %s on %s(%s)\n' % (
+                index_name, table, ','.join(columns)))
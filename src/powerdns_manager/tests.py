@@ -31,7 +31,60 @@ unittest). These will both pass when you run "manage.py test".
 Replace these with more appropriate tests for your application.
 """
 
+import os
+import sys
+import datetime
+import shutil
+import tempfile
+from StringIO import StringIO
+
 from django.test import TestCase
+from django.core.management import call_command
+from django.db import connections
+from django.db.models.loading import cache
+from django.utils import timezone
+
+from powerdns_manager import settings
+from powerdns_manager import maintenance
+from powerdns_manager.utils import process_zone_file
+from powerdns_manager.utils import rectify_zone
+from powerdns_manager.utils import Nsec3Hasher
+from powerdns_manager.utils import generate_zone_file
+from powerdns_manager.utils import iter_zone_files
+from powerdns_manager.indexes import get_table_indexes
+from powerdns_manager.indexes import get_missing_indexes
+from powerdns_manager.indexes import create_missing_indexes
+from powerdns_manager.management.commands.exportzones import get_zone_states
+
+
+ZONE_TEXT = """$ORIGIN example.org.
+$TTL 3600
+@       IN  SOA  ns1.example.org. hostmaster.example.org. 2012010101 28800 7200 604800 86400
+@       IN  NS   ns1.example.org.
+@       IN  NS   ns2.example.org.
+@       IN  MX   10 mail.example.org.
+ns1     IN  A    192.168.0.1
+ns2     IN  A    192.168.0.2
+mail    IN  A    192.168.0.3
+www     IN  CNAME mail.example.org.
+sub     IN  NS   ns1.sub.example.org.
+sub     IN  A    192.168.1.1
+txt     IN  TXT  "v=spf1 a" "-all"
+_sip._tcp IN SRV 10 20 5060 sip.example.org.
+@ IN AAAA 2001:db8::0:1
+"""
+
+
+def call_command_output(name, *args, **options):
+    """Runs a management command and returns its ``(stdout, stderr)``."""
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = StringIO(), StringIO()
+    try:
+        call_command(name, *args, **options)
+        return sys.stdout.getvalue(), sys.stderr.getvalue()
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -40,6 +93,883 @@ class SimpleTest(TestCase):
         """
         self.failUnlessEqual(1 + 1, 2)
 
+
+class ZoneImportTest(TestCase):
+    multi_db = True
+    
+    def test_import_zone(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Record = cache.get_model('powerdns_manager', 'Record')
+        
+        process_zone_file('example.org', ZONE_TEXT)
+        
+        the_domain = Domain.objects.get(name='example.org')
+        qs = Record.objects.filter(domain=the_domain)
+        self.assertEqual(qs.count(), 13)
+        self.assertEqual(qs.filter(type='A').count(), 4)
+        mx = qs.get(type='MX')
+        self.assertEqual((mx.prio, mx.content), (10, 'mail.example.org'))
+        self.assertEqual(qs.filter(change_date__isnull=True).count(), 0)
+        self.assertEqual(qs.get(type='SOA').content.split()[-1], '86400')
+    
+    def test_import_existing_zone(self):
+        process_zone_file('example.org', ZONE_TEXT)
+        self.assertRaises(Exception, process_zone_file, 'example.org', ZONE_TEXT)
+        process_zone_file('example.org', ZONE_TEXT, overwrite=True)
+    
+    def test_overwrite_zone(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Record = cache.get_model('powerdns_manager', 'Record')
+        
+        process_zone_file('example.org', ZONE_TEXT)
+        the_domain = Domain.objects.get(name='example.org')
+        soa_content = Record.objects.get(domain=the_domain, type='SOA').content
+        ids = dict(Record.objects.filter(domain=the_domain).values_list('id', 'name'))
+        # Move the modification date to the past, so that updates are detected
+        Record.objects.filter(domain=the_domain).update(date_modified=datetime.datetime(2000, 1, 1, tzinfo=timezone.utc))
+        
+        # Unchanged zone: no records are touched
+        process_zone_file('example.org', ZONE_TEXT, overwrite=True)
+        self.assertEqual(Record.objects.get(domain=the_domain, type='SOA').content, soa_content)
+        
+        zonetext = ZONE_TEXT.replace('www     IN  CNAME mail', 'www     IN  CNAME ns1')
+        zonetext = zonetext.replace('ns2     IN  A', 'ns2 60  IN  A')
+        zonetext = zonetext.replace('@ IN AAAA 2001:db8::0:1\n', 'ftp IN A 192.168.0.4\n')
+        process_zone_file('example.org', zonetext, overwrite=True)
+        
+        self.assertEqual(Domain.objects.get(name='example.org').id, the_domain.id)
+        qs = Record.objects.filter(domain=the_domain)
+        self.assertEqual(qs.count(), 13)
+        self.assertEqual(qs.get(name='www.example.org').content, 'ns1.example.org')
+        self.assertEqual(qs.get(name='ns2.example.org').ttl, 60)
+        self.assertEqual(qs.filter(type='AAAA').count(), 0)
+        # Unchanged records keep their ids
+        self.assertEqual(qs.get(name='ns2.example.org').id,
+            [k for k, v in ids.items() if v == 'ns2.example.org'][0])
+        # Updated records get a new modification date
+        self.assertTrue(qs.get(name='ns2.example.org').date_modified.year > 2000)
+        self.assertEqual(qs.get(name='ns1.example.org', type='A').date_modified.year, 2000)
+        self.assertNotEqual(qs.get(type='SOA').content, soa_content)
+    
+    def test_overwrite_zone_non_ascii(self):
+        from powerdns_manager.utils import parse_zone_file
+        from powerdns_manager.utils import get_zone_rr_data
+        from powerdns_manager.utils import import_zone_rr_data
+        Record = cache.get_model('powerdns_manager', 'Record')
+        # The TXT content returned by get_zone_rr_data() is UTF-8 encoded
+        rr_data = [rr[:2] + ('caf\xc3\xa9',) + rr[3:] if rr[1] == 'TXT' else rr
+            for rr in get_zone_rr_data(parse_zone_file('example.org', ZONE_TEXT))]
+        import_zone_rr_data('example.org', rr_data)
+        txt = Record.objects.get(domain__name='example.org', type='TXT')
+        self.assertEqual(txt.content, u'caf\xe9')
+        # Records with non-ASCII content are matched and kept
+        import_zone_rr_data('example.org', rr_data, overwrite=True)
+        self.assertEqual(Record.objects.get(domain__name='example.org', type='TXT').id, txt.id)
+    
+    def test_import_zone_directory(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ('example.org', 'example.net'):
+                f = open(os.path.join(directory, '%s.zone' % name), 'w')
+                f.write(ZONE_TEXT.replace('example.org', name))
+                f.close()
+            f = open(os.path.join(directory, 'broken.zone'), 'w')
+            f.write('garbage')
+            f.close()
+            call_command('importzones', directory=directory, pattern='*.zone', verbosity=0)
+        finally:
+            shutil.rmtree(directory)
+        
+        self.assertEqual(sorted(Domain.objects.values_list('name', flat=True)),
+            ['example.net', 'example.org'])
+    
+    def test_import_zone_files_parallel(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Record = cache.get_model('powerdns_manager', 'Record')
+        
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ('example.org', 'example.net', 'example.com'):
+                f = open(os.path.join(directory, '%s.zone' % name), 'w')
+                f.write(ZONE_TEXT.replace('example.org', name))
+                f.close()
+            f = open(os.path.join(directory, 'broken.zone'), 'w')
+            f.write('garbage')
+            f.close()
+            path = lambda name: os.path.join(directory, name)
+            
+            # Missing zone files are reported as failed
+            stdout, stderr = call_command_output('importzones', path('missing.zone'),
+                path('example.com.zone'), directory=directory, pattern='*.org.zone',
+                jobs=2, verbosity=1)
+            self.assertEqual(stderr, 'error: No such file: %s\n' % path('missing.zone'))
+            self.assertEqual(set(stdout.splitlines()), set([
+                'success: %s' % path('example.com.zone'),
+                'success: %s' % path('example.org.zone'),
+                '2 zone files imported successfully, 1 failed.',
+                'failed: %s' % path('missing.zone'),
+            ]))
+            
+            # The zones imported by the first run exist already
+            stdout, stderr = call_command_output('importzones', path('*.zone'),
+                jobs=2, verbosity=1)
+            self.assertTrue('Zone already exists. Consider using the "overwrite" option: %s'
+                % path('example.org.zone') in stderr)
+            self.assertEqual(set(stdout.splitlines()), set([
+                'success: %s' % path('example.net.zone'),
+                '1 zone files imported successfully, 3 failed.',
+                'failed: %s' % path('broken.zone'),
+                'failed: %s' % path('example.com.zone'),
+                'failed: %s' % path('example.org.zone'),
+            ]))
+        finally:
+            shutil.rmtree(directory)
+        
+        self.assertEqual(sorted(Domain.objects.values_list('name', flat=True)),
+            ['example.com', 'example.net', 'example.org'])
+        self.assertEqual(Record.objects.filter(domain__name='example.net').count(), 13)
+    
+    def test_import_axfr_concurrently(self):
+        from powerdns_manager.management.commands import importaxfr
+        from powerdns_manager.utils import parse_zone_file
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Record = cache.get_model('powerdns_manager', 'Record')
+        process_zone_file('example.org', ZONE_TEXT)
+        
+        def fake_transfer_zone(origin, nameserver):
+            if origin == 'example.net':
+                raise Exception('Transfer Failed')
+            return parse_zone_file(origin, ZONE_TEXT.replace('example.org', origin))
+        transfer_zone = importaxfr.transfer_zone
+        importaxfr.transfer_zone = fake_transfer_zone
+        try:
+            stdout, stderr = call_command_output('importaxfr', 'example.org', 'example.net',
+                'example.com', 'example.info', nameserver='192.0.2.1', concurrency=2, verbosity=1)
+        finally:
+            importaxfr.transfer_zone = transfer_zone
+        
+        self.assertEqual(sorted(Domain.objects.values_list('name', flat=True)),
+            ['example.com', 'example.info', 'example.org'])
+        self.assertEqual(Record.objects.filter(domain__name='example.info').count(), 13)
+        self.assertTrue('error: Transfer Failed: example.net\n' in stderr)
+        self.assertEqual(set(stdout.splitlines()), set([
+            'success: example.com',
+            'success: example.info',
+            '2 zones imported successfully, 2 failed.',
+            'failed: example.net',
+            'failed: example.org',
+        ]))
+
+
+class RectifyZoneTest(TestCase):
+    multi_db = True
+    
+    def setUp(self):
+        process_zone_file('example.org', ZONE_TEXT)
+        Record = cache.get_model('powerdns_manager', 'Record')
+        self.qs = Record.objects.filter(domain__name='example.org')
+    
+    def test_delegation(self):
+        delegation = self.qs.get(name='sub.example.org', type='NS')
+        self.assertEqual(delegation.auth, False)
+        self.assertNotEqual(delegation.ordername, None)
+        glue = self.qs.get(name='sub.example.org', type='A')
+        self.assertEqual((glue.auth, glue.ordername), (False, None))
+        self.assertEqual(self.qs.get(name='www.example.org').auth, True)
+        self.assertEqual(self.qs.filter(auth=True).count(), 11)
+    
+    def test_nsec3(self):
+        DomainMetadata = cache.get_model('powerdns_manager', 'DomainMetadata')
+        DomainMetadata.objects.create(domain=self.qs[0].domain,
+            kind='NSEC3PARAM', content='1 0 1 ab')
+        rectify_zone('example.org')
+        hasher = Nsec3Hasher('ab', 1)
+        www = self.qs.get(name='www.example.org')
+        self.assertEqual(www.ordername, hasher.hash_name('www.example.org'))
+        self.assertEqual(self.qs.get(name='sub.example.org', type='NS').ordername, None)
+    
+    def test_unchanged_records_are_not_updated(self):
+        # 3 SELECT queries, no UPDATE
+        self.assertNumQueries(3, rectify_zone, 'example.org', using='powerdns')
+
+
+class SoaContentTest(TestCase):
+    multi_db = True
+    
+    def test_soa_accessor(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Record = cache.get_model('powerdns_manager', 'Record')
+        process_zone_file('example.org', ZONE_TEXT)
+        the_domain = Domain.objects.get(name='example.org')
+        
+        # The SOA record is retrieved once
+        self.assertNumQueries(1, the_domain.get_minimum_ttl, using='powerdns')
+        self.assertNumQueries(0, the_domain.get_minimum_ttl, using='powerdns')
+        rr = Record(domain=the_domain, name='ftp.example.org', type='A', content='192.168.0.4')
+        self.assertNumQueries(1, rr.save, using='powerdns')
+        self.assertEqual(rr.ttl, 86400)
+        
+        the_domain.set_minimum_ttl(7200)
+        soa = Domain.objects.get(name='example.org').get_soa()
+        self.assertEqual((soa.refresh, soa.retry, soa.expire, soa.minimum), (28800, 7200, 604800, 7200))
+        self.assertEqual(soa.to_content(), Record.objects.get(type='SOA').content)
+
+
+class CompositeIndexTest(TestCase):
+    multi_db = True
+    
+    def test_indexes(self):
+        # The indexes have been created after syncdb
+        self.assertEqual(get_missing_indexes('powerdns'), [])
+        self.assertEqual(get_missing_indexes('default'), [])
+        indexes = get_table_indexes('records', 'powerdns')
+        self.assertEqual(indexes['domaintype_index'], ('domain_id', 'type'))
+        indexes = get_table_indexes('domains', 'powerdns')
+        self.assertEqual(indexes['domains_created_by_name'], ('created_by_id', 'name'))
+        
+        connections['powerdns'].cursor().execute('DROP INDEX recordorder')
+        self.assertEqual(get_missing_indexes('powerdns'),
+            [('records', 'recordorder', ('domain_id', 'ordername'))])
+        create_missing_indexes('powerdns')
+        self.assertEqual(get_missing_indexes('powerdns'), [])
+
+
+class ZoneMaintenanceTest(TestCase):
+    multi_db = True
+    
+    def setUp(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        process_zone_file('example.org', ZONE_TEXT)
+        self.domain = Domain.objects.get(name='example.org')
+    
+    def get_serial(self):
+        Record = cache.get_model('powerdns_manager', 'Record')
+        return int(Record.objects.get(domain=self.domain, type='SOA').content.split()[2])
+    
+    def test_batch(self):
+        scheduler = maintenance.ZoneMaintenanceScheduler(mode='immediate')
+        serial = self.get_serial()
+        with scheduler.batch():
+            scheduler.schedule(self.domain.id)
+            with scheduler.batch():
+                scheduler.schedule(self.domain.id)
+            self.assertEqual(self.get_serial(), serial)
+        self.assertEqual(self.get_serial(), serial + 1)
+        scheduler.schedule(self.domain.id)
+        self.assertEqual(self.get_serial(), serial + 2)
+    
+    def test_zone_saved_signal(self):
+        from powerdns_manager.signal_cb import zone_saved
+        serial = self.get_serial()
+        zone_saved.send(sender=self.domain.__class__, instance=self.domain)
+        self.assertEqual(self.get_serial(), serial + 1)
+    
+    def test_queue_mode(self):
+        ZoneJob = cache.get_model('powerdns_manager', 'ZoneJob')
+        scheduler = maintenance.ZoneMaintenanceScheduler(mode='queue')
+        serial = self.get_serial()
+        scheduler.schedule(self.domain.id)
+        scheduler.schedule(self.domain.id)
+        self.assertEqual(ZoneJob.objects.count(), 2)
+        self.assertEqual(self.get_serial(), serial)
+        # The zone is locked by another worker
+        self.assertTrue(maintenance.acquire_zone_lock(self.domain.id, 'other'))
+        self.assertFalse(maintenance.acquire_zone_lock(self.domain.id, 'worker'))
+        self.assertEqual(maintenance.process_zone_jobs('worker'), 0)
+        maintenance.release_zone_lock(self.domain.id, 'other')
+        self.assertEqual(maintenance.process_zone_jobs('worker'), 1)
+        self.assertEqual(ZoneJob.objects.count(), 0)
+        self.assertEqual(self.get_serial(), serial + 1)
+    
+    def test_stale_zone_locks(self):
+        ZoneJob = cache.get_model('powerdns_manager', 'ZoneJob')
+        ZoneLock = cache.get_model('powerdns_manager', 'ZoneLock')
+        maintenance.enqueue_zone_jobs([self.domain.id])
+        self.assertTrue(maintenance.acquire_zone_lock(self.domain.id, 'worker'))
+        ZoneJob.objects.update(locked_by='worker')
+        old = timezone.now() - datetime.timedelta(seconds=settings.PDNS_WORKER_LOCK_TIMEOUT + 60)
+        
+        # A lock created long ago, but refreshed by a running worker
+        ZoneLock.objects.update(date_created=old, date_modified=old)
+        self.assertTrue(maintenance.refresh_zone_lock(self.domain.id, 'worker'))
+        maintenance.recover_zone_jobs()
+        self.assertEqual(ZoneLock.objects.count(), 1)
+        self.assertEqual(ZoneJob.objects.filter(locked_by='worker').count(), 2)
+        
+        # A lock that has not been refreshed
+        ZoneLock.objects.update(date_modified=old)
+        maintenance.recover_zone_jobs()
+        self.assertEqual(ZoneLock.objects.count(), 0)
+        self.assertEqual(ZoneJob.objects.filter(locked_by__isnull=True).count(), 2)
+        self.assertFalse(maintenance.refresh_zone_lock(self.domain.id, 'worker'))
+    
+    def test_queue_mode_failed_jobs(self):
+        ZoneJob = cache.get_model('powerdns_manager', 'ZoneJob')
+        scheduler = maintenance.ZoneMaintenanceScheduler(mode='queue')
+        serial = self.get_serial()
+        scheduler.schedule(self.domain.id)
+        
+        def failing_run_zone_jobs(domain_id, kinds):
+            raise Exception('maintenance failed')
+        run_zone_jobs = maintenance.run_zone_jobs
+        maintenance.run_zone_jobs = failing_run_zone_jobs
+        try:
+            for i in range(settings.PDNS_WORKER_MAX_ATTEMPTS):
+                self.assertEqual(maintenance.process_zone_jobs('worker'), 1)
+        finally:
+            maintenance.run_zone_jobs = run_zone_jobs
+        # The failed jobs are not retried
+        self.assertEqual(maintenance.process_zone_jobs('worker'), 0)
+        self.assertEqual(set(ZoneJob.objects.values_list('attempts', 'last_error')),
+            set([(settings.PDNS_WORKER_MAX_ATTEMPTS, 'maintenance failed')]))
+        
+        # New maintenance of the zone is processed
+        scheduler.schedule(self.domain.id)
+        self.assertEqual(maintenance.process_zone_jobs('worker'), 1)
+        self.assertEqual(self.get_serial(), serial + 1)
+    
+    def test_thread_mode_failures(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        process_zone_file('example.com', ZONE_TEXT.replace('example.org', 'example.com'))
+        other_domain = Domain.objects.get(name='example.com')
+        scheduler = maintenance.ZoneMaintenanceScheduler(mode='thread', delay=3600)
+        scheduler.schedule(self.domain.id)
+        scheduler.schedule(other_domain.id)
+        scheduler._timer.cancel()
+        serial = self.get_serial()
+        
+        def failing_run_zone_maintenance(domain_ids):
+            if other_domain.id in domain_ids:
+                raise Exception('maintenance failed')
+            run_zone_maintenance(domain_ids)
+        run_zone_maintenance = maintenance.run_zone_maintenance
+        maintenance.run_zone_maintenance = failing_run_zone_maintenance
+        try:
+            scheduler._run_in_thread()
+            scheduler._timer.cancel()
+            # The failed zone is scheduled again
+            self.assertEqual(self.get_serial(), serial + 1)
+            self.assertEqual(scheduler._thread_pending, [other_domain.id])
+            for i in range(settings.PDNS_WORKER_MAX_ATTEMPTS - 1):
+                scheduler._run_in_thread()
+                if scheduler._timer is not None:
+                    scheduler._timer.cancel()
+        finally:
+            maintenance.run_zone_maintenance = run_zone_maintenance
+            if scheduler._timer is not None:
+                scheduler._timer.cancel()
+        # The zone is dropped after the last attempt
+        self.assertEqual(scheduler._thread_pending, [])
+        self.assertEqual(scheduler._timer, None)
+        self.assertEqual(scheduler._attempts, {})
+    
+    def test_request_mode(self):
+        scheduler = maintenance.ZoneMaintenanceScheduler(mode='request')
+        serial = self.get_serial()
+        scheduler.schedule(self.domain.id)
+        scheduler.schedule(self.domain.id)
+        self.assertEqual(self.get_serial(), serial)
+        scheduler.request_finished_cb(sender=None)
+        self.assertEqual(self.get_serial(), serial + 1)
+
+
+class Nsec3HasherTest(TestCase):
+    
+    def test_rfc5155_hashes(self):
+        # Test vectors from RFC 5155, Appendix A
+        hasher = Nsec3Hasher('aabbccdd', 12)
+        self.assertEqual(hasher.hash_name('example'), '0p9mhaveqvm6t7vbl5lop2u3t2rp3tom')
+        self.assertEqual(hasher.hash_names(['A.example', 'a.example.']), {
+            'A.example': '35mthgpgcu1qg68fab165klnsnk3dpvl',
+            'a.example.': '35mthgpgcu1qg68fab165klnsnk3dpvl',
+        })
+    
+    def test_parallel_hashing(self):
+        names = ['host%d.example' % i for i in range(50)]
+        serial_hashes = Nsec3Hasher('aabbccdd', 12).hash_names(names)
+        hasher = Nsec3Hasher('aabbccdd', 12, workers=2, parallel_threshold=10)
+        self.assertEqual(hasher.hash_names(names), serial_hashes)
+
+
+class ZoneExportTest(TestCase):
+    multi_db = True
+    
+    def test_export_zone(self):
+        process_zone_file('example.org', ZONE_TEXT)
+        lines = generate_zone_file('example.org').split('\r\n')
+        self.assertEqual(lines[0], '$ORIGIN example.org.')
+        self.assertTrue(lines[1].startswith('example.org. 3600 IN SOA ns1.example.org. hostmaster.example.org. '))
+        self.assertTrue('_sip._tcp.example.org. 3600 IN SRV 10 20 5060 sip.example.org.' in lines)
+        self.assertTrue('txt.example.org. 3600 IN TXT "v=spf1 a -all"' in lines)
+        self.assertTrue('example.org. 3600 IN MX 10 mail.example.org.' in lines)
+    
+    def test_export_many_zones(self):
+        process_zone_file('example.org', ZONE_TEXT)
+        process_zone_file('example.com', ZONE_TEXT.replace('example.org', 'example.com'))
+        zone_files = dict([(origin, ''.join(lines)) for origin, lines in iter_zone_files()])
+        self.assertEqual(zone_files, {
+            'example.org': generate_zone_file('example.org'),
+            'example.com': generate_zone_file('example.com'),
+        })
+    
+    def test_export_zone_file_view(self):
+        from django.contrib.auth.models import User
+        from django.core.urlresolvers import reverse
+        User.objects.create_superuser('admin', 'admin@example.org', 'secret')
+        self.client.login(username='admin', password='secret')
+        process_zone_file('example.org', ZONE_TEXT)
+        response = self.client.get(reverse('export_zone_file', kwargs={'origin': 'example.org'}))
+        self.assertEqual(response.status_code, 200)
+        if getattr(response, 'streaming', False):
+            # Django >= 1.5
+            content = ''.join(response.streaming_content)
+        else:
+            content = response.content
+        self.assertEqual(content, generate_zone_file('example.org'))
+    
+    def test_export_zones_failures(self):
+        from powerdns_manager.management.commands.exportzones import export_zones
+        Record = cache.get_model('powerdns_manager', 'Record')
+        process_zone_file('example.org', ZONE_TEXT)
+        process_zone_file('example.com', ZONE_TEXT.replace('example.org', 'example.com'))
+        Record.objects.filter(domain__name='example.com', type='MX').update(prio=None)
+        outdir = tempfile.mkdtemp()
+        try:
+            for prefetch in (False, True):
+                results = dict(export_zones(['example.com', 'example.org', 'example.net'], outdir, prefetch))
+                self.assertEqual(results['example.org'], None)
+                self.assertEqual(results['example.net'], 'zone not found')
+                self.assertNotEqual(results['example.com'], None)
+                self.assertEqual(sorted(os.listdir(outdir)), ['example.org.zone'])
+        finally:
+            shutil.rmtree(outdir)
+    
+    def test_incremental_export(self):
+        from powerdns_manager.management.commands.exportzones import MANIFEST_FILENAME
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        process_zone_file('example.org', ZONE_TEXT)
+        process_zone_file('example.com', ZONE_TEXT.replace('example.org', 'example.com'))
+        outdir = tempfile.mkdtemp()
+        
+        def export():
+            stdout, stderr = call_command_output('exportzones', all=True, directory=outdir,
+                incremental=True, verbosity=1)
+            self.assertEqual(stderr, '')
+            return sorted(line.split()[1] for line in stdout.splitlines()
+                if line.startswith('success: '))
+        
+        try:
+            self.assertEqual(export(), ['example.com', 'example.org'])
+            # Unchanged zones are skipped
+            self.assertEqual(export(), [])
+            # Zones whose serial has changed are exported again
+            Domain.objects.get(name='example.org').update_serial()
+            self.assertEqual(export(), ['example.org'])
+            # Zones whose modification date has changed are exported again
+            Domain.objects.filter(name='example.com').update(
+                date_modified=timezone.now() + datetime.timedelta(seconds=60))
+            self.assertEqual(export(), ['example.com'])
+            # Zones whose zone file has been deleted are exported again
+            os.remove(os.path.join(outdir, 'example.org.zone'))
+            self.assertEqual(export(), ['example.org'])
+            # Corrupt manifests are treated as empty
+            f = open(os.path.join(outdir, MANIFEST_FILENAME), 'w')
+            f.write('{"example.org": [')
+            f.close()
+            self.assertEqual(export(), ['example.com', 'example.org'])
+            self.assertEqual(export(), [])
+        finally:
+            shutil.rmtree(outdir)
+    
+    def test_export_zones_parallel(self):
+        process_zone_file('example.org', ZONE_TEXT)
+        process_zone_file('example.com', ZONE_TEXT.replace('example.org', 'example.com'))
+        outdir = tempfile.mkdtemp()
+        try:
+            # The forked worker processes read the in-memory test database
+            # they have inherited
+            stdout, stderr = call_command_output('exportzones', 'example.org', 'example.com',
+                'example.net', directory=outdir, jobs=2, verbosity=1)
+            self.assertEqual(sorted(os.listdir(outdir)), ['example.com.zone', 'example.org.zone'])
+            f = open(os.path.join(outdir, 'example.com.zone'))
+            try:
+                self.assertEqual(f.read(), generate_zone_file('example.com'))
+            finally:
+                f.close()
+        finally:
+            shutil.rmtree(outdir)
+        self.assertEqual(stderr, 'error: zone not found: example.net\n')
+        self.assertEqual(set(stdout.splitlines()), set([
+            'success: example.com',
+            'success: example.org',
+            '2 zones exported successfully, 1 failed.',
+            'failed: example.net',
+        ]))
+    
+    def test_zone_states_of_many_origins(self):
+        process_zone_file('example.org', ZONE_TEXT)
+        origins = ['zone%d.example.org' % i for i in range(1200)] + ['example.org']
+        self.assertEqual(get_zone_states(origins).keys(), ['example.org'])
+    
+    def test_export_reimport(self):
+        process_zone_file('example.org', ZONE_TEXT)
+        Record = cache.get_model('powerdns_manager', 'Record')
+        qs = Record.objects.filter(domain__name='example.org')
+        exported_rrs = set(qs.exclude(type='SOA').values_list('name', 'type', 'content', 'ttl', 'prio'))
+        process_zone_file('example.org', generate_zone_file('example.org'), overwrite=True)
+        self.assertEqual(set(qs.exclude(type='SOA').values_list('name', 'type', 'content', 'ttl', 'prio')), exported_rrs)
+
+
+class DynamicIPUpdateTest(TestCase):
+    multi_db = True
+    
+    def setUp(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        DynamicZone = cache.get_model('powerdns_manager', 'DynamicZone')
+        process_zone_file('example.org', ZONE_TEXT)
+        self.domain = Domain.objects.get(name='example.org')
+        self.dyn_zone = DynamicZone.objects.create(domain=self.domain, is_dynamic=True)
+    
+    def update(self, **data):
+        from django.core.urlresolvers import reverse
+        data.setdefault('api_key', self.dyn_zone.api_key)
+        return self.client.post(reverse('dynamic_ip_update'), data)
+    
+    def get_soa_content(self):
+        Record = cache.get_model('powerdns_manager', 'Record')
+        return Record.objects.get(domain=self.domain, type='SOA').content
+    
+    def test_update_hostname(self):
+        Record = cache.get_model('powerdns_manager', 'Record')
+        soa_content = self.get_soa_content()
+        response = self.update(hostname='ns2.example.org', ipv4='10.1.2.3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Record.objects.get(name='ns2.example.org', type='A').content, '10.1.2.3')
+        self.assertEqual(Record.objects.get(name='ns1.example.org', type='A').content, '192.168.0.1')
+        self.assertNotEqual(self.get_soa_content(), soa_content)
+    
+    def test_unchanged_ip(self):
+        soa_content = self.get_soa_content()
+        response = self.update(hostname='ns1.example.org', ipv4='192.168.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_soa_content(), soa_content)
+    
+    def test_update_queue(self):
+        from powerdns_manager.update_queue import DynamicUpdateQueue
+        Record = cache.get_model('powerdns_manager', 'Record')
+        soa_content = self.get_soa_content()
+        queue = DynamicUpdateQueue(delay=3600)
+        queue.put(self.domain.id, 'ns1.example.org', 'A', '10.0.0.1')
+        queue.put(self.domain.id, 'ns1.example.org', 'A', '10.0.0.2')
+        queue.put(self.domain.id, 'ns2.example.org', 'A', '10.0.0.3')
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.flush(), 2)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(Record.objects.get(name='ns1.example.org', type='A').content, '10.0.0.2')
+        self.assertEqual(Record.objects.get(name='ns2.example.org', type='A').content, '10.0.0.3')
+        # The serial is updated once per flush
+        soa_bits = self.get_soa_content().split()
+        self.assertEqual(int(soa_bits[2]), int(soa_content.split()[2]) + 1)
+    
+    def test_update_queue_failures(self):
+        from powerdns_manager import update_queue
+        Record = cache.get_model('powerdns_manager', 'Record')
+        queue = update_queue.DynamicUpdateQueue(delay=3600)
+        failing_domain_id = self.domain.id + 1000
+        queue.put(failing_domain_id, 'ns1.example.com', 'A', '10.0.0.1')
+        queue.put(self.domain.id, 'ns1.example.org', 'A', '10.0.0.2')
+        
+        def failing_update_dynamic_rr_ip(domain_id, hostname, rr_type, rr_ip):
+            if domain_id == failing_domain_id:
+                raise Exception('update failed')
+            return update_dynamic_rr_ip(domain_id, hostname, rr_type, rr_ip)
+        update_dynamic_rr_ip = update_queue.update_dynamic_rr_ip
+        update_queue.update_dynamic_rr_ip = failing_update_dynamic_rr_ip
+        try:
+            self.assertEqual(queue.flush(), 1)
+        finally:
+            update_queue.update_dynamic_rr_ip = update_dynamic_rr_ip
+        self.assertEqual(Record.objects.get(name='ns1.example.org', type='A').content, '10.0.0.2')
+    
+    def test_api_key_cache(self):
+        from powerdns_manager.utils import get_dynamic_zone_auth
+        timeout = settings.PDNS_API_KEY_CACHE_TIMEOUT
+        settings.PDNS_API_KEY_CACHE_TIMEOUT = 300
+        try:
+            api_key = self.dyn_zone.api_key
+            self.assertEqual(get_dynamic_zone_auth(api_key), (self.domain.id, True))
+            self.assertNumQueries(0, get_dynamic_zone_auth, api_key, using='powerdns')
+            # Unknown API keys are not cached
+            self.assertEqual(get_dynamic_zone_auth('INVALID'), None)
+            self.assertNumQueries(1, get_dynamic_zone_auth, 'INVALID', using='powerdns')
+            # Resetting the API key invalidates the cached lookup
+            self.dyn_zone.api_key = None
+            self.dyn_zone.save()
+            self.assertEqual(get_dynamic_zone_auth(api_key), None)
+            self.assertEqual(get_dynamic_zone_auth(self.dyn_zone.api_key), (self.domain.id, True))
+            self.dyn_zone.delete()
+            self.assertEqual(self.update(ipv4='10.1.2.3').status_code, 400)
+        finally:
+            settings.PDNS_API_KEY_CACHE_TIMEOUT = timeout
+    
+    def test_unknown_hostname(self):
+        response = self.update(hostname='unknown.example.org', ipv4='10.1.2.3')
+        self.assertEqual(response.status_code, 404)
+        response = self.update(api_key='INVALID', ipv4='10.1.2.3')
+        self.assertEqual(response.status_code, 400)
+
+
+class ZoneChangeViewTest(TestCase):
+    multi_db = True
+    
+    def setUp(self):
+        from django.contrib.auth.models import User
+        User.objects.create_superuser('admin', 'admin@example.org', 'secret')
+        self.client.login(username='admin', password='secret')
+        process_zone_file('example.org', ZONE_TEXT)
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        self.domain = Domain.objects.get(name='example.org')
+        self.page_size = settings.PDNS_RECORD_INLINE_PAGE_SIZE
+    
+    def tearDown(self):
+        settings.PDNS_RECORD_INLINE_PAGE_SIZE = self.page_size
+    
+    def change_view(self, data=None):
+        from django.core.urlresolvers import reverse
+        url = reverse('admin:powerdns_manager_domain_change', args=(self.domain.id,))
+        connection = connections['powerdns']
+        connection.use_debug_cursor = True
+        connection.queries = []
+        try:
+            if data is None:
+                response = self.client.get(url)
+            else:
+                response = self.client.post(url, data)
+        finally:
+            connection.use_debug_cursor = False
+        record_queries = [q for q in connection.queries
+            if q['sql'].startswith('SELECT') and 'FROM "records"' in q['sql']]
+        return response, record_queries
+    
+    def test_record_inlines(self):
+        response, record_queries = self.change_view()
+        self.assertEqual(response.status_code, 200)
+        # The number of records per type and all the records are retrieved
+        # with two queries
+        self.assertEqual(len(record_queries), 2)
+        formsets = dict([(ifs.formset.rr_type, ifs.formset)
+            for ifs in response.context['inline_admin_formsets']
+            if hasattr(ifs.formset, 'rr_type')])
+        self.assertEqual(len(formsets['A'].forms), 4)
+        self.assertEqual(len(formsets['NS'].forms), 3)
+        self.assertEqual(len(formsets['SOA'].forms), 1)
+        
+        # Submit the change form with a modified A record
+        data = {'name': 'example.org', 'type': 'NATIVE', 'master': ''}
+        for ifs in response.context['inline_admin_formsets']:
+            formset = ifs.formset
+            for name, field in formset.management_form.fields.items():
+                value = formset.management_form[name].value()
+                if value is not None:
+                    # MAX_NUM_FORMS is None on Django 1.4
+                    data[formset.management_form.add_prefix(name)] = value
+            for form in formset.forms:
+                for name in form.fields:
+                    value = form[name].value()
+                    if value is not None:
+                        data[form.add_prefix(name)] = value
+        a_form = formsets['A'].forms[0]
+        data[a_form.add_prefix('content')] = '10.0.0.1'
+        response, record_queries = self.change_view(data)
+        self.assertEqual(response.status_code, 302)
+        Record = cache.get_model('powerdns_manager', 'Record')
+        self.assertEqual(Record.objects.get(id=a_form.instance.id).content, '10.0.0.1')
+    
+    def test_paginated_record_inlines(self):
+        settings.PDNS_RECORD_INLINE_PAGE_SIZE = 3
+        get_formsets = lambda response: dict([(ifs.formset.rr_type, ifs.formset)
+            for ifs in response.context['inline_admin_formsets']
+            if hasattr(ifs.formset, 'rr_type')])
+        response, record_queries = self.change_view()
+        formsets = get_formsets(response)
+        # The A records do not fit in a single page
+        self.assertEqual([f.instance.name for f in formsets['A'].forms],
+            ['mail.example.org', 'ns1.example.org', 'ns2.example.org'])
+        self.assertEqual(formsets['A'].pager['page'].paginator.num_pages, 2)
+        self.assertEqual(formsets['A'].pager['next_url'], '?a_page=2')
+        self.assertEqual(len(formsets['NS'].forms), 3)
+        self.assertEqual(formsets['NS'].pager, None)
+        self.assertContains(response, 'Page 1 of 2 (4 records)')
+        self.assertContains(response, 'The zone has unsaved changes')
+        
+        response = self.client.get(response.request['PATH_INFO'], {'a_page': 2})
+        formsets = get_formsets(response)
+        self.assertEqual([f.instance.name for f in formsets['A'].forms], ['sub.example.org'])
+        
+        response = self.client.get(response.request['PATH_INFO'], {'a_q': 'ns'})
+        formsets = get_formsets(response)
+        self.assertEqual([f.instance.name for f in formsets['A'].forms],
+            ['ns1.example.org', 'ns2.example.org'])
+
+
+class ExportPermissionTest(TestCase):
+    multi_db = True
+    
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_user('reseller', 'reseller@example.org', 'secret')
+        self.client.login(username='reseller', password='secret')
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        process_zone_file('example.org', ZONE_TEXT)
+        process_zone_file('example.com', ZONE_TEXT.replace('example.org', 'example.com'))
+        self.own_domain = Domain.objects.get(name='example.org')
+        self.own_domain.created_by = self.user
+        self.own_domain.save()
+        self.other_domain = Domain.objects.get(name='example.com')
+    
+    def test_export_views(self):
+        from django.core.urlresolvers import reverse
+        # Non-superusers may only export the zones they have created
+        response = self.client.get(reverse('export_zone', kwargs={'origin': 'example.org'}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('export_zone', kwargs={'origin': 'example.com'}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('export_zone_file', kwargs={'origin': 'example.org'}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('export_zone_file', kwargs={'origin': 'example.com'}))
+        self.assertEqual(response.status_code, 404)
+
+
+class ZoneActionTest(TestCase):
+    multi_db = True
+    
+    def setUp(self):
+        from django.contrib.auth.models import User
+        User.objects.create_superuser('admin', 'admin@example.org', 'secret')
+        self.client.login(username='admin', password='secret')
+        process_zone_file('example.org', ZONE_TEXT)
+        process_zone_file('example.com', ZONE_TEXT.replace('example.org', 'example.com'))
+    
+    def run_action(self, action, follow=False, **data):
+        from django.core.urlresolvers import reverse
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        data.update({
+            'action': action,
+            'post': 'yes',
+            '_selected_action': list(Domain.objects.values_list('id', flat=True)),
+        })
+        return self.client.post(reverse('admin:powerdns_manager_domain_changelist'), data, follow=follow)
+    
+    def test_changelist(self):
+        from django.core.urlresolvers import reverse
+        Record = cache.get_model('powerdns_manager', 'Record')
+        connection = connections['powerdns']
+        connection.use_debug_cursor = True
+        connection.queries = []
+        try:
+            response = self.client.get(reverse('admin:powerdns_manager_domain_changelist'))
+        finally:
+            connection.use_debug_cursor = False
+        self.assertEqual(response.status_code, 200)
+        # The number of the zones and the zones with their record counts and
+        # SOA records
+        self.assertEqual(len(connection.queries), 2)
+        self.assertEqual(response.context['cl'].result_list[0].record_count, 13)
+        soa_content = Record.objects.get(domain__name='example.org', type='SOA').content
+        self.assertContains(response, '<td>%s</td>' % soa_content.split()[2])
+        self.assertContains(response, '<a href="/powerdns/export/example.org/">')
+        # Sorting by the number of records
+        response = self.client.get(reverse('admin:powerdns_manager_domain_changelist'), {'o': '-3'})
+        self.assertEqual(response.status_code, 200)
+    
+    def test_set_ttl_bulk(self):
+        from django.contrib.admin.models import LogEntry
+        Record = cache.get_model('powerdns_manager', 'Record')
+        soa_serials = dict(Record.objects.filter(type='SOA').values_list('domain', 'content'))
+        new_ttl = settings.PDNS_DEFAULT_RR_TTL
+        response = self.run_action('set_ttl_bulk', new_ttl=new_ttl, reset_zone_minimum='on')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(Record.objects.values_list('ttl', flat=True)), set([new_ttl]))
+        for domain_id, content in Record.objects.filter(type='SOA').values_list('domain', 'content'):
+            bits = content.split()
+            self.assertEqual(bits[6], str(new_ttl))
+            self.assertNotEqual(bits[2], soa_serials[domain_id].split()[2])
+        self.assertEqual(LogEntry.objects.count(), 2)
+    
+    def test_set_domain_type_bulk(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Record = cache.get_model('powerdns_manager', 'Record')
+        soa_serials = dict(Record.objects.filter(type='SOA').values_list('domain', 'content'))
+        response = self.run_action('set_domain_type_bulk', domaintype='MASTER')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(Domain.objects.values_list('type', flat=True)), set(['MASTER']))
+        for domain_id, content in Record.objects.filter(type='SOA').values_list('domain', 'content'):
+            self.assertNotEqual(content.split()[2], soa_serials[domain_id].split()[2])
+    
+    def test_force_serial_update(self):
+        Record = cache.get_model('powerdns_manager', 'Record')
+        get_serials = lambda: dict([(name, int(content.split()[2])) for name, content in
+            Record.objects.filter(type='SOA').values_list('domain__name', 'content')])
+        serials = get_serials()
+        self.run_action('force_serial_update')
+        call_command('updateserials', 'example.org', verbosity=0)
+        call_command('updateserials', all=True, verbosity=0)
+        self.assertEqual(get_serials(), {
+            'example.org': serials['example.org'] + 3,
+            'example.com': serials['example.com'] + 2,
+        })
+    
+    def test_malformed_soa(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Record = cache.get_model('powerdns_manager', 'Record')
+        Record.objects.filter(domain__name='example.com', type='SOA').update(content='ns1.example.com')
+        soa_content = Record.objects.get(domain__name='example.org', type='SOA').content
+        for action, data in (('force_serial_update', {}),
+                ('set_ttl_bulk', {'new_ttl': settings.PDNS_DEFAULT_RR_TTL, 'reset_zone_minimum': 'on'}),
+                ('set_domain_type_bulk', {'domaintype': 'MASTER'})):
+            response = self.run_action(action, follow=True, **data)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'their SOA record is malformed: example.com')
+        self.assertNotEqual(Record.objects.get(domain__name='example.org', type='SOA').content, soa_content)
+        self.assertEqual(Record.objects.get(domain__name='example.com', type='SOA').content, 'ns1.example.com')
+        self.assertEqual(set(Domain.objects.values_list('type', flat=True)), set(['MASTER']))
+        # Records of zones with malformed SOA content get the default TTL
+        the_domain = Domain.objects.get(name='example.com')
+        self.assertEqual(the_domain.get_minimum_ttl(), settings.PDNS_DEFAULT_RR_TTL)
+        self.assertEqual(get_zone_states(['example.com'])['example.com'][0], None)
+    
+    def test_clone_zone(self):
+        from django.contrib.admin.models import LogEntry
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Record = cache.get_model('powerdns_manager', 'Record')
+        Domain.objects.filter(name='example.com').delete()
+        response = self.run_action('clone_zone', clone_domain_name='example.net\nexample.info')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Domain.objects.count(), 3)
+        self.assertEqual(LogEntry.objects.count(), 2)
+        for clone_name in ('example.net', 'example.info'):
+            qs = Record.objects.filter(domain__name=clone_name)
+            self.assertEqual(qs.count(), 13)
+            self.assertEqual(qs.get(type='MX').content, 'mail.%s' % clone_name)
+            self.assertTrue(qs.get(type='SOA').content.startswith('ns1.%s hostmaster.%s ' % (clone_name, clone_name)))
+            self.assertEqual(qs.filter(auth=False).count(), 2)
+    
+    def test_clone_zone_without_names(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Domain.objects.filter(name='example.com').delete()
+        response = self.run_action('clone_zone', clone_domain_name=' \n  ')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Enter at least one domain name.')
+        self.assertEqual(Domain.objects.count(), 1)
+    
+    def test_clone_zone_command(self):
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        call_command('clonezone', 'example.org', 'example.net', 'example.com', verbosity=0)
+        self.assertEqual(Domain.objects.count(), 3)
+
+
 __test__ = {"doctest": """
 Another way to test that 1 + 1 is equal to 2.
 
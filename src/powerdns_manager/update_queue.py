@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+#  This file is part of django-powerdns-manager.
+#
+#  django-powerdns-manager is a web based PowerDNS administration panel.
+#
+#  Development Web Site:
+#    - http://www.codetrax.org/projects/django-powerdns-manager
+#  Public Source Code Repository:
+#    - https://source.codetrax.org/hgroot/django-powerdns-manager
+#
+#  Copyright 2012 George Notaras <gnot [at] g-loaded.eu>
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import atexit
+import threading
+
+from django.db import connections
+from django.db import router
+from django.db.models.loading import cache
+from django.utils.datastructures import SortedDict
+
+from powerdns_manager import settings
+from powerdns_manager.utils import commit_on_success_unless_managed
+from powerdns_manager.utils import update_dynamic_rr_ip
+from powerdns_manager.utils import logger
+
+
+
+class DynamicUpdateQueue(object):
+    """Write-behind queue for the dynamic IP updates.
+    
+    The updates are coalesced per (zone, hostname, type), so that only the
+    most recent IP address of a resource record is written, and are flushed
+    ``delay`` seconds after the first update has been queued. Each zone is
+    updated in a single transaction and its serial is updated once per flush,
+    if any of its resource records has changed.
+    
+    The queue is kept in the memory of the current process. Queued updates
+    that have not been flushed are lost if the process is killed.
+    
+    """
+    def __init__(self, delay=None):
+        if delay is None:
+            delay = settings.PDNS_DYNAMIC_UPDATE_QUEUE_DELAY
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pending = SortedDict()
+        self._timer = None
+    
+    def put(self, domain_id, hostname, rr_type, rr_ip):
+        """Queues an update of the IP address of the A or AAAA records.
+        
+        If ``hostname`` is empty, all the records of the zone with the
+        specified type are updated.
+        
+        """
+        key = (domain_id, hostname or None, rr_type)
+        self._lock.acquire()
+        try:
+            # The latest update is applied last
+            if key in self._pending:
+                del self._pending[key]
+            self._pending[key] = rr_ip
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+        finally:
+            self._lock.release()
+    
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            # Close the database connections of the timer thread
+            for conn in connections.all():
+                conn.close()
+    
+    def flush(self):
+        """Writes the queued updates to the database.
+        
+        Returns the number of the resource records that have changed.
+        
+        Each zone is updated separately. Zones that no longer exist are
+        skipped and failures are logged, so that a failing zone does not
+        prevent the updates of the rest of the zones.
+        
+        """
+        self._lock.acquire()
+        try:
+            pending = self._pending
+            self._pending = SortedDict()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        finally:
+            self._lock.release()
+        
+        if not pending:
+            return 0
+        
+        # Group updates by zone
+        zones = SortedDict()
+        for (domain_id, hostname, rr_type), rr_ip in pending.items():
+            zones.setdefault(domain_id, []).append((hostname, rr_type, rr_ip))
+        
+        Domain = cache.get_model('powerdns_manager', 'Domain')
+        Record = cache.get_model('powerdns_manager', 'Record')
+        db = router.db_for_write(Record)
+        
+        changed = 0
+        for domain_id, updates in zones.items():
+            try:
+                with commit_on_success_unless_managed(using=db):
+                    zone_changed = 0
+                    for hostname, rr_type, rr_ip in updates:
+                        zone_changed += update_dynamic_rr_ip(domain_id, hostname, rr_type, rr_ip)
+                    if zone_changed:
+                        Domain.objects.get(id=domain_id).update_serial()
+            except Domain.DoesNotExist:
+                # The zone has been deleted after the updates were queued
+                continue
+            except Exception:
+                logger.exception('Dynamic IP updates of zone %s failed', domain_id)
+                continue
+            changed += zone_changed
+        return changed
+    
+    def __len__(self):
+        return len(self._pending)
+
+
+# Queue used by ``views.dynamic_ip_update_view`` if
+# PDNS_DYNAMIC_UPDATE_QUEUE is enabled.
+dynamic_update_queue = DynamicUpdateQueue()
+
+# Flush the queued updates when the process exits normally
+atexit.register(dynamic_update_queue.flush)
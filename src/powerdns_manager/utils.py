@@ -24,13 +24,16 @@
 #  limitations under the License.
 #
 
+import os
 import datetime
 import time
+import tempfile
 import hashlib
 import base64
 import string
-import StringIO
 import re
+import multiprocessing
+import logging
 
 import dns.zone
 import dns.query
@@ -45,14 +48,49 @@ import dns.rdtypes.IN
 from dns.rdtypes.IN import *
 from dns.name import Name
 
+from django.db import connections
+from django.db import router
+from django.db import transaction
+from django.db.models import Q
 from django.db.models.loading import cache
+from django.core.cache import cache as data_cache
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.utils import timezone
 from django.utils.crypto import get_random_string
+from django.utils.encoding import smart_str
+from django.utils.encoding import smart_unicode
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_ipv46_address
 
 from powerdns_manager import settings
 
 
+# Failures of background tasks, like the zone maintenance and the dynamic
+# update queue, are logged. The logger has to be configured in the LOGGING
+# setting of the Django project.
+logger = logging.getLogger('powerdns_manager')
+logger.addHandler(logging.NullHandler())
+
+
+class _NoTransaction(object):
+    def __enter__(self):
+        pass
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+def commit_on_success_unless_managed(using=None):
+    """Returns a context manager that works like ``commit_on_success()``.
+    
+    If transactions are already managed, for instance within another
+    ``commit_on_success()`` block, no new transaction block is started,
+    so that the transaction of the caller is not committed prematurely.
+    
+    """
+    if transaction.is_managed(using=using):
+        return _NoTransaction()
+    return transaction.commit_on_success(using=using)
+
 
 def validate_hostname(hostname,
         reject_ip=True, supports_cidr_notation=False, supports_wildcard=False):
@@ -177,6 +215,205 @@ def generate_api_key():
         length=24, allowed_chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
 
 
+class SoaContent(object):
+    """The parsed content of a SOA resource record.
+    
+    SOA content:  primary hostmaster serial refresh retry expire default_ttl
+    
+    ``record_id`` is the id of the ``Record`` instance the content has been
+    read from, if any.
+    
+    """
+    def __init__(self, primary, hostmaster, serial, refresh, retry, expire, minimum, record_id=None):
+        self.primary = primary
+        self.hostmaster = hostmaster
+        self.serial = int(serial)
+        self.refresh = int(refresh)
+        self.retry = int(retry)
+        self.expire = int(expire)
+        self.minimum = int(minimum)
+        self.record_id = record_id
+    
+    @classmethod
+    def parse(cls, content, record_id=None):
+        """Returns a ``SoaContent`` instance for ``content``.
+        
+        A ``ValueError`` is raised if ``content`` is not valid SOA content.
+        
+        """
+        bits = content.split()
+        if len(bits) != 7:
+            raise ValueError('Invalid SOA content: %s' % content)
+        return cls(*bits, **{'record_id': record_id})
+    
+    def update_serial(self):
+        """Sets the next serial. See ``generate_serial()``."""
+        self.serial = int(generate_serial(serial_old=str(self.serial)))
+    
+    def to_content(self):
+        """Returns the content of the SOA record."""
+        return '%s %s %d %d %d %d %d' % (self.primary, self.hostmaster,
+            self.serial, self.refresh, self.retry, self.expire, self.minimum)
+    
+    def __eq__(self, other):
+        return isinstance(other, SoaContent) and self.to_content() == other.to_content()
+    
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def _get_api_key_cache_key(api_key):
+    return 'powerdns_manager.api_key.%s' % api_key
+
+
+def get_dynamic_zone_auth(api_key):
+    """Looks up the dynamic zone that uses ``api_key``.
+    
+    Returns a ``(domain_id, is_dynamic)`` tuple, or None if no dynamic zone
+    uses the API key.
+    
+    Successful lookups are stored in the cache of the Django project for
+    ``PDNS_API_KEY_CACHE_TIMEOUT`` seconds, so that the dynamic IP updates
+    do not need to query the database. ``invalidate_dynamic_zone_auth()``
+    removes the cached lookups whenever a ``DynamicZone`` instance is saved
+    or deleted, which only reaches the other processes of the project if the
+    cache backend is shared. Unknown API keys are not cached.
+    
+    """
+    timeout = settings.PDNS_API_KEY_CACHE_TIMEOUT
+    cache_key = _get_api_key_cache_key(api_key)
+    if timeout:
+        auth = data_cache.get(cache_key)
+        if auth is not None:
+            return auth
+    
+    DynamicZone = cache.get_model('powerdns_manager', 'DynamicZone')
+    try:
+        auth = tuple(DynamicZone.objects.values_list(
+            'domain', 'is_dynamic').get(api_key__exact=api_key))
+    except DynamicZone.DoesNotExist:
+        return None
+    
+    if timeout:
+        data_cache.set(cache_key, auth, timeout)
+    return auth
+
+
+def invalidate_dynamic_zone_auth(*api_keys):
+    """Removes the cached lookups of the supplied API keys."""
+    cache_keys = [_get_api_key_cache_key(api_key) for api_key in api_keys if api_key]
+    if cache_keys:
+        data_cache.delete_many(cache_keys)
+
+
+def update_dynamic_zone_ips(domain_id, hostname=None, ipv4=None, ipv6=None):
+    """Updates the IP addresses of the A and AAAA records of a dynamic zone.
+    
+    domain_id: id of the ``Domain`` instance of the dynamic zone
+    hostname: name of the resource records to update. If missing, all the A
+        and/or AAAA records of the zone are updated.
+    ipv4: new content of the A records
+    ipv6: new content of the AAAA records
+    
+    The resource records are updated with conditional UPDATE statements, so
+    only the records whose content is actually different are written. The
+    serial of the zone is updated only if at least one record has changed.
+    
+    Returns a ``(matched, changed)`` tuple, where ``matched`` is True if
+    resource records suitable for the supplied IP addresses exist and
+    ``changed`` is the number of the records that have been updated.
+    
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    Record = cache.get_model('powerdns_manager', 'Record')
+    
+    rr_ips = get_dynamic_rr_ips(ipv4, ipv6)
+    if not rr_ips:
+        return False, 0
+    
+    changed = 0
+    with commit_on_success_unless_managed(using=router.db_for_write(Record)):
+        for rr_type, rr_ip in rr_ips:
+            changed += update_dynamic_rr_ip(domain_id, hostname, rr_type, rr_ip)
+        if changed:
+            Domain.objects.get(id=domain_id).update_serial()
+    
+    if changed:
+        return True, changed
+    # Records that already have the supplied IP addresses
+    return dynamic_rrs_exist(domain_id, hostname, rr_ips), 0
+
+
+def get_dynamic_rr_ips(ipv4=None, ipv6=None):
+    """Returns a list of (type, ip) tuples for the supplied IP addresses."""
+    rr_ips = []
+    if ipv4:
+        rr_ips.append(('A', ipv4))
+    if ipv6:
+        rr_ips.append(('AAAA', ipv6))
+    return rr_ips
+
+
+def _get_dynamic_rrs(domain_id, hostname=None):
+    Record = cache.get_model('powerdns_manager', 'Record')
+    qs = Record.objects.filter(domain__id=domain_id)
+    if hostname:
+        qs = qs.filter(name=hostname)
+    return qs
+
+
+def dynamic_rrs_exist(domain_id, hostname, rr_ips):
+    """Checks if resource records suitable for ``rr_ips`` exist in the zone.
+    
+    rr_ips: list of (type, ip) tuples, as returned by ``get_dynamic_rr_ips()``
+    
+    """
+    rr_types = [rr_type for rr_type, rr_ip in rr_ips]
+    return _get_dynamic_rrs(domain_id, hostname).filter(type__in=rr_types).exists()
+
+
+def update_dynamic_rr_ip(domain_id, hostname, rr_type, rr_ip):
+    """Sets the IP address of the A or AAAA records of a dynamic zone.
+    
+    Only the records whose content differs from ``rr_ip`` are updated. The
+    serial of the zone is not updated.
+    
+    Returns the number of the updated records.
+    
+    """
+    qs = _get_dynamic_rrs(domain_id, hostname)
+    return qs.filter(type=rr_type).exclude(content=rr_ip).update(
+        content=rr_ip,
+        change_date=generate_serial_timestamp(),
+        date_modified=timezone.now())
+
+
+def search_records(qs, search=None):
+    """Filters the Record queryset ``qs`` by the ``search`` term, which is
+    matched against the name and the content of the records.
+    
+    """
+    if search:
+        qs = qs.filter(Q(name__icontains=search) | Q(content__icontains=search))
+    return qs
+
+
+def get_record_page(records, page_number, page_size):
+    """Returns a ``Page`` of ``page_size`` items of ``records``.
+    
+    Invalid page numbers return the first page and page numbers out of range
+    return the last page.
+    
+    """
+    paginator = Paginator(records, page_size)
+    try:
+        return paginator.page(page_number or 1)
+    except PageNotAnInteger:
+        return paginator.page(1)
+    except EmptyPage:
+        return paginator.page(paginator.num_pages)
+
+
 def process_zone_file(origin, zonetext, overwrite=False):
     """Imports zone to the database.
     
@@ -185,6 +422,20 @@ def process_zone_file(origin, zonetext, overwrite=False):
     
 
     
+    """
+    zone = parse_zone_file(origin, zonetext)
+    process_and_import_zone_data(zone, overwrite)
+
+
+def parse_zone_file(origin, zonetext):
+    """Parses the text of a zone file.
+    
+    If ``origin`` is empty, the origin is set by the $ORIGIN directive of the
+    zone file.
+    
+    Returns the parsed zone (dns.zone). No database access takes place in
+    this function.
+    
     """
     if origin:
         origin = Name((origin.rstrip('.') + '.').split('.'))
@@ -199,8 +450,6 @@ def process_zone_file(origin, zonetext, overwrite=False):
         if not str(zone.origin).rstrip('.'):
             raise UnknownOrigin
         
-        process_and_import_zone_data(zone, overwrite)
-        
     except NoSOA:
         raise Exception('The zone has no SOA RR at its origin')
     except NoNS:
@@ -212,6 +461,8 @@ def process_zone_file(origin, zonetext, overwrite=False):
     except DNSException, e:
         #raise Exception(str(e))
         raise Exception('The zone is malformed')
+    
+    return zone
 
 
 def process_axfr_response(origin, nameserver, overwrite=False):
@@ -219,6 +470,20 @@ def process_axfr_response(origin, nameserver, overwrite=False):
     origin: string domain name
     nameserver: IP of the DNS server
     
+    """
+    zone = transfer_zone(origin, nameserver)
+    process_and_import_zone_data(zone, overwrite)
+
+
+def transfer_zone(origin, nameserver):
+    """Transfers a zone using an AXFR query.
+    
+    origin: string domain name
+    nameserver: IP of the DNS server
+    
+    Returns the transferred zone (dns.zone). No database access takes place
+    in this function.
+    
     """
     origin = Name((origin.rstrip('.') + '.').split('.'))
     axfr_query = dns.query.xfr(nameserver, origin, timeout=5, relativize=False, lifetime=10)
@@ -228,8 +493,6 @@ def process_axfr_response(origin, nameserver, overwrite=False):
         if not str(zone.origin).rstrip('.'):
             raise UnknownOrigin
         
-        process_and_import_zone_data(zone, overwrite)
-
     except NoSOA:
         raise Exception('The zone has no SOA RR at its origin')
     except NoNS:
@@ -243,11 +506,25 @@ def process_axfr_response(origin, nameserver, overwrite=False):
             raise Exception('Transfer Failed')
         raise Exception(str(e))
     
+    return zone
+    
 
-def process_and_import_zone_data(zone, overwrite=False):
-    """
+def get_zone_rr_data(zone):
+    """Returns the resource records of a zone as a list of tuples.
+    
     zone: dns.zone
     
+    Each item of the returned list is a tuple of the form::
+    
+        (name, type, content, ttl, prio)
+    
+    The values are formatted the way they are stored in the ``records``
+    table. Resource records of types that are not supported by the importer
+    are skipped.
+    
+    No database access takes place in this function, so it is safe to call
+    it in worker processes.
+    
     *****
     Special kudos to Grig Gheorghiu for demonstrating how to manage zone files
     using dnspython in the following article:
@@ -255,28 +532,11 @@ def process_and_import_zone_data(zone, overwrite=False):
     *****
     
     """
-    Domain = cache.get_model('powerdns_manager', 'Domain')
-    Record = cache.get_model('powerdns_manager', 'Record')
-    
-    # Check if zone already exists in the database.
-    try:
-        domain_instance = Domain.objects.get(name=str(zone.origin).rstrip('.'))
-    except Domain.DoesNotExist:
-        pass    # proceed with importing the new zone data
-    else:   # Zone exists
-        if overwrite:
-            # If ``overwrite`` has been checked, then delete the current zone.
-            domain_instance.delete()
-        else:
-            raise Exception('Zone already exists. Consider using the "overwrite" option')
+    rr_data = []
     
-    # Import the new zone data to the database.
-    
-    # Create a domain instance
-    the_domain = Domain.objects.create(name=str(zone.origin).rstrip('.'), type='NATIVE', master='')
-    
-    # Create RRs
     for name, node in zone.nodes.items():
+        # name is the dnspython node name
+        rr_name = str(name).rstrip('.')
         rdatasets = node.rdatasets
         
         for rdataset in rdatasets:
@@ -286,18 +546,13 @@ def process_and_import_zone_data(zone, overwrite=False):
 
             for rdata in rdataset:
                 
-                rr = Record(
-                    domain=the_domain,
-                    name=str(name).rstrip('.'), # name is the dnspython node name
-                    change_date=int(time.time()),
-                    ttl = rdataset.ttl
-                )
+                rr_prio = None
                 
                 if rdataset.rdtype == dns.rdatatype._by_text['SOA']:
                     # Set type
-                    rr.type = 'SOA'
+                    rr_type = 'SOA'
                     # Construct content
-                    rr.content = '%s %s %s %s %s %s %s' % (
+                    rr_content = '%s %s %s %s %s %s %s' % (
                         str(rdata.mname).rstrip('.'),
                         str(rdata.rname).rstrip('.'),
                         rdata.serial,
@@ -309,214 +564,760 @@ def process_and_import_zone_data(zone, overwrite=False):
 
                 elif rdataset.rdtype == dns.rdatatype._by_text['NS']:
                     # http://www.dnspython.org/docs/1.10.0/html/dns.rdtypes.ANY.NS.NS-class.html
-                    rr.type = 'NS'
-                    rr.content = str(rdata.target).rstrip('.')
+                    rr_type = 'NS'
+                    rr_content = str(rdata.target).rstrip('.')
 
                 elif rdataset.rdtype == dns.rdatatype._by_text['MX']:
                     # http://www.dnspython.org/docs/1.10.0/html/dns.rdtypes.ANY.MX.MX-class.html
-                    rr.type = 'MX'
-                    rr.content = str(rdata.exchange).rstrip('.')
-                    rr.prio = rdata.preference
+                    rr_type = 'MX'
+                    rr_content = str(rdata.exchange).rstrip('.')
+                    rr_prio = rdata.preference
                 
                 elif rdataset.rdtype == dns.rdatatype._by_text['TXT']:
                     # http://www.dnspython.org/docs/1.10.0/html/dns.rdtypes.ANY.TXT.TXT-class.html
-                    rr.type = 'TXT'
-                    rr.content = ' '.join(rdata.strings)
+                    rr_type = 'TXT'
+                    rr_content = ' '.join(rdata.strings)
                 
                 elif rdataset.rdtype == dns.rdatatype._by_text['CNAME']:
                     # http://www.dnspython.org/docs/1.10.0/html/dns.rdtypes.ANY.CNAME.CNAME-class.html
-                    rr.type = 'CNAME'
-                    rr.content = str(rdata.target).rstrip('.')
+                    rr_type = 'CNAME'
+                    rr_content = str(rdata.target).rstrip('.')
                     
                 elif rdataset.rdtype == dns.rdatatype._by_text['A']:
                     # http://www.dnspython.org/docs/1.10.0/html/dns.rdtypes.IN.A.A-class.html
-                    rr.type = 'A'
-                    rr.content = rdata.address
+                    rr_type = 'A'
+                    rr_content = rdata.address
                 
                 elif rdataset.rdtype == dns.rdatatype._by_text['AAAA']:
                     # http://www.dnspython.org/docs/1.10.0/html/dns.rdtypes.IN.AAAA.AAAA-class.html
-                    rr.type = 'AAAA'
-                    rr.content = rdata.address
+                    rr_type = 'AAAA'
+                    rr_content = rdata.address
                 
                 elif rdataset.rdtype == dns.rdatatype._by_text['SPF']:
                     # http://www.dnspython.org/docs/1.10.0/html/dns.rdtypes.ANY.SPF.SPF-class.html
-                    rr.type = 'SPF'
-                    rr.content = ' '.join(rdata.strings)
+                    rr_type = 'SPF'
+                    rr_content = ' '.join(rdata.strings)
                 
                 elif rdataset.rdtype == dns.rdatatype._by_text['PTR']:
                     # http://www.dnspython.org/docs/1.10.0/html/dns.rdtypes.ANY.PTR.PTR-class.html
-                    rr.type = 'PTR'
-                    rr.content = str(rdata.target).rstrip('.')
+                    rr_type = 'PTR'
+                    rr_content = str(rdata.target).rstrip('.')
                 
                 elif rdataset.rdtype == dns.rdatatype._by_text['SRV']:
                     # http://www.dnspython.org/docs/1.10.0/html/dns.rdtypes.IN.SRV.SRV-class.html
-                    rr.type = 'SRV'
-                    rr.content = '%d %d %s' % (rdata.weight, rdata.port, str(rdata.target).rstrip('.'))
+                    rr_type = 'SRV'
+                    rr_content = '%d %d %s' % (rdata.weight, rdata.port, str(rdata.target).rstrip('.'))
+                    rr_prio = rdata.priority
                 
-                rr.save()
-    
-    # Update zone serial
-    the_domain.update_serial()
+                else:
+                    # Unsupported RR type
+                    continue
+                
+                rr_data.append( (rr_name, rr_type, rr_content, rdataset.ttl, rr_prio) )
     
-    # Rectify zone
-    rectify_zone(the_domain.name)
+    return rr_data
+
 
+def _zone_rr_key(rr_name, rr_type, rr_content, rr_prio):
+    """Returns the key that identifies a resource record within a zone.
+    
+    A zone has a single SOA record, so SOA records are identified by their
+    name and type only. The TTL is not part of the key.
+    
+    The values are converted to unicode, so that the UTF-8 encoded strings
+    of the parsed zone data match the unicode strings of the database.
+    
+    """
+    if rr_type == 'SOA':
+        return (smart_unicode(rr_name), smart_unicode(rr_type), None, None)
+    return (smart_unicode(rr_name), smart_unicode(rr_type), smart_unicode(rr_content), rr_prio)
 
 
-def generate_zone_file(origin):
-    """Generates a zone file.
+def _sync_zone_rr_data(the_domain, rr_data, change_date):
+    """Synchronizes the resource records of an existing zone with ``rr_data``.
     
-    Accepts the zone origin as string (no trailing dot).
-     
-    Returns the contents of a zone file that contains all the resource records
-    associated with the domain with the provided origin.
+    The incoming resource records are compared against the records stored
+    in the database and only the required INSERT, UPDATE and DELETE
+    statements are issued. Records are matched by name, type, content and
+    priority. The SOA record is matched by name and type and the serial is
+    ignored when comparing its content, since the serial of the stored zone
+    is managed by ``Domain.update_serial()``.
+    
+    Must be called within a transaction.
+    
+    Returns the number of resource records that have been inserted, updated
+    or deleted.
     
     """
-    Domain = cache.get_model('powerdns_manager', 'Domain')
     Record = cache.get_model('powerdns_manager', 'Record')
     
-    the_domain = Domain.objects.get(name__exact=origin)
-    the_rrs = Record.objects.filter(domain=the_domain).order_by('-type')
+    # Existing records, grouped by key
+    existing = {}
+    qs = Record.objects.filter(domain=the_domain).values_list(
+        'id', 'name', 'type', 'content', 'ttl', 'prio')
+    for rr_id, rr_name, rr_type, rr_content, rr_ttl, rr_prio in qs:
+        key = _zone_rr_key(rr_name, rr_type, rr_content, rr_prio)
+        existing.setdefault(key, []).append((rr_id, rr_content, rr_ttl))
+    
+    to_insert = []
+    # Maps tuples of (field, value) pairs to lists of record ids
+    to_update = {}
+    
+    for rr_name, rr_type, rr_content, rr_ttl, rr_prio in rr_data:
+        matches = existing.get(_zone_rr_key(rr_name, rr_type, rr_content, rr_prio))
+        if not matches:
+            to_insert.append(Record(
+                domain=the_domain,
+                name=rr_name,
+                type=rr_type,
+                content=rr_content,
+                ttl=rr_ttl,
+                prio=rr_prio,
+                change_date=change_date
+            ))
+            continue
+        rr_id, old_content, old_ttl = matches.pop()
+        fields = ()
+        if rr_type == 'SOA':
+            try:
+                old_soa = SoaContent.parse(old_content)
+                new_soa = SoaContent.parse(rr_content)
+            except ValueError:
+                if rr_content != old_content:
+                    fields += (('content', rr_content),)
+            else:
+                # Keep the current serial
+                new_soa.serial = old_soa.serial
+                if new_soa != old_soa:
+                    fields += (('content', new_soa.to_content()),)
+        if rr_ttl != old_ttl:
+            fields += (('ttl', rr_ttl),)
+        if fields:
+            to_update.setdefault(fields, []).append(rr_id)
+    
+    # Existing records that are not present in the incoming zone data
+    to_delete = [match[0] for rr_matches in existing.values() for match in rr_matches]
+    
+    batch_size = settings.PDNS_BULK_INSERT_BATCH_SIZE
+    for i in range(0, len(to_insert), batch_size):
+        Record.objects.bulk_create(to_insert[i:i+batch_size])
+    
+    # ``update()`` does not set the ``auto_now`` fields
+    date_modified = timezone.now()
+    batch_size = settings.PDNS_BULK_UPDATE_BATCH_SIZE
+    for fields, rr_ids in to_update.items():
+        for i in range(0, len(rr_ids), batch_size):
+            Record.objects.filter(id__in=rr_ids[i:i+batch_size]).update(
+                change_date=change_date, date_modified=date_modified, **dict(fields))
+    
+    for i in range(0, len(to_delete), batch_size):
+        Record.objects.filter(id__in=to_delete[i:i+batch_size]).delete()
+    
+    return len(to_insert) + sum([len(ids) for ids in to_update.values()]) + len(to_delete)
+
+
+def import_zone_rr_data(origin, rr_data, overwrite=False):
+    """Imports the resource records of a zone to the database.
     
-    # Generate the zone file
+    origin: string domain name (no trailing dot)
+    rr_data: list of (name, type, content, ttl, prio) tuples, as returned by
+        ``get_zone_rr_data()``
     
-    origin = Name((origin.rstrip('.') + '.').split('.'))
+    All the ``Record`` instances are built in memory and are written to the
+    database using chunked bulk INSERT statements. The chunk size is set by
+    the ``PDNS_BULK_INSERT_BATCH_SIZE`` setting. The whole import, including
+    the serial update and the rectification of the zone, takes place in a
+    single transaction, so PowerDNS never serves a partially imported zone.
     
-    # Create an empty dns.zone object.
-    # We set check_origin=False because the zone contains no records.
-    zone = dns.zone.from_text('', origin=origin, relativize=False, check_origin=False)
+    If the zone exists and ``overwrite`` is set, the existing ``Domain``
+    instance is kept and only the resource records that differ from the
+    imported zone data are inserted, updated or deleted. The serial is
+    updated and the zone is rectified only if a resource record has changed.
     
-    rdclass = dns.rdataclass._by_text.get('IN')
+    Returns the ``Domain`` instance of the imported zone.
     
-    for rr in the_rrs:
-        
-        # Add trailing dot to rr.name
-        record_name = rr.name.rstrip('.') + '.'
-        
-        if rr.type == 'SOA':
-            # Add SOA Resource Record
-            
-            # SOA content:  primary hostmaster serial refresh retry expire default_ttl
-            bits = rr.content.split()
-            # Primary nameserver of SOA record
-            primary = bits[0].rstrip('.') + '.'
-            mname = Name(primary.split('.'))
-            # Responsible hostmaster from SOA record
-            hostmaster = bits[1].rstrip('.') + '.'
-            rname = Name(hostmaster.split('.'))
-            
-            rdtype = dns.rdatatype._by_text.get('SOA')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.ANY.SOA.SOA(rdclass, rdtype,
-                mname = mname,
-                rname = rname,
-                serial = int(bits[2]),
-                refresh = int(bits[3]),
-                retry = int(bits[4]),
-                expire = int(bits[5]),
-                minimum = int(bits[6])
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
-        
-        elif rr.type == 'NS':
-            # Add NS Resource Record
-            rdtype = dns.rdatatype._by_text.get('NS')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.ANY.NS.NS(rdclass, rdtype,
-                target = Name((rr.content.rstrip('.') + '.').split('.'))
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
-        
-        elif rr.type == 'MX':
-            # Add MX Resource Record
-            rdtype = dns.rdatatype._by_text.get('MX')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.ANY.MX.MX(rdclass, rdtype,
-                preference = int(rr.prio),
-                exchange = Name((rr.content.rstrip('.') + '.').split('.'))
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    Record = cache.get_model('powerdns_manager', 'Record')
+    
+    db = router.db_for_write(Record)
+    
+    # ``Record.save()`` is not used, so ``change_date`` is set here once
+    # for all the records. The TTL is always present in the zone data, so
+    # there is no need to look up the minimum TTL of the zone.
+    change_date = generate_serial_timestamp()
+    
+    with commit_on_success_unless_managed(using=db):
+    
+        # Check if zone already exists in the database.
+        try:
+            the_domain = Domain.objects.get(name=origin)
+        except Domain.DoesNotExist:
+            pass    # proceed with importing the new zone data
+        else:   # Zone exists
+            if overwrite:
+                # If ``overwrite`` has been checked, then update the
+                # resource records that have changed.
+                if _sync_zone_rr_data(the_domain, rr_data, change_date):
+                    the_domain.update_serial()
+                    rectify_zone(the_domain.name)
+                return the_domain
+            else:
+                raise Exception('Zone already exists. Consider using the "overwrite" option')
         
-        elif rr.type == 'TXT':
-            # Add TXT Resource Record
-            rdtype = dns.rdatatype._by_text.get('TXT')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.ANY.TXT.TXT(rdclass, rdtype,
-                strings = rr.content.split(';')
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
+        # Import the new zone data to the database.
         
-        elif rr.type == 'CNAME':
-            # Add CNAME Resource Record
-            rdtype = dns.rdatatype._by_text.get('CNAME')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.ANY.CNAME.CNAME(rdclass, rdtype,
-                target = Name((rr.content.rstrip('.') + '.').split('.'))
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
+        # Create a domain instance
+        the_domain = Domain.objects.create(name=origin, type='NATIVE', master='')
         
-        elif rr.type == 'A':
-            # Add A Resource Record
-            rdtype = dns.rdatatype._by_text.get('A')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.IN.A.A(rdclass, rdtype,
-                address = rr.content
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
+        # Create RRs
         
-        elif rr.type == 'AAAA':
-            # Add AAAA Resource Record
-            rdtype = dns.rdatatype._by_text.get('AAAA')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.IN.AAAA.AAAA(rdclass, rdtype,
-                address = rr.content
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
+        batch_size = settings.PDNS_BULK_INSERT_BATCH_SIZE
+        for i in range(0, len(rr_data), batch_size):
+            Record.objects.bulk_create([
+                Record(
+                    domain=the_domain,
+                    name=rr_name,
+                    type=rr_type,
+                    content=rr_content,
+                    ttl=rr_ttl,
+                    prio=rr_prio,
+                    change_date=change_date
+                ) for rr_name, rr_type, rr_content, rr_ttl, rr_prio in rr_data[i:i+batch_size]
+            ])
         
-        elif rr.type == 'SPF':
-            # Add SPF Resource Record
-            rdtype = dns.rdatatype._by_text.get('SPF')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.ANY.SPF.SPF(rdclass, rdtype,
-                strings = rr.content.split(';')
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
+        # Update zone serial
+        the_domain.update_serial()
         
-        elif rr.type == 'PTR':
-            # Add PTR Resource Record
-            rdtype = dns.rdatatype._by_text.get('PTR')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.ANY.PTR.PTR(rdclass, rdtype,
-                target = Name((rr.content.rstrip('.') + '.').split('.'))
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
+        # Rectify zone
+        rectify_zone(the_domain.name)
+    
+    return the_domain
+
+
+def process_and_import_zone_data(zone, overwrite=False):
+    """
+    zone: dns.zone
+    
+    Imports the zone data to the database. See ``get_zone_rr_data()`` and
+    ``import_zone_rr_data()``.
+    
+    """
+    origin = str(zone.origin).rstrip('.')
+    return import_zone_rr_data(origin, get_zone_rr_data(zone), overwrite)
+
+
+
+def clone_zones(domain_obj, clone_names, created_by=None, clone_dynamic=True, clone_metadata=True):
+    """Clones a zone to many new zones.
+    
+    domain_obj: the ``Domain`` instance of the zone that is cloned
+    clone_names: list of the domain names of the new zones
+    created_by: the ``User`` the new zones belong to
+    clone_dynamic: if True, the dynamic setting of the zone is cloned. A new
+        API key is generated for each dynamic clone.
+    clone_metadata: if True, the metadata of the zone is cloned
+    
+    The resource records of the zone are retrieved once. The names and the
+    content of the records of each clone are generated in memory using
+    ``interchange_domain()`` and all the new records are written to the
+    database using bulk INSERT statements. The clones are created in chunks,
+    each chunk in its own transaction, so that each transaction inserts
+    about ``PDNS_BULK_INSERT_BATCH_SIZE`` resource records. Each clone is
+    rectified once, after all of its data has been inserted.
+    
+    Returns the list of the ``Domain`` instances of the clones.
+    
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    Record = cache.get_model('powerdns_manager', 'Record')
+    DynamicZone = cache.get_model('powerdns_manager', 'DynamicZone')
+    DomainMetadata = cache.get_model('powerdns_manager', 'DomainMetadata')
+    
+    db = router.db_for_write(Record)
+    
+    # Retrieve the data of the zone
+    rr_data = list(Record.objects.filter(domain=domain_obj).values_list(
+        'name', 'type', 'content', 'ttl', 'prio').order_by('id'))
+    minimum_ttl = domain_obj.get_minimum_ttl()
+    is_dynamic = False
+    if clone_dynamic:
+        is_dynamic = DynamicZone.objects.filter(domain=domain_obj, is_dynamic=True).exists()
+    metadata = []
+    if clone_metadata:
+        metadata = list(DomainMetadata.objects.filter(domain=domain_obj).values_list(
+            'kind', 'content').order_by('id'))
+    
+    origin = domain_obj.name
+    change_date = generate_serial_timestamp()
+    serial = generate_serial()
+    
+    clones = []
+    chunk_size = max(1, settings.PDNS_BULK_INSERT_BATCH_SIZE // max(1, len(rr_data)))
+    for i in range(0, len(clone_names), chunk_size):
+        chunk = clone_names[i:i+chunk_size]
         
-        elif rr.type == 'SRV':
-            # Add SRV Resource Record
+        with commit_on_success_unless_managed(using=db):
+            
+            # Create the clones
+            Domain.objects.bulk_create([
+                Domain(
+                    name = clone_name,
+                    master = domain_obj.master,
+                    type = domain_obj.type,
+                    account = domain_obj.account,
+                    created_by = created_by
+                ) for clone_name in chunk
+            ])
+            clone_objs = list(Domain.objects.filter(name__in=chunk))
+            
+            # Create the resource records of the clones
+            clone_rrs = []
+            for clone_obj in clone_objs:
+                clone_name = clone_obj.name
+                for rr_name, rr_type, rr_content, rr_ttl, rr_prio in rr_data:
+                    
+                    # Special treatment to the content of SOA and SRV RRs
+                    if rr_type == 'SOA':
+                        soa = SoaContent.parse(rr_content)
+                        soa.primary = interchange_domain(soa.primary, origin, clone_name)
+                        soa.hostmaster = interchange_domain(soa.hostmaster, origin, clone_name)
+                        # Set new serial
+                        soa.serial = int(serial)
+                        clone_rr_content = soa.to_content()
+                    elif rr_type == 'SRV':
+                        content_parts = rr_content.split()
+                        # target
+                        content_parts[2] = interchange_domain(content_parts[2], origin, clone_name)
+                        clone_rr_content = ' '.join(content_parts)
+                    else:
+                        clone_rr_content = interchange_domain(rr_content, origin, clone_name)
+                    
+                    clone_rrs.append(Record(
+                        domain = clone_obj,
+                        name = interchange_domain(rr_name, origin, clone_name),
+                        type = rr_type,
+                        content = clone_rr_content,
+                        ttl = rr_ttl or minimum_ttl,
+                        prio = rr_prio,
+                        change_date = change_date
+                    ))
             
-            # weight port target
-            weight, port, target = rr.content.split()
+            batch_size = settings.PDNS_BULK_INSERT_BATCH_SIZE
+            for j in range(0, len(clone_rrs), batch_size):
+                Record.objects.bulk_create(clone_rrs[j:j+batch_size])
             
-            rdtype = dns.rdatatype._by_text.get('SRV')
-            rdataset = zone.find_rdataset(record_name, rdtype=rdtype, create=True)
-            rdata = dns.rdtypes.IN.SRV.SRV(rdclass, rdtype,
-                priority = int(rr.prio),
-                weight = int(weight),
-                port = int(port),
-                target = Name((target.rstrip('.') + '.').split('.'))
-            )
-            rdataset.add(rdata, ttl=int(rr.ttl))
+            # Clone the dynamic zone setting
+            if is_dynamic:
+                DynamicZone.objects.bulk_create([
+                    DynamicZone(
+                        domain = clone_obj,
+                        is_dynamic = True,
+                        api_key = generate_api_key()
+                    ) for clone_obj in clone_objs
+                ])
             
+            # Clone the zone's metadata
+            if metadata:
+                DomainMetadata.objects.bulk_create([
+                    DomainMetadata(
+                        domain = clone_obj,
+                        kind = kind,
+                        content = content
+                    ) for clone_obj in clone_objs for kind, content in metadata
+                ])
+            
+            # Rectify the clones
+            for clone_obj in clone_objs:
+                rectify_zone(clone_obj.name)
+        
+        clones.extend(clone_objs)
+    
+    return clones
+
+
+
+# End of line sequence used in exported zone files
+ZONE_FILE_EOL = '\r\n'
+
+
+def _quote_character_string(data):
+    """Returns ``data`` as a quoted character string for use in master files.
+    
+    Double quotes and backslashes are escaped with a backslash. Non-printable
+    characters are escaped in the ``\\DDD`` form.
+    
+    """
+    escaped = []
+    for c in smart_str(data):
+        if c in '"\\':
+            escaped.append('\\' + c)
+        elif 0x20 <= ord(c) < 0x7F:
+            escaped.append(c)
+        else:
+            escaped.append('\\%03d' % ord(c))
+    return '"%s"' % ''.join(escaped)
+
+
+def format_zone_record(rr_name, rr_type, rr_content, rr_ttl, rr_prio):
+    """Returns a resource record in master file format.
+    
+    Accepts the values of the ``name``, ``type``, ``content``, ``ttl`` and
+    ``prio`` fields of a ``Record``.
+    
+    Returns a line (including the end of line sequence) or None if the type of
+    the resource record is not supported by the exporter.
+    
+    """
+    # Names in the zone file are absolute (with trailing dot)
+    fqdn = lambda name: '%s.' % name.rstrip('.')
+    
+    if rr_type == 'SOA':
+        # SOA content:  primary hostmaster serial refresh retry expire default_ttl
+        bits = rr_content.split()
+        rdata = '%s %s %d %d %d %d %d' % (
+            fqdn(bits[0]), fqdn(bits[1]), int(bits[2]), int(bits[3]),
+            int(bits[4]), int(bits[5]), int(bits[6]))
+    elif rr_type in ('NS', 'CNAME', 'PTR'):
+        rdata = fqdn(rr_content)
+    elif rr_type == 'MX':
+        rdata = '%d %s' % (int(rr_prio), fqdn(rr_content))
+    elif rr_type in ('TXT', 'SPF'):
+        rdata = ' '.join([_quote_character_string(s) for s in rr_content.split(';')])
+    elif rr_type in ('A', 'AAAA'):
+        rdata = rr_content
+    elif rr_type == 'SRV':
+        # weight port target
+        weight, port, target = rr_content.split()
+        rdata = '%d %d %d %s' % (int(rr_prio), int(weight), int(port), fqdn(target))
+    else:
+        return None
+    
+    if rr_ttl is None:
+        rr_ttl = settings.PDNS_DEFAULT_RR_TTL
+    
+    return smart_str('%s %d IN %s %s%s' % (
+        fqdn(rr_name), int(rr_ttl), rr_type, rdata, ZONE_FILE_EOL))
+
+
+def _iter_zone_file_lines(origin, soa_values, rr_values_iter):
+    """Generates the lines of a zone file.
+    
+    origin: the zone origin (no trailing dot)
+    soa_values: the (name, type, content, ttl, prio) tuple of the SOA record
+        or None
+    rr_values_iter: iterator over the (name, type, content, ttl, prio) tuples
+        of the rest of the resource records of the zone
+    
+    """
+    yield smart_str('$ORIGIN %s.%s' % (origin.rstrip('.'), ZONE_FILE_EOL))
+    if soa_values is not None:
+        yield format_zone_record(*soa_values)
+    for rr_values in rr_values_iter:
+        line = format_zone_record(*rr_values)
+        if line is not None:
+            yield line
+
+
+# Fields of ``Record`` used by the zone file exporter
+ZONE_FILE_RR_FIELDS = ('name', 'type', 'content', 'ttl', 'prio')
+
+
+def iter_zone_file(origin):
+    """Generates a zone file incrementally.
+    
+    Accepts the zone origin as string (no trailing dot).
+    
+    Returns an iterator over the lines of a zone file that contains all the
+    resource records associated with the domain with the provided origin.
+    ``Domain.DoesNotExist`` is raised immediately if the zone does not exist.
+    
+    The resource records are retrieved using ``.iterator()`` and are formatted
+    one by one, so the memory usage does not depend on the size of the zone.
+    
+    The SOA record is written first, followed by the rest of the records of
+    the zone ordered by name.
+    
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    Record = cache.get_model('powerdns_manager', 'Record')
+    
+    the_domain = Domain.objects.get(name__exact=origin)
+    the_rrs = Record.objects.filter(domain=the_domain)
+    
+    soa_values = None
+    for soa_values in the_rrs.filter(type='SOA').values_list(*ZONE_FILE_RR_FIELDS)[:1]:
+        pass
+    
+    rr_values_iter = the_rrs.exclude(type='SOA').order_by(
+        'name', 'type', 'id').values_list(*ZONE_FILE_RR_FIELDS).iterator()
+    
+    return _iter_zone_file_lines(origin, soa_values, rr_values_iter)
+
+
+def iter_zone_files(domains=None):
+    """Generates the zone files of many zones.
+    
+    Accepts a ``Domain`` queryset. By default, all zones are exported.
+    
+    Yields ``(origin, lines)`` tuples, where ``lines`` is an iterator over the
+    lines of the zone file, like the one returned by ``iter_zone_file()``.
+    Each ``lines`` iterator must be consumed before advancing to the next zone.
+    
+    The SOA records of the zones are retrieved with one query. The rest of the
+    resource records of all the zones are retrieved with one more query, which
+    is streamed using ``.iterator()`` and split per zone.
+    
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    Record = cache.get_model('powerdns_manager', 'Record')
+    
+    if domains is None:
+        domains = Domain.objects.all()
+    domains = domains.order_by('id')
+    
+    the_rrs = Record.objects.filter(domain__in=domains.values('id'))
+    
+    soa_values_map = {}
+    for rr_values in the_rrs.filter(type='SOA').values_list('domain', *ZONE_FILE_RR_FIELDS):
+        soa_values_map.setdefault(rr_values[0], rr_values[1:])
+    
+    rr_values_iter = the_rrs.exclude(type='SOA').order_by(
+        'domain__id', 'name', 'type', 'id').values_list('domain', *ZONE_FILE_RR_FIELDS).iterator()
+    
+    # Both the domains and the records are ordered by domain ID, so the
+    # records of each zone are found by advancing the record iterator.
+    pending = [None]    # Record read from the iterator but not yet consumed
+    
+    def zone_rr_values(domain_id):
+        while True:
+            if pending[0] is None:
+                try:
+                    pending[0] = rr_values_iter.next()
+                except StopIteration:
+                    return
+            if pending[0][0] > domain_id:
+                return
+            rr_values = pending[0]
+            pending[0] = None
+            if rr_values[0] == domain_id:
+                yield rr_values[1:]
+    
+    for domain_id, origin in domains.values_list('id', 'name').iterator():
+        yield origin, _iter_zone_file_lines(
+            origin, soa_values_map.get(domain_id), zone_rr_values(domain_id))
+    
+
+
+def get_zone_file_path(outdir, origin):
+    return os.path.join(outdir, '%s.zone' % origin)
+
+
+def write_file_atomically(path, lines):
+    """Writes ``lines`` to the file at ``path``.
+    
+    The data is written to a temporary file in the same directory, which is
+    then renamed to ``path``. Readers of ``path`` never see a partially
+    written file.
+    
+    """
+    dirname, filename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.%s.' % filename)
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            f.writelines(lines)
+        finally:
+            f.close()
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def write_zone_file(outdir, origin, zone_file_lines):
+    """Writes the zone file of ``origin`` to ``outdir``."""
+    # The zone file is written incrementally
+    write_file_atomically(get_zone_file_path(outdir, origin), zone_file_lines)
+
+
+def generate_zone_file(origin):
+    """Generates a zone file.
+    
+    Accepts the zone origin as string (no trailing dot).
+     
+    Returns the contents of a zone file that contains all the resource records
+    associated with the domain with the provided origin.
+    
+    The whole zone file is kept in memory. Use ``iter_zone_file()`` for big
+    zones.
+    
+    """
+    return ''.join(iter_zone_file(origin))
+    
+
+
+def update_soa_records(soa_contents, change_date=None):
+    """Sets the content of many SOA records.
+    
+    soa_contents: dictionary that maps ``Record`` ids to the new content
+    
+    Each batch of records is updated with a single UPDATE statement, which
+    uses a CASE expression to set the content of each record. The batch size
+    is set by the ``PDNS_BULK_UPDATE_BATCH_SIZE`` setting.
+    
+    Must be called within a transaction.
+    
+    """
+    Record = cache.get_model('powerdns_manager', 'Record')
+    
+    if change_date is None:
+        change_date = generate_serial_timestamp()
+    
+    db = router.db_for_write(Record)
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    date_modified = connection.ops.value_to_db_datetime(timezone.now())
+    
+    items = soa_contents.items()
+    batch_size = settings.PDNS_BULK_UPDATE_BATCH_SIZE
+    cursor = connection.cursor()
+    for i in range(0, len(items), batch_size):
+        batch = items[i:i+batch_size]
+        sql = 'UPDATE %s SET %s = CASE %s %s END, %s = %%s, %s = %%s WHERE %s IN (%s)' % (
+            qn(Record._meta.db_table),
+            qn('content'),
+            qn('id'),
+            ' '.join(['WHEN %s THEN %s'] * len(batch)),
+            qn('change_date'),
+            qn('date_modified'),
+            qn('id'),
+            ', '.join(['%s'] * len(batch)),
+        )
+        params = []
+        for rr_id, rr_content in batch:
+            params.extend([rr_id, rr_content])
+        params.extend([change_date, date_modified])
+        params.extend([rr_id for rr_id, rr_content in batch])
+        cursor.execute(sql, params)
+    transaction.commit_unless_managed(using=db)
+
+
+def update_zone_serials(domain_ids, minimum_ttl=None, change_date=None, failed=None):
+    """Updates the serials of many zones.
+    
+    domain_ids: list of ``Domain`` ids
+    minimum_ttl: if set, the minimum TTL field of the SOA records is also
+        set to this value
+    failed: if set, the ids of the zones whose SOA record could not be
+        parsed are appended to this list
+    
+    The SOA records of each batch of zones are retrieved with a single query
+    and the new serials are calculated with ``generate_serial()``. The SOA
+    records are written back with ``update_soa_records()``. The batch size
+    is set by the ``PDNS_BULK_UPDATE_BATCH_SIZE`` setting.
     
-    # Export text (from the source code of http://www.dnspython.org/docs/1.10.0/html/dns.zone.Zone-class.html#to_file)
-    EOL = '\r\n'
-    f = StringIO.StringIO()
-    f.write('$ORIGIN %s%s' % (origin, EOL))
-    zone.to_file(f, sorted=True, relativize=False, nl=EOL)
-    data = f.getvalue()
-    f.close()
-    return data
+    Zones without a SOA record are skipped. Zones with malformed SOA content
+    are logged and skipped, so that they do not abort the whole batch.
     
+    Returns the number of the updated SOA records.
+    
+    """
+    Record = cache.get_model('powerdns_manager', 'Record')
+    
+    db = router.db_for_write(Record)
+    if change_date is None:
+        change_date = generate_serial_timestamp()
+    
+    soa_count = 0
+    batch_size = settings.PDNS_BULK_UPDATE_BATCH_SIZE
+    with commit_on_success_unless_managed(using=db):
+        for i in range(0, len(domain_ids), batch_size):
+            soa_contents = {}
+            soa_qs = Record.objects.filter(domain__id__in=domain_ids[i:i+batch_size], type='SOA')
+            for rr_id, domain_id, rr_content in soa_qs.values_list('id', 'domain', 'content'):
+                try:
+                    soa = SoaContent.parse(rr_content)
+                except ValueError:
+                    logger.warning('Invalid SOA content of zone %s: %s', domain_id, rr_content)
+                    if failed is not None:
+                        failed.append(domain_id)
+                    continue
+                soa.update_serial()
+                if minimum_ttl is not None:
+                    soa.minimum = minimum_ttl
+                soa_contents[rr_id] = soa.to_content()
+            update_soa_records(soa_contents, change_date)
+            soa_count += len(soa_contents)
+    
+    return soa_count
+
+
+def set_zone_ttl(domain_ids, ttl, reset_zone_minimum=False, failed=None):
+    """Sets the TTL of all the resource records of the specified zones.
+    
+    domain_ids: list of ``Domain`` ids
+    ttl: the new TTL
+    reset_zone_minimum: if True, the minimum TTL field of the SOA record of
+        the zones is also set to ``ttl``
+    failed: passed to ``update_zone_serials()``
+    
+    The records of each batch of zones are updated with a single UPDATE
+    statement. The serials of the zones are then updated with
+    ``update_zone_serials()``. The whole operation takes place in a single
+    transaction.
+    
+    Returns the number of the updated resource records.
+    
+    """
+    Record = cache.get_model('powerdns_manager', 'Record')
+    
+    db = router.db_for_write(Record)
+    change_date = generate_serial_timestamp()
+    
+    record_count = 0
+    batch_size = settings.PDNS_BULK_UPDATE_BATCH_SIZE
+    with commit_on_success_unless_managed(using=db):
+        for i in range(0, len(domain_ids), batch_size):
+            record_count += Record.objects.filter(domain__id__in=domain_ids[i:i+batch_size]).update(
+                ttl=ttl, change_date=change_date, date_modified=timezone.now())
+        
+        minimum_ttl = None
+        if reset_zone_minimum:
+            minimum_ttl = ttl
+        update_zone_serials(domain_ids, minimum_ttl, change_date, failed)
+    
+    return record_count
+
+
+def set_zone_type(domain_ids, domain_type, failed=None):
+    """Sets the type of the specified zones and updates their serials.
+    
+    domain_ids: list of ``Domain`` ids
+    domain_type: the new zone type (NATIVE, MASTER, SLAVE)
+    failed: passed to ``update_zone_serials()``
+    
+    The zones of each batch are updated with a single UPDATE statement and
+    the serials are updated with ``update_zone_serials()``. The whole
+    operation takes place in a single transaction.
+    
+    Returns the number of the updated zones.
+    
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    
+    db = router.db_for_write(Domain)
+    
+    domain_count = 0
+    batch_size = settings.PDNS_BULK_UPDATE_BATCH_SIZE
+    with commit_on_success_unless_managed(using=db):
+        for i in range(0, len(domain_ids), batch_size):
+            domain_count += Domain.objects.filter(id__in=domain_ids[i:i+batch_size]).update(
+                type=domain_type, date_modified=timezone.now())
+        update_zone_serials(domain_ids, failed=failed)
+    
+    return domain_count
 
 
 def rectify_zone(origin):
@@ -530,6 +1331,10 @@ def rectify_zone(origin):
     rectify_zone() accepts a string containing the zone origin.
     Returns nothing.
     
+    The records of the zone are processed in a single pass and only those
+    records whose ``auth`` or ``ordername`` fields need to change are written
+    back to the database.
+    
     PowerDNS Documentation at Chapter 12 Section 8.5:
     
         http://doc.powerdns.com/dnssec-modes.html#dnssec-direct-database
@@ -670,7 +1475,6 @@ def rectify_zone(origin):
     Domain = cache.get_model('powerdns_manager', 'Domain')
     Record = cache.get_model('powerdns_manager', 'Record')
     DomainMetadata = cache.get_model('powerdns_manager', 'DomainMetadata')
-    CryptoKey = cache.get_model('powerdns_manager', 'CryptoKey')
     
     # List containing domain parts
     origin_parts = origin.split('.')
@@ -679,105 +1483,92 @@ def rectify_zone(origin):
     # TODO: Do some exception handling here in case domain does not exist
     the_domain = Domain.objects.get(name=origin)
     
-    # Get a list of the zone's records
-    zone_rr_list = Record.objects.filter(domain__name=origin)
+    # Get a list of the zone's records. Only the fields that are needed
+    # in order to rectify the zone are retrieved.
+    zone_rr_list = list(Record.objects.filter(domain=the_domain).values_list(
+        'id', 'name', 'type', 'auth', 'ordername'))
     
     # Find delegated names by checking the names of all NS and DS records.
-    delegated_names_list = []
-    for rr in zone_rr_list:
-        if rr.type not in ('NS', 'DS'):
+    delegated_names = set()
+    for rr_id, rr_name, rr_type, rr_auth, rr_ordername in zone_rr_list:
+        if rr_type not in ('NS', 'DS') or not rr_name:
             continue
-        rr_name_parts = rr.name.split('.')
-        if len(rr_name_parts) > len(origin_parts):
+        if len(rr_name.split('.')) > len(origin_parts):
             # name is delegated
-            if rr.name not in delegated_names_list:
-                delegated_names_list.append(rr.name)
-    
-    
-    # AUTH field management
-    
-    # Set auth=1 on all records initially
-    for rr in zone_rr_list:
-        rr.auth = True
-    
-    for delegated_name in delegated_names_list:
-        
-        # Set auth=0 to A & AAAA records (glue) of delegated names
-        for rr in zone_rr_list:
-            if rr.name == delegated_name and rr.type in ('A', 'AAAA'):
-                rr.auth = False
-    
-        # DS records should already have auth=1
-        
-        # Set auth=0 to NS records
-        for rr in zone_rr_list:
-            if rr.name == delegated_name and rr.type == 'NS':
-                rr.auth = False
-    
-    
-    # ORDERNAME field management
+            delegated_names.add(rr_name)
     
     # If no crypto keys are present for the domain, DNSSEC is not enabled,
     # so the ``ordername`` field is not necessary to be filled. However, the
     # following code always fills the ``ordername`` field. 
-    qs = CryptoKey.objects.filter(domain=the_domain)
-    if not len(qs):
-        # This is not a DNSSEC-enabled domain.
-        # We still fill the ordername field as mentioned in the docstring.
-        pass
     
     # Decide NSEC mode:
-    try:
-        nsec3 = DomainMetadata.objects.get(
-            domain=the_domain, kind__startswith='NSEC3')
-    except DomainMetadata.DoesNotExist:
-        # NSEC Mode
+    metadata_kinds = set(DomainMetadata.objects.filter(
+        domain=the_domain).values_list('kind', flat=True))
+    is_nsec3 = bool([k for k in metadata_kinds if k.startswith('NSEC3')])
+    is_nsec3_narrow = 'NSEC3NARROW' in metadata_kinds
+    
+    # AUTH field management
+    
+    # Set auth=0 to A & AAAA records (glue) and NS records of delegated
+    # names. DS records of delegated names keep auth=1. All other
+    # records get auth=1.
+    auth_list = [not (rr[1] in delegated_names and rr[2] in ('A', 'AAAA', 'NS'))
+        for rr in zone_rr_list]
+    
+    # In NSEC3 'Non-Narrow' and 'Opt-out' modes, the ordername of the
+    # authoritative records is the NSEC3 hash of their name. Each unique
+    # name is hashed once.
+    if is_nsec3 and not is_nsec3_narrow:
+        nsec3_hasher = Nsec3Hasher.for_zone(the_domain)
+        nsec3_hashes = nsec3_hasher.hash_names(set(
+            [rr[1] for rr, auth in zip(zone_rr_list, auth_list) if auth]))
+    
+    # Map of (auth, ordername) to the list of IDs of the records that need
+    # to be updated with these values.
+    changes = {}
+    
+    for (rr_id, rr_name, rr_type, rr_auth, rr_ordername), auth in zip(zone_rr_list, auth_list):
         
-        for rr in zone_rr_list:
-            
-            # Generate ordername content
-            name_parts = rr.name.split('.')
-            ordername_content_parts = name_parts[:-3]
-            ordername_content_parts.reverse()
-            ordername_content = ' '.join(ordername_content_parts)
-                
-            if rr.name in delegated_names_list:
-            
-                # Set ordername=NULL for A & AAAA records of delegated names (glue)
-                if rr.type in ('A', 'AAAA'):
-                    rr.ordername = None
-                
-                # Fill ordername for: Delegation NS records
-                elif rr.type == 'NS':
-                    rr.ordername = ordername_content
-            
-            # Fill ordername for: All auth=1 records
-            if rr.auth:
-                rr.ordername = ordername_content
+        # ORDERNAME field management
         
-    else:
-        # NSEC3 Mode
-        try:
-            nsec3narrow = DomainMetadata.objects.get(
-                domain=the_domain, kind='NSEC3NARROW')
-        except DomainMetadata.DoesNotExist:
+        if not is_nsec3:
+            # NSEC Mode
+            # Fill ordername for: delegation NS records and all auth=1 records.
+            # Set ordername=NULL for A & AAAA records of delegated names (glue)
+            if auth or rr_type == 'NS':
+                name_parts = (rr_name or '').split('.')
+                ordername_content_parts = name_parts[:-3]
+                ordername_content_parts.reverse()
+                ordername = ' '.join(ordername_content_parts)
+            else:
+                ordername = None
+        elif not is_nsec3_narrow:
             # NSEC3 'Non-Narrow', 'Opt-out' mode
-            for rr in zone_rr_list:
-                if rr.auth:
-                    rr.ordername = pdnssec_hash_zone_record(rr.domain.name , rr.name)
-                else:
-                    rr.ordername = None
+            if auth:
+                ordername = nsec3_hashes[rr_name]
+            else:
+                ordername = None
         else:
             # NSEC3 'Narrow' Mode
-            for rr in zone_rr_list:
-                rr.ordername=''
-    
-    
-    # Save the records
+            ordername = ''
+        
+        if (auth, ordername) != (rr_auth, rr_ordername):
+            changes.setdefault((auth, ordername), []).append(rr_id)
+    
+    # Save the changes
+    # Only the records whose ``auth`` or ``ordername`` fields have changed are
+    # updated. Records that share the same new values are updated by a single
+    # UPDATE statement. ``Record.save()`` is not used, so ``date_modified`` and
+    # ``change_date`` are not affected.
     # Since this is an internal maintenance function, the serial of the zone
     # is not updated.
-    for rr in zone_rr_list:
-        rr.save()
+    db = router.db_for_write(Record)
+    batch_size = settings.PDNS_BULK_UPDATE_BATCH_SIZE
+    with commit_on_success_unless_managed(using=db):
+        for (auth, ordername), rr_ids in changes.items():
+            for i in range(0, len(rr_ids), batch_size):
+                Record.objects.filter(id__in=rr_ids[i:i+batch_size]).update(
+                    auth=auth, ordername=ordername)
 
 
 
@@ -880,25 +1671,34 @@ def pdnssec_hash_zone_record(zone_name, record_name):
       1 is SHA-1.
 
       2-255 Available for assignment.
+    
+    Important
+    ---------
+    The NSEC3PARAM metadata of the zone is retrieved from the database on
+    every call. When many names of the same zone need to be hashed, use a
+    ``Nsec3Hasher`` instance instead.
+    
     """
+    return Nsec3Hasher.for_zone(zone_name).hash_name(record_name)
+
+
+def nsec3_hash(record_name, salt, iterations):
+    """Returns the NSEC3 hash of ``record_name``.
     
-    Domain = cache.get_model('powerdns_manager', 'Domain')
-    DomainMetadata = cache.get_model('powerdns_manager', 'DomainMetadata')
+    salt: the binary salt (not the hex representation)
+    iterations: the number of additional iterations (integer)
     
-    the_domain = Domain.objects.get(name__exact=zone_name)
-    nsec3param = DomainMetadata.objects.get(domain=the_domain, kind='NSEC3PARAM')
-    algo, flags, iterations, salt = nsec3param.content.split()
+    The hash is returned as a lowercase base32hex encoded string, as required
+    by PowerDNS. See ``pdnssec_hash_zone_record()`` for more information.
     
+    """
     # dns.name.NAME expects an absolute name (with trailing dot)
     record_name = '%s.' % record_name.rstrip('.')
     record_name = Name(record_name.split('.'))
     
-    # Prepare salt
-    salt = salt.decode('hex')
-    
     hashed_name = sha1hash(record_name.to_digestable(), salt)
     i = 0
-    while i < int(iterations):
+    while i < iterations:
         hashed_name = sha1hash(hashed_name, salt)
         i += 1
     
@@ -910,3 +1710,108 @@ def pdnssec_hash_zone_record(zone_name, record_name):
     return final_data.lower()
 
 
+class Nsec3Hasher(object):
+    """Calculates the NSEC3 hashes of the names of a zone.
+    
+    The NSEC3 parameters are set once, when the hasher is created. Use
+    ``Nsec3Hasher.for_zone()`` to create a hasher using the NSEC3PARAM
+    metadata of a zone.
+    
+    Calculated hashes are memoized per owner name, so names that appear in
+    many resource record sets are hashed only once.
+    
+    Hashing is CPU-bound. When ``hash_names()`` has to hash at least
+    ``parallel_threshold`` new names and ``workers`` is greater than 1, the
+    names are hashed in chunks by a pool of ``workers`` processes. The
+    defaults are set by the ``PDNS_NSEC3_HASH_WORKERS`` and
+    ``PDNS_NSEC3_PARALLEL_THRESHOLD`` settings.
+    
+    Usage::
+    
+        hasher = Nsec3Hasher.for_zone('example.org')
+        hasher.hash_name('www.example.org')
+        hasher.hash_names(['example.org', 'www.example.org'])
+    
+    """
+    def __init__(self, salt, iterations, workers=None, parallel_threshold=None):
+        """
+        salt: the salt in the NSEC3PARAM presentation format (hex digits or '-')
+        iterations: the number of additional iterations
+        workers: the number of worker processes used by ``hash_names()``
+        parallel_threshold: the minimum number of names hashed in parallel
+        
+        """
+        if salt == '-':
+            salt = ''
+        self.salt = salt.decode('hex')
+        self.iterations = int(iterations)
+        if workers is None:
+            workers = settings.PDNS_NSEC3_HASH_WORKERS
+        self.workers = workers
+        if parallel_threshold is None:
+            parallel_threshold = settings.PDNS_NSEC3_PARALLEL_THRESHOLD
+        self.parallel_threshold = parallel_threshold
+        self._hashes = {}
+    
+    @classmethod
+    def for_zone(cls, zone):
+        """Returns a hasher for ``zone``.
+        
+        zone: the zone origin (string) or a ``Domain`` instance
+        
+        The NSEC3PARAM metadata of the zone is retrieved from the database.
+        
+        """
+        DomainMetadata = cache.get_model('powerdns_manager', 'DomainMetadata')
+        
+        if isinstance(zone, basestring):
+            nsec3param = DomainMetadata.objects.get(domain__name__exact=zone, kind='NSEC3PARAM')
+        else:
+            nsec3param = DomainMetadata.objects.get(domain=zone, kind='NSEC3PARAM')
+        algo, flags, iterations, salt = nsec3param.content.split()
+        return cls(salt, iterations)
+    
+    def _memo_key(self, record_name):
+        # Owner names are compared in lowercase and without trailing dot
+        return record_name.rstrip('.').lower()
+    
+    def hash_name(self, record_name):
+        """Returns the NSEC3 hash of ``record_name``."""
+        key = self._memo_key(record_name)
+        try:
+            return self._hashes[key]
+        except KeyError:
+            hashed_name = nsec3_hash(key, self.salt, self.iterations)
+            self._hashes[key] = hashed_name
+            return hashed_name
+    
+    def hash_names(self, record_names):
+        """Returns a dictionary mapping each of ``record_names`` to its hash."""
+        record_names = list(record_names)
+        
+        # Unique names that have not been hashed yet
+        new_keys = list(set([self._memo_key(name) for name in record_names]
+            ).difference(self._hashes))
+        
+        if self.workers > 1 and len(new_keys) >= self.parallel_threshold:
+            # Split the names in a few chunks per worker process, so that the
+            # work is evenly distributed while the IPC overhead stays low.
+            chunk_size = len(new_keys) // (self.workers * 4) + 1
+            chunks = [(new_keys[i:i+chunk_size], self.salt, self.iterations)
+                for i in range(0, len(new_keys), chunk_size)]
+            pool = multiprocessing.Pool(processes=self.workers)
+            try:
+                results = pool.map(_nsec3_hash_chunk, chunks)
+            finally:
+                pool.close()
+                pool.join()
+            for (keys, salt, iterations), hashed_names in zip(chunks, results):
+                self._hashes.update(zip(keys, hashed_names))
+        
+        return dict([(name, self.hash_name(name)) for name in record_names])
+
+
+def _nsec3_hash_chunk(args):
+    """Hashes a chunk of names in a worker process of ``Nsec3Hasher``."""
+    record_names, salt, iterations = args
+    return [nsec3_hash(name, salt, iterations) for name in record_names]
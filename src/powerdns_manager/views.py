@@ -35,18 +35,29 @@ from django.http import HttpResponse
 from django.http import HttpResponseNotAllowed
 from django.http import HttpResponseBadRequest
 from django.http import HttpResponseNotFound
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5. HttpResponse consumes iterators lazily.
+    StreamingHttpResponse = HttpResponse
 from django.db.models.loading import cache
 from django.utils.html import mark_safe
 from django.core.validators import validate_ipv4_address
 from django.core.validators import validate_ipv6_address
 from django.core.exceptions import ValidationError
 
+from powerdns_manager import settings
 from powerdns_manager.forms import ZoneImportForm
 from powerdns_manager.forms import AxfrImportForm
 from powerdns_manager.forms import DynamicIPUpdateForm
 from powerdns_manager.utils import process_zone_file
 from powerdns_manager.utils import process_axfr_response
 from powerdns_manager.utils import generate_zone_file
+from powerdns_manager.utils import iter_zone_file
+from powerdns_manager.utils import update_dynamic_zone_ips
+from powerdns_manager.utils import get_dynamic_rr_ips
+from powerdns_manager.utils import dynamic_rrs_exist
+from powerdns_manager.update_queue import dynamic_update_queue
 
 
 
@@ -113,8 +124,23 @@ def import_axfr_view(request):
 
 
 
+def _user_can_access_origin(user, origin):
+    """Returns True if ``user`` may manage the zone ``origin``.
+    
+    Superusers may manage all zones. Other users may manage the zones they
+    have created.
+    
+    """
+    if user.is_superuser:
+        return True
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    return Domain.objects.filter(name=origin, created_by=user).exists()
+
+
 @login_required
 def export_zone_view(request, origin):
+    if not _user_can_access_origin(request.user, origin):
+        return HttpResponseNotFound('Zone not found: %s' % origin)
     info_dict = {
         'zone_text': generate_zone_file(origin),
         'origin': origin,
@@ -124,6 +150,27 @@ def export_zone_view(request, origin):
 
 
 
+@login_required
+def export_zone_file_view(request, origin):
+    """Streams the zone file of the zone with the provided origin.
+    
+    The zone file is generated incrementally while it is sent to the client,
+    so the memory usage does not depend on the size of the zone.
+    
+    """
+    Domain = cache.get_model('powerdns_manager', 'Domain')
+    if not _user_can_access_origin(request.user, origin):
+        return HttpResponseNotFound('Zone not found: %s' % origin)
+    try:
+        zone_file_lines = iter_zone_file(origin)
+    except Domain.DoesNotExist:
+        return HttpResponseNotFound('Zone not found: %s' % origin)
+    response = StreamingHttpResponse(zone_file_lines, content_type='text/plain')
+    response['Content-Disposition'] = 'attachment; filename=%s.zone' % origin.replace('/', '_')
+    return response
+
+
+
 @csrf_exempt
 def dynamic_ip_update_view(request):
     """
@@ -169,19 +216,11 @@ def dynamic_ip_update_view(request):
     
     # Gather required information
     
-    # API key
-    
-    api_key = form.cleaned_data['api_key']
-    
     # Hostname
     
-    hostname = form.cleaned_data['hostname']
-    
     # If the hostname is missing, the IP addresses of all A and AAAA records
     # of the zone are updated.
-    update_all_hosts_in_zone = False
-    if not hostname:
-        update_all_hosts_in_zone = True
+    hostname = form.cleaned_data['hostname']
     
     # IP addresses
     
@@ -197,64 +236,32 @@ def dynamic_ip_update_view(request):
     
     # All required data is good. Process the request.
     
-    DynamicZone = cache.get_model('powerdns_manager', 'DynamicZone')
     Record = cache.get_model('powerdns_manager', 'Record')
     
-    # Get the relevant dynamic zone instance
-    dyn_zone = DynamicZone.objects.get(api_key__exact=api_key)
-    
-    # Get A and AAAA records
-    dyn_rrs = Record.objects.filter(domain=dyn_zone.domain, type__in=('A', 'AAAA'))
-    if not dyn_rrs:
-        return HttpResponseNotFound('A or AAAA resource records not found')
-    
-    # Check existence of hostname
-    if hostname:
-        hostname_exists = False
-        for rr in dyn_rrs:
-            if rr.name == hostname:
-                hostname_exists = True
-                break
-        if not hostname_exists:
-            return HttpResponseNotFound('error:Hostname not found: %s' % hostname)
-    
-    # Update the IPs
-    
-    rr_has_changed = False
+    # The domain of the dynamic zone has been looked up by the form.
+    domain_id = form.domain_id
     
-    if update_all_hosts_in_zone:    # No hostname supplied
-        for rr in dyn_rrs:
-            
-            # Try to update A records
-            if rr.type == 'A' and ipv4:
-                rr.content = ipv4
-                rr_has_changed = True
-            
-            # Try to update AAAA records
-            elif rr.type == 'AAAA' and ipv6:
-                rr.content = ipv6
-                rr_has_changed = True
-            
-            rr.save()
-        
-    else:    # A hostname is supplied
-        for rr in dyn_rrs:
-            if rr.name == hostname:
-                
-                # Try to update A records
-                if rr.type == 'A' and ipv4:
-                    rr.content = ipv4
-                    rr_has_changed = True
-            
-                # Try to update AAAA records
-                elif rr.type == 'AAAA' and ipv6:
-                    rr.content = ipv6
-                    rr_has_changed = True
-                
-                rr.save()
+    if settings.PDNS_DYNAMIC_UPDATE_QUEUE:
+        # Queue the updates. They are written to the database later.
+        rr_ips = get_dynamic_rr_ips(ipv4, ipv6)
+        rr_found = dynamic_rrs_exist(domain_id, hostname, rr_ips)
+        if rr_found:
+            for rr_type, rr_ip in rr_ips:
+                dynamic_update_queue.put(domain_id, hostname, rr_type, rr_ip)
+    else:
+        # Update the IPs. Only the records whose IP has changed are written.
+        rr_found, rr_changed = update_dynamic_zone_ips(
+            domain_id, hostname=hostname, ipv4=ipv4, ipv6=ipv6)
     
-    if rr_has_changed:
+    if rr_found:
         return HttpResponse('Success')
+    
+    # Find out why no resource record has been updated
+    dyn_rrs = Record.objects.filter(domain__id=domain_id, type__in=('A', 'AAAA'))
+    if not dyn_rrs.exists():
+        return HttpResponseNotFound('A or AAAA resource records not found')
+    elif hostname and not dyn_rrs.filter(name=hostname).exists():
+        return HttpResponseNotFound('error:Hostname not found: %s' % hostname)
     else:
         return HttpResponseNotFound('error:No suitable resource record found')
 